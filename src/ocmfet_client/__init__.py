@@ -4,13 +4,10 @@ Fabio Terranova - 2023
 Client for the OCMFET acquisition system developed by Elbatech
 """
 
+import logging
 import sys
 
-import pyqtgraph as pg
 import yaml
-from PyQt5.QtWidgets import QApplication
-
-from ocmfet_client.gui.dialogs.SplashDialog import SplashDialog
 
 __version__ = "2.5.0"
 author = "Fabio Terranova"
@@ -22,14 +19,44 @@ def config_pyqtgraph():
     """
     PyQtGraph configuration
     """
+    import pyqtgraph as pg
+
     pg.setConfigOptions(background="w", foreground="k", leftButtonPan=False)
 
 
 def cli():
-    # Configure PyQtGraph
-    config_pyqtgraph()
-
-    # Run Qt GUI
+    # The headless acquisition does not need Qt
+    if "--headless" in sys.argv:
+        from ocmfet_client.headless import main
+
+        sys.exit(main(sys.argv))
+
+    # Report of the imports and of the time to the splash
+    if "--profile-startup" in sys.argv:
+        from ocmfet_client.utils.startup import profile_startup
+
+        budget = None
+        if "--budget" in sys.argv:
+            try:
+                budget = float(sys.argv[sys.argv.index("--budget") + 1])
+            except (IndexError, ValueError):
+                print(
+                    "usage: ocmfet_client --profile-startup [--budget MS]",
+                    file=sys.stderr,
+                )
+                sys.exit(2)
+        sys.exit(profile_startup(budget=budget))
+
+    # The reports of the windows (e.g., the replay statistics) are logged to stderr
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    from PyQt5.QtWidgets import QApplication
+
+    from ocmfet_client.gui.dialogs.SplashDialog import SplashDialog
+
+    # Run Qt GUI (PyQtGraph is configured when a window needs it)
     app = QApplication([])
     splash = SplashDialog(version=__version__, title=win_title)
 
@@ -40,6 +67,16 @@ def cli():
             config_file = sys.argv[idx + 1]
             splash.config = yaml.safe_load(open(config_file))
 
+        # Capture and replay of the datagrams
+        for option, key, type_ in [
+            ("--capture", "capture_file", str),
+            ("--replay", "replay_file", str),
+            ("--speed", "replay_speed", float),
+        ]:
+            if option in sys.argv:
+                idx = sys.argv.index(option)
+                splash.config[key] = type_(sys.argv[idx + 1])
+
         if "-l" in sys.argv:
             splash.open_live()
         elif "-o" in sys.argv:
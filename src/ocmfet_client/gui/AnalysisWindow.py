@@ -1,5 +1,6 @@
 import os
 
+import pyqtgraph as pg
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import (
     QComboBox,
@@ -7,16 +8,21 @@ from PyQt5.QtWidgets import (
     QGridLayout,
     QLabel,
     QMainWindow,
+    QMessageBox,
     QPushButton,
     QWidget,
 )
 
+from ocmfet_client.gui.widgets.Memory import MemoryLabel
 from ocmfet_client.gui.widgets.MultiGraph import MultiGraphWidget
-from ocmfet_client.network.listeners import DataReader
-from ocmfet_client.utils.processing import DataProcessor
+from ocmfet_client.utils.memory import MemoryBudgetError, memory
+from ocmfet_client.utils.processing import ADC_LSB, DataProcessor
+from ocmfet_client.utils.recording import open_recording
 
 
 class AnalysisWindow(QMainWindow):
+    LOAD_SAMPLES = 1 << 18  # Samples per channel read at once
+
     def __init__(self, title, config):
         super().__init__()
 
@@ -24,8 +30,19 @@ class AnalysisWindow(QMainWindow):
         self.channels = config["channels"]
         self.fs = config["sample_rate"]
         self.tr = config["time_range"]
-
-        self.data_processor = DataProcessor(len(self.channels), self.fs, self.tr)
+        self.buffer_dtype = config.get("buffer_dtype", "float64")
+
+        memory.configure(config)
+        self.data_processor = DataProcessor(
+            len(self.channels),
+            self.fs,
+            self.tr,
+            dtype=self.buffer_dtype,
+            lsb=[ch.get("lsb", ADC_LSB) for ch in self.channels],
+            budget=memory,
+            name="analysis",
+        )
+        self.tag_lines = []
 
         self.initUI()
 
@@ -65,6 +82,9 @@ class AnalysisWindow(QMainWindow):
         self.central_widget.setLayout(self.layout)
         self.setCentralWidget(self.central_widget)
 
+        self.memory_label = MemoryLabel(self)
+        self.statusBar().addPermanentWidget(self.memory_label)
+
     def update_data(self, data):
         self.data_processor.update_data(data)
         self.multi_graph.update_curves(self.data_processor.get_data())
@@ -74,16 +94,62 @@ class AnalysisWindow(QMainWindow):
         f_name = os.path.basename(file)
         self.name_label.setText(f_name)
 
-        with open(file, "rb") as f:
-            f_size = f.seek(0, 2)
-            f.seek(0, 0)
-            time = f_size / 4 / self.fs / 1e3
-            self.multi_graph.change_time_range(time)
-            self.data_processor.change_max_time(time)
-
-        self.data_reader = DataReader(file)
-        self.data_reader.data_read.connect(self.update_data)
-        self.data_reader.run()
+        # The .ocm files store their sample rate, the legacy .bin files use the configured one
+        reader = open_recording(file, len(self.channels), self.fs)
+        k = self.decimation(reader)
+        if k > 1:
+            self.name_label.setText(f"{f_name} (1:{k})")
+        fs = reader.fs / k
+        # The samples of the previous file are not kept through the resize
+        self.data_processor.clear_data()
+        try:
+            if fs * 1e3 != self.data_processor.fs:
+                self.data_processor.change_fs(fs)
+            self.data_processor.change_max_time(reader.duration)
+        except MemoryBudgetError as e:
+            QMessageBox.warning(self, "Memory budget", str(e))
+            return
+        self.multi_graph.change_sample_rate(fs)
+        self.multi_graph.change_time_range(reader.duration)
+
+        # The file is loaded in blocks, so only the buffer (in its storage type) holds it whole
+        step = max(self.LOAD_SAMPLES // k, 1) * k
+        for start in range(0, reader.n_samples, step):
+            block = reader.read(start, start + step)
+            if k > 1:
+                m = block.shape[1] // k
+                block = block[:, : m * k].reshape(len(block), m, k).mean(axis=2)
+            self.data_processor.update_data(block.T.ravel())
+        self.multi_graph.update_curves(self.data_processor.get_data())
+        self.show_tags(reader)
+
+    def decimation(self, reader):
+        """
+        Return the decimation of the recording needed to fit it in the memory budget, when the
+        buffer is degraded and the recording does not fit even stored as int16.
+        """
+        if memory.policy != "degrade":
+            return 1
+        available = memory.available(exclude=("analysis raw", "analysis filtered"))
+        per_sample = self.data_processor.required(1, "int16")
+        if reader.n_samples * per_sample <= available:
+            return 1
+        k = -(-reader.n_samples * per_sample // max(available, 1))  # Rounded up
+        memory.report("analysis", f"recording decimated 1:{k}")
+        return k
+
+    def show_tags(self, reader):
+        for pi, line in self.tag_lines:
+            pi.removeItem(line)
+        self.tag_lines = []
+
+        for sample, text in reader.tags:
+            for pi in self.multi_graph.plot_items:
+                line = pg.InfiniteLine(
+                    sample / reader.fs / 1e3, label=text, labelOpts={"position": 0.9}
+                )
+                pi.addItem(line)
+                self.tag_lines.append((pi, line))
 
     def open_folder(self):
         # Open file dialog
@@ -93,7 +159,7 @@ class AnalysisWindow(QMainWindow):
             files = [
                 os.path.join(folder, file)
                 for file in os.listdir(folder)
-                if file.endswith(".bin")
+                if file.endswith((".bin", ".ocm"))
             ]
             self.files_combo.clear()
             self.files_combo.addItems(files)
@@ -103,7 +169,7 @@ class AnalysisWindow(QMainWindow):
     def open_file(self):
         # Open file dialog
         file, _ = QFileDialog.getOpenFileName(
-            self, "Open file", "", "Binary files (*.bin)"
+            self, "Open file", "", "Recordings (*.ocm *.bin)"
         )
 
         if file:
@@ -134,3 +200,7 @@ class AnalysisWindow(QMainWindow):
         ax.yaxis.set_major_formatter(EngFormatter())
 
         plt.show()
+
+    def closeEvent(self, event):
+        self.data_processor.release()
+        event.accept()
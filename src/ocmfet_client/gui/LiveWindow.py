@@ -1,3 +1,5 @@
+import logging
+
 from PyQt5.QtCore import QTimer
 from PyQt5.QtWidgets import (
     QCheckBox,
@@ -17,9 +19,20 @@ from PyQt5.QtWidgets import (
 
 from ocmfet_client.gui.dialogs.PlotDialog import PlotDialog
 from ocmfet_client.gui.widgets.Controller import ControllerDialog
+from ocmfet_client.gui.widgets.Memory import MemoryLabel
 from ocmfet_client.gui.widgets.Messanger import Messanger
+from ocmfet_client.network.broadcast import BroadcastServer
+from ocmfet_client.network.aio import AsyncMsgDataClient, LoopThread
+from ocmfet_client.network.multiboard import MultiBoardClient
+from ocmfet_client.network.shm import SharedRingPublisher
 from ocmfet_client.network.udp import MsgDataClient
 from ocmfet_client.utils.formatting import s2hhmmss
+from ocmfet_client.utils.memory import memory
+from ocmfet_client.utils.metrics import metrics
+from ocmfet_client.utils.processing import design_filters
+from ocmfet_client.utils.storage import StreamRecorder
+
+logger = logging.getLogger("ocmfet_client.live")
 
 
 class LiveWindow(QMainWindow):
@@ -45,26 +58,92 @@ class LiveWindow(QMainWindow):
         self.max_record_time = config["max_record_time"]
         self.bandpass = config["bandpass"]
         self.notch = config["notch"]
+        self.metrics_file = config.get("metrics_file")
+        self.record_dir = config.get("record_dir", "recordings")
+        self.fsync = config.get("fsync", "rollover")
+        self.record_format = config.get("record_format", "ocm")
+        self.recorder = None
+        self.shm_name = config.get("shm_name")
+        self.shm_seconds = config.get("shm_seconds", 10)
+        self.publisher = None
+        self.broadcast_port = config.get("broadcast_port")
+        self.broadcast_host = config.get("broadcast_host", "0.0.0.0")
+        self.broadcast_queue = config.get("broadcast_queue", 64)
+        self.broadcast_filters = config.get("broadcast_filters", [])
+        self.broadcast = None
 
         # Status flags
         self.recording = False
         self.paused = False
         self.streaming = False
 
-        self.udp_client = MsgDataClient(
-            self.server_ip,
-            self.msg_port,
-            self.data_port,
-            config["BUF_LEN"],
-            self.n_channels * int(self.fs * self.time_range) * 100,
+        self.loop_thread = None
+        if config.get("boards"):
+            self.udp_client = MultiBoardClient(
+                config["boards"],
+                self.fs,
+                config["BUF_LEN"],
+                self.n_channels * int(self.fs * self.time_range) * 100,
+                max_skew=config.get("board_max_skew", 0.5),
+                batch_separator=config.get("sweep_batch_separator"),
+            )
+        elif config.get("transport", "threads") == "asyncio" and not config.get(
+            "replay_file"
+        ):
+            self.loop_thread = LoopThread(parent=self)
+            self.loop_thread.start()
+            self.udp_client = AsyncMsgDataClient(
+                self.server_ip,
+                self.msg_port,
+                self.data_port,
+                config["BUF_LEN"],
+                self.n_channels * int(self.fs * self.time_range) * 100,
+                loop=self.loop_thread.loop,
+            )
+        else:
+            self.udp_client = MsgDataClient(
+                self.server_ip,
+                self.msg_port,
+                self.data_port,
+                config["BUF_LEN"],
+                self.n_channels * int(self.fs * self.time_range) * 100,
+                replay=config.get("replay_file"),
+                speed=config.get("replay_speed", 1.0),
+            )
+        self.udp_client.commands.timeout = config.get("command_timeout", 1.0)
+        self.udp_client.commands.retries = config.get("command_retries", 2)
+        self.udp_client.commands.use_ids = config.get("command_ids", False)
+        if config.get("sweep_batch_separator") and not config.get("command_ids"):
+            logger.warning(
+                "sweep_batch_separator requires command_ids, the sweep commands are sent one "
+                "per datagram"
+            )
+        if config.get("replay_file"):
+            self.win_title += f" (replay of {config['replay_file']})"
+        elif config.get("capture_file"):
+            self.udp_client.start_capture(config["capture_file"])
+
+        self.msg_widget = Messanger(
+            config["commands"],
+            self.udp_client,
+            self,
+            max_lines=config.get("console_max_lines", 5000),
+            log_file=config.get("console_log_file"),
+            log_max_bytes=config.get("console_log_max_bytes", 10 << 20),
+            log_backups=config.get("console_log_backups", 5),
         )
 
-        self.msg_widget = Messanger(config["commands"], self.udp_client, self)
-
+        memory.configure(config)
         self.plot_dialog = PlotDialog(config, self.udp_client.data_listener, self)
 
         self.ocmfet_dialog = ControllerDialog(
-            [ch for ch in self.channels if ch["type"] >= 1], self.udp_client, self
+            [ch for ch in self.channels if ch["type"] >= 1],
+            self.udp_client,
+            self,
+            data_processor=self.plot_dialog.data_processer,
+            data_channels=[i for i, ch in enumerate(self.channels) if ch["type"] >= 1],
+            tag=self.tag,
+            batch_separator=config.get("sweep_batch_separator"),
         )
 
         self.initUI()
@@ -115,6 +194,11 @@ class LiveWindow(QMainWindow):
         self.timer_checkbox.setChecked(True)
         self.timer_checkbox.stateChanged.connect(self.timer_spin_box.setEnabled)
 
+        self.client_record_checkbox = QCheckBox("Client-side copy", self)
+        self.client_record_checkbox.setToolTip(
+            f"Also record the live stream on this computer (in {self.record_dir})"
+        )
+
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.update_timer)
         self.elapsed_time = 0
@@ -155,6 +239,7 @@ class LiveWindow(QMainWindow):
         self.rec_layout.addWidget(self.timer_spin_box, 0, 1)
         self.rec_layout.addWidget(self.max_record_time_label, 1, 0)
         self.rec_layout.addWidget(self.max_record_time_spin_box, 1, 1)
+        self.rec_layout.addWidget(self.client_record_checkbox, 2, 0, 1, 2)
         self.time_layout = QHBoxLayout()
         self.time_layout.addStretch()
         self.time_layout.addWidget(self.recording_time_label)
@@ -170,7 +255,37 @@ class LiveWindow(QMainWindow):
         self.central_widget.setLayout(self.layout)
         self.setCentralWidget(self.central_widget)
 
+        self.memory_label = MemoryLabel(self)
+        self.statusBar().addPermanentWidget(self.memory_label)
+
     def startup(self):
+        if self.shm_name:
+            self.publisher = SharedRingPublisher(
+                self.shm_name,
+                self.n_channels,
+                self.fs,
+                self.shm_seconds,
+                [ch["name"] for ch in self.channels],
+            )
+            self.udp_client.data_listener.add_sink(self.publisher.write)
+
+        if self.broadcast_port is not None:
+            self.broadcast = BroadcastServer(
+                self.broadcast_port,
+                self.n_channels,
+                self.fs,
+                [ch["name"] for ch in self.channels],
+                host=self.broadcast_host,
+                queue_size=self.broadcast_queue,
+                filters=design_filters(
+                    self.fs,
+                    self.bandpass if "bandpass" in self.broadcast_filters else None,
+                    self.notch if "notch" in self.broadcast_filters else None,
+                ),
+                filter_names=self.broadcast_filters,
+            )
+            self.udp_client.data_listener.add_sink(self.broadcast.write)
+
         self.plot_dialog.show()
         self.udp_client.start_listening()
         self.send_command("start")
@@ -208,7 +323,8 @@ class LiveWindow(QMainWindow):
             self.send_command("rec")
 
     def send_command(self, command):
-        self.udp_client.send_message(command)
+        # The commands of the window (e.g., rec and save) are not idempotent
+        self.udp_client.commands.send(command, retries=0)
 
     def send_user_command(self):
         command = self.line_edit.toPlainText()
@@ -220,6 +336,8 @@ class LiveWindow(QMainWindow):
                 self.pause_timer()
                 self.send_command("pause")
                 self.paused = True
+                if self.recorder:
+                    self.udp_client.data_listener.remove_sink(self.recorder.write)
 
                 self.playpause_button.setIcon(
                     self.style().standardIcon(QStyle.SP_MediaPlay)
@@ -229,6 +347,8 @@ class LiveWindow(QMainWindow):
                 self.start_timer()
                 self.send_command("resume")
                 self.paused = False
+                if self.recorder:
+                    self.udp_client.data_listener.add_sink(self.recorder.write)
 
                 self.playpause_button.setIcon(
                     self.style().standardIcon(QStyle.SP_MediaPause)
@@ -240,20 +360,50 @@ class LiveWindow(QMainWindow):
             self.start_timer()
             self.send_command("rec")
             self.recording = True
+            if self.client_record_checkbox.isChecked():
+                self.start_client_recording()
 
             self.record_button.setIcon(
                 self.style().standardIcon(QStyle.SP_DialogSaveButton)
             )
             self.tag_button.setEnabled(True)
             self.playpause_button.setEnabled(True)
+            self.client_record_checkbox.setEnabled(False)
         else:  # Stop recording
             self.stop_timer()
             self.recording = False
             self.save_recording()
+            self.stop_client_recording()
 
             self.record_button.setIcon(self.style().standardIcon(QStyle.SP_MediaPlay))
             self.tag_button.setEnabled(False)
             self.playpause_button.setEnabled(False)
+            self.client_record_checkbox.setEnabled(True)
+
+    def start_client_recording(self):
+        """
+        Start recording the live stream on the client, with the same name and file duration of
+        the server-side recording.
+        """
+        name = self.name_line_edit.text() or "data"
+        self.recorder = StreamRecorder(
+            self.record_dir,
+            name,
+            self.n_channels,
+            self.fs,
+            self.max_record_time_spin_box.value(),
+            self.fsync,
+            channels=self.channels,
+            format=self.record_format,
+        )
+        self.recorder.start()
+        self.udp_client.data_listener.add_sink(self.recorder.write)
+
+    def stop_client_recording(self):
+        if self.recorder:
+            self.udp_client.data_listener.remove_sink(self.recorder.write)
+            self.recorder.stop()
+            self.recorder = None
 
     def save_recording(self):
         name = "data"
@@ -266,10 +416,36 @@ class LiveWindow(QMainWindow):
         if tag == "":
             tag = "tag"
 
-        self.send_command(f"tag {tag}")
+        self.tag(tag)
+
+    def tag(self, text):
+        """
+        Tag the server-side and the client-side recordings.
+        """
+        self.send_command(f"tag {text}")
+        if self.recorder:
+            self.recorder.tag(text)
 
     def closeEvent(self, event):
         self.send_command("stop")
+        self.stop_client_recording()
+        if self.publisher:
+            self.udp_client.data_listener.remove_sink(self.publisher.write)
+            self.publisher.close()
+        if self.broadcast:
+            self.udp_client.data_listener.remove_sink(self.broadcast.write)
+            self.broadcast.close()
+        replay_stats = self.udp_client.replay_stats()
         self.udp_client.close()
+        if self.loop_thread:
+            self.loop_thread.stop()
         self.plot_dialog.close()
+        self.plot_dialog.release()
+        if replay_stats:
+            logger.info(
+                "Replay: {packets} datagrams, {bytes} bytes in {elapsed:.3f} s "
+                "({throughput:.0f} B/s, {rate:.0f} datagrams/s)".format(**replay_stats)
+            )
+        if self.metrics_file:
+            metrics.dump(self.metrics_file)
         event.accept()
@@ -1,74 +1,209 @@
-import json
 import os
+import queue
+import time
 
-import numpy as np
-import pandas as pd
-from PyQt5.QtCore import QSize, QThread, pyqtSignal
+from PyQt5.QtCore import QSize, Qt, QThread, QTimer, pyqtSignal
 from PyQt5.QtGui import QStandardItem, QStandardItemModel
 from PyQt5.QtWidgets import (
     QDialog,
     QFileDialog,
-    QProgressDialog,
+    QHBoxLayout,
+    QLabel,
+    QProgressBar,
+    QPushButton,
     QTreeView,
     QVBoxLayout,
 )
 
-from ocmfet_client.utils.formatting import bytes2samples
+from ocmfet_client.network.transfer import TransferQueue, summarize
+from ocmfet_client.utils.formatting import s2hhmmss, size2string
+from ocmfet_client.utils.storage import NpyWriter, npy2csv
 
 
 class Downloader(QThread):
-    progress = pyqtSignal(int)
+    """
+    Downloader
 
-    def __init__(self, udp_client):
+    Queue of the downloads with the getf command. The downloads share the data port, so they run
+    one at a time, each in the thread of the Downloader: the decoded samples received by the data
+    listener are queued and streamed to an open .npy file, which can be converted in chunks to
+    CSV after the download. The GUI never waits for the network or the disk.
+
+    The queue has the interface of TransferQueue (add, cancel, summary, shutdown), used for the
+    block transfers.
+
+    Parameters
+    ----------
+    udp_client : MsgDataClient
+        UDP client connected to the server
+
+    n_channels : scalar
+        Number of channels of the downloaded files
+
+    Attributes
+    ----------
+    jobs : list
+        List of dictionaries with the path, size, local file, status ("queued", "running",
+        "done", "failed" or "cancelled"), bytes done and statistics of each download
+    """
+
+    downloaded = pyqtSignal(str, dict)
+
+    def __init__(self, udp_client, n_channels=2):
         super().__init__()
         self.udp_client = udp_client
-        self.size_counter = 0
-        self.file_size = 0
+        self.n_channels = n_channels
+        self.jobs = []
+        self.job = None
+        self.t_start = None
         self.old_bytes_to_emit = self.udp_client.data_listener.bytes_to_emit
+        self.queue = queue.Queue()
+        self.finished.connect(self.next_job)
+
+    def add(self, path, size, file):
+        """
+        Queue the download of a file.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file on the server
+
+        size : scalar
+            Size of the file in bytes
+
+        file : str
+            Path of the local file (.npy or .csv)
+
+        Returns
+        -------
+        job : dict
+            The queued job
+        """
+        job = {
+            "path": path,
+            "size": size,
+            "file": file,
+            "status": "queued",
+            "done": 0,
+            "resumed": 0,
+            "stats": {},
+        }
+        self.jobs.append(job)
+        if self.job is None:
+            self.next_job()
+        return job
+
+    def next_job(self):
+        """
+        Start the next queued download, after the end of the running one.
+        """
+        if self.job is not None:
+            self.stop_download()
+            self.job = None
+        for job in self.jobs:
+            if job["status"] == "queued":
+                self.start_download(job)
+                return
+
+    def start_download(self, job):
+        self.job = job
+        job["status"] = "running"
+        if self.t_start is None:
+            self.t_start = time.perf_counter()
 
-    def download_data(self, name, path, size):
-        file_name, _ = QFileDialog.getSaveFileName(
-            self.parent(), "Save file", name + ".csv", "All files (*)"
+        self.file_name = os.path.splitext(job["file"])[0] + ".npy"
+        self.queue = queue.Queue()
+        self.writer = NpyWriter(self.file_name, self.n_channels)
+        self.start()
+
+        self.old_bytes_to_emit = self.udp_client.data_listener.bytes_to_emit
+        self.udp_client.data_listener.set_bytes_to_emit(int(job["size"] / 32))
+        # Queue the samples directly from the listener thread
+        self.udp_client.data_listener.received_data.connect(
+            self.queue.put, Qt.DirectConnection
         )
-        if file_name:
-            if os.path.exists(file_name):
-                os.remove(file_name)
-            pd.DataFrame(columns=["Ch. 1", "Ch. 2"]).to_csv(
-                file_name, index=False, header=True
-            )
-            self.file_size = size
-            self.udp_client.data_listener.set_bytes_to_emit(int(size / 32))
-            self.udp_client.data_listener.start_listening()
-            self.udp_client.send_message(f"getf {path}")
-            self.udp_client.data_listener.received_data.connect(
-                lambda data: self.write_to_file(file_name, data)
-            )
+        self.udp_client.data_listener.start_listening()
+        self.udp_client.commands.send(f"getf {job['path']}", retries=0)
 
     def stop_download(self):
         self.udp_client.data_listener.stop_listening()
         self.udp_client.data_listener.set_bytes_to_emit(self.old_bytes_to_emit)
-        self.udp_client.data_listener.received_data.disconnect()
-
-    def write_to_file(self, file_name, data):
-        with open(file_name, "ab") as file:
-            # write to csv file
-            new_data = np.frombuffer(data, dtype=np.uint8)
-            new_data = [bytes2samples(new_data[::2]), bytes2samples(new_data[1::2])]
-            pd.DataFrame(new_data).to_csv(file, index=False, header=False, mode="a")
-
-        self.size_counter += len(data)
-        self.progress.emit(self.size_counter)
-        print(self.size_counter, self.file_size)
-        if self.size_counter >= self.file_size:
-            self.stop_download()
+        try:
+            self.udp_client.data_listener.received_data.disconnect(self.queue.put)
+        except TypeError:
+            pass
+
+    def cancel(self):
+        """Cancel all the queued and running downloads."""
+        for job in self.jobs:
+            if job["status"] == "queued":
+                job["status"] = "cancelled"
+            elif job["status"] == "running":
+                job["status"] = "cancelled"
+                self.queue.put(None)
+
+    def summary(self):
+        """
+        Return the aggregate progress of the queue (see TransferQueue.summary).
+        """
+        return summarize(self.jobs, self.t_start)
+
+    def shutdown(self):
+        """Cancel the downloads and wait for the running one to stop."""
+        self.cancel()
+        self.wait()
+
+    def run(self):
+        job = self.job
+        size_counter = 0
+        t_start = time.perf_counter()
+        while size_counter < job["size"]:
+            data = self.queue.get()
+            if data is None:
+                break
+
+            self.writer.write(data)
+            size_counter += len(data) * 2  # 2 bytes per sample
+            job["done"] = min(size_counter, job["size"])
+        self.writer.close()
+        elapsed = time.perf_counter() - t_start
+        job["stats"] = {
+            "bytes": size_counter,
+            "elapsed": elapsed,
+            "throughput": size_counter / elapsed if elapsed > 0 else 0.0,
+        }
+        if job["status"] == "cancelled":
+            return
+
+        # Post-download conversion
+        if job["file"].endswith(".csv"):
+            header = [f"Ch. {i + 1}" for i in range(self.n_channels)]
+            npy2csv(self.file_name, job["file"], header)
+            os.remove(self.file_name)
+
+        job["status"] = "done"
+        self.downloaded.emit(job["file"], job["stats"])
 
 
 class DataDialog(QDialog):
-    def __init__(self, udp_client, parent=None):
+    def __init__(
+        self,
+        udp_client,
+        parent=None,
+        n_channels=2,
+        block_transfer=False,
+        concurrency=4,
+    ):
         super().__init__(parent)
         self.udp_client = udp_client
-        self.downloader = Downloader(udp_client)
-        self.json_string = ""
+        self.block_transfer = block_transfer
+        self.concurrency = concurrency
+        self.downloader = Downloader(udp_client, n_channels)
+        self.downloader.downloaded.connect(self.show_download)
+        self.transfer_queue = None
+        self.pending_items = []
+        self.batch_size = 200
         self.columns = ["Name", "Duration", "Last modified"]
         self.init_ui()
 
@@ -84,12 +219,48 @@ class DataDialog(QDialog):
         self.tree.setSortingEnabled(True)
         self.tree.setEditTriggers(QTreeView.NoEditTriggers)
         self.tree.header().setSectionResizeMode(3)
+        self.tree.setSelectionMode(QTreeView.ExtendedSelection)
+        self.tree.setSelectionBehavior(QTreeView.SelectRows)
 
         self.tree.doubleClicked.connect(self.double_click)
 
+        self.status_label = QLabel("Double click on a file to queue its download")
+
+        self.download_button = QPushButton("Download selected", self)
+        self.download_button.setToolTip("Queue the download of the selected files")
+        self.download_button.clicked.connect(self.download_selected)
+        self.cancel_button = QPushButton("Cancel", self)
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.cancel_queue)
+        self.queue_progress = QProgressBar(self)
+        self.queue_progress.setRange(0, 1000)
+        self.queue_progress.setValue(0)
+        self.queue_timer = QTimer(self)
+        self.queue_timer.timeout.connect(self.update_queue)
+
+        self.queue_layout = QHBoxLayout()
+        self.queue_layout.addWidget(self.download_button)
+        self.queue_layout.addWidget(self.queue_progress)
+        self.queue_layout.addWidget(self.cancel_button)
+
         self.layout.addWidget(self.tree)
+        self.layout.addLayout(self.queue_layout)
+        self.layout.addWidget(self.status_label)
         self.setLayout(self.layout)
 
+    def download_queue(self):
+        """
+        Return the queue of the downloads: a TransferQueue with the block transfer, otherwise the
+        Downloader, which runs the getf downloads one at a time.
+        """
+        if not self.block_transfer:
+            return self.downloader
+        if self.transfer_queue is None:
+            self.transfer_queue = TransferQueue(
+                self.udp_client.host, self.udp_client.msg_port, self.concurrency
+            )
+        return self.transfer_queue
+
     def double_click(self, index):
         if self.model.itemFromIndex(index).hasChildren():
             return
@@ -99,54 +270,154 @@ class DataDialog(QDialog):
         path = self.model.itemFromIndex(index.siblingAtColumn(4)).text()
         size = int(self.model.itemFromIndex(index.siblingAtColumn(3)).text())
 
-        self.progress_dialog = QProgressDialog(self)
-        self.progress_dialog.setLabelText(f"Downloading {name}")
-        self.progress_dialog.setRange(0, size)
-        self.downloader.download_data(name, path, size)
-        self.downloader.progress.connect(self.progress_dialog.setValue)
-        self.progress_dialog.exec_()
+        if self.block_transfer:
+            filters = "Binary files (*.bin)"
+            default = name + ".bin"
+        else:
+            filters = "NumPy files (*.npy);;CSV files (*.csv)"
+            default = name + ".npy"
+        file_name, _ = QFileDialog.getSaveFileName(self, "Save file", default, filters)
+        if not file_name:
+            return
+
+        self.download_queue().add(path, size, file_name)
+        self.start_queue()
+
+    def download_selected(self):
+        """
+        Queue the download of the selected files. With the block transfer, the partially
+        downloaded files in the chosen folder are resumed.
+        """
+        rows = []
+        for index in self.tree.selectionModel().selectedRows(0):
+            path = index.siblingAtColumn(4)
+            if self.model.itemFromIndex(index).hasChildren() or not path.isValid():
+                continue
+            rows.append(
+                (
+                    self.model.itemFromIndex(index).text(),
+                    self.model.itemFromIndex(path).text(),
+                    int(self.model.itemFromIndex(index.siblingAtColumn(3)).text()),
+                )
+            )
+        if not rows:
+            return
+
+        folder = QFileDialog.getExistingDirectory(self, "Download to folder")
+        if not folder:
+            return
+
+        ext = ".bin" if self.block_transfer else ".npy"
+        for name, path, size in rows:
+            self.download_queue().add(path, size, os.path.join(folder, name + ext))
+        self.start_queue()
+
+    def start_queue(self):
+        self.cancel_button.setEnabled(True)
+        self.queue_timer.start(500)
+        self.update_queue()
+
+    def update_queue(self):
+        """
+        Show the aggregate progress, throughput and ETA of the download queue.
+        """
+        summary = self.download_queue().summary()
+        if summary["total"]:
+            self.queue_progress.setValue(int(1000 * summary["done"] / summary["total"]))
+
+        status = ", ".join(f"{n} {s}" for s, n in summary["status"].items())
+        eta = s2hhmmss(summary["eta"]) if summary["eta"] is not None else "--:--:--"
+        self.status_label.setText(
+            f"{size2string(summary['done'])}/{size2string(summary['total'])} "
+            f"({size2string(summary['throughput'])}/s, ETA {eta}) - {status}"
+        )
+
+        if not summary["status"].get("queued") and not summary["status"].get("running"):
+            self.queue_timer.stop()
+            self.cancel_button.setEnabled(False)
+
+    def cancel_queue(self):
+        self.download_queue().cancel()
+
+    def show_download(self, file, stats):
+        if "error" in stats:
+            self.status_label.setText(f"Download failed: {stats['error']}")
+        else:
+            self.status_label.setText(
+                f"{os.path.basename(file)}: {size2string(stats['bytes'])} in "
+                f"{stats['elapsed']:.1f} s ({size2string(stats['throughput'])}/s)"
+            )
 
     def populate_tree(self, data):
-        root_item = self.model.invisibleRootItem()
-        self.json_string += data
-        try:
-            json.loads(self.json_string)
-        except json.JSONDecodeError:
+        """
+        Populate the tree with the data listing (already parsed) sent by the server. The top-level
+        items are built detached from the model, and they are added in batches, so the dialog
+        stays responsive with large listings.
+        """
+        if not isinstance(data, dict):
             return
 
-        self.add_data_to_model(root_item, json.loads(self.json_string))
+        self.pending_items = list(data.items())
+        self.tree.setSortingEnabled(False)
+        QTimer.singleShot(0, self.add_batch)
+
+    def add_batch(self):
+        root_item = self.model.invisibleRootItem()
+        batch = self.pending_items[: self.batch_size]
+        self.pending_items = self.pending_items[self.batch_size :]
+
+        for key, value in batch:
+            row = self.make_row(key, value)
+            if row is not None:
+                root_item.appendRow(row)
+                if row[0].hasChildren():
+                    self.tree.setExpanded(row[0].index(), True)
 
-        for i in range(root_item.rowCount()):
-            self.tree.setExpanded(self.model.index(i, 0), True)
+        if self.pending_items:
+            QTimer.singleShot(0, self.add_batch)
+        else:
+            self.tree.setSortingEnabled(True)
 
-    def add_data_to_model(self, item, data):
-        for key, value in data.items():
-            if isinstance(value, dict):
-                parent = QStandardItem(key)
-                item.appendRow(parent)
-                self.add_data_to_model(parent, value)
-            elif isinstance(value, list):
-                items = [QStandardItem(str(key))]
-                items.extend([QStandardItem(str(i)) for i in value])
-                item.appendRow(items)
+    def make_row(self, key, value):
+        """
+        Build the items of a row (and of its children) without adding them to the model.
+        """
+        if isinstance(value, dict):
+            parent = QStandardItem(key)
+            for k, v in value.items():
+                row = self.make_row(k, v)
+                if row is not None:
+                    parent.appendRow(row)
+            return [parent]
+        elif isinstance(value, list):
+            items = [QStandardItem(str(key))]
+            items.extend([QStandardItem(str(i)) for i in value])
+            return items
+        return None
 
     def clear_model(self):
+        self.pending_items = []
         self.model.clear()
         self.model.setHorizontalHeaderLabels(self.columns)
-        self.json_string = ""
 
     def showEvent(self, event):
         if self.parent():
             self.parent().msg_widget.disconnect()
             self.parent().plot_dialog.disconnect()
-        self.udp_client.msg_listener.received_msg.connect(self.populate_tree)
-        self.udp_client.send_message("data")
+        self.udp_client.msg_listener.assembler.reset()
+        self.udp_client.msg_listener.received_json.connect(self.populate_tree)
+        self.udp_client.commands.send("data", retries=0)
         event.accept()
 
     def closeEvent(self, event):
+        self.queue_timer.stop()
+        if self.transfer_queue is not None:
+            self.transfer_queue.shutdown()
+            self.transfer_queue = None
+        self.downloader.shutdown()
         if self.parent():
             self.parent().msg_widget.connect()
             self.parent().plot_dialog.connect()
-        self.udp_client.msg_listener.received_msg.disconnect(self.populate_tree)
+        self.udp_client.msg_listener.received_json.disconnect(self.populate_tree)
         self.clear_model()
         event.accept()
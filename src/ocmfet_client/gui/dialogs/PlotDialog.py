@@ -1,4 +1,6 @@
-from PyQt5.QtCore import Qt
+import numpy as np
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtGui import QFont
 from PyQt5.QtWidgets import (
     QCheckBox,
     QComboBox,
@@ -6,8 +8,11 @@ from PyQt5.QtWidgets import (
     QGridLayout,
     QHBoxLayout,
     QLabel,
+    QMessageBox,
     QPushButton,
     QRadioButton,
+    QScrollBar,
+    QSpinBox,
     QStyle,
     QToolButton,
     QVBoxLayout,
@@ -15,12 +20,19 @@ from PyQt5.QtWidgets import (
 
 from ocmfet_client.gui.widgets.DataProcessing import DataProcessingWidget
 from ocmfet_client.gui.widgets.MultiGraph import (
+    MultiGraphPagedWidget,
     MultiGraphPSDWidget,
     MultiGraphSpectrogramWidget,
+    MultiGraphStackedWidget,
     MultiGraphWidget,
 )
-from ocmfet_client.utils.formatting import s2string
-from ocmfet_client.utils.processing import DataProcessor
+from ocmfet_client.network.multiboard import BoardMerger
+from ocmfet_client.utils.detection import SpikeDetector
+from ocmfet_client.utils.formatting import s2hhmmss, s2string, size2string
+from ocmfet_client.utils.history import TieredHistory
+from ocmfet_client.utils.memory import MemoryBudgetError, memory
+from ocmfet_client.utils.metrics import metrics
+from ocmfet_client.utils.processing import ADC_LSB, DataProcessor
 
 
 class ChannelSelectionDialog(QDialog):
@@ -58,9 +70,7 @@ class ChannelSelectionDialog(QDialog):
         return [i for i, cb in enumerate(self.ch_checkboxes) if cb.isChecked()]
 
     def update_channels(self):
-        self.parent().multi_graph.set_channels(self.get_selected_channels())
-        self.parent().psd_widget.set_channels(self.get_selected_channels())
-        self.parent().spectral_widget.set_channels(self.get_selected_channels())
+        self.parent().set_channels(self.get_selected_channels())
 
     def select_all(self):
         for cb in self.ch_checkboxes:
@@ -74,6 +84,8 @@ class ChannelSelectionDialog(QDialog):
 
 
 class PlotDialog(QDialog):
+    HISTORY_STEP = 0.01  # Step of the history scroll bar in s
+
     def __init__(self, config, data_listener, parent=None):
         super().__init__(parent)
 
@@ -84,8 +96,26 @@ class PlotDialog(QDialog):
         self.time_ranges = config["time_ranges"]
         self.bandpass = config["bandpass"]
         self.notch = config["notch"]
+        self.opengl = config.get("opengl", False)
+        self.page_grid = config.get("page_grid")
+        self.autoscale_hysteresis = config.get("autoscale_hysteresis", 0.25)
+        self.spike_settings = dict(
+            threshold=config.get("spike_threshold", 5),
+            polarity=config.get("spike_polarity", "negative"),
+            refractory=config.get("spike_refractory", 1),
+            snippet=config.get("spike_snippet", (0.5, 1.5)),
+            noise_window=config.get("spike_noise_window", 2),
+            capacity=config.get("spike_events", 10000),
+        )
 
-        self.data_processer = DataProcessor(self.n_channels, self.fs, self.tr)
+        try:
+            self.data_processer = self.make_data_processor(config, self.tr)
+        except MemoryBudgetError:
+            # The configured time range does not fit, start with the shortest one
+            self.tr = min(self.time_ranges)
+            self.data_processer = self.make_data_processor(config, self.tr)
+        # The time range may be shortened to fit in the memory budget
+        self.tr = self.data_processer.max_time
 
         self.processing_widget = DataProcessingWidget(
             self.fs, self.data_processer, self.bandpass, self.notch, self
@@ -95,14 +125,56 @@ class PlotDialog(QDialog):
 
         self.data_listener = data_listener
 
+        # Long history of the session, for the scrollback
+        self.history = None
+        self.history_error = None
+        if config.get("history_hours"):
+            try:
+                self.history = TieredHistory(
+                    self.n_channels,
+                    self.fs,
+                    config["history_hours"],
+                    directory=config.get("history_dir"),
+                    decimation=config.get("history_decimation", 256),
+                    budget=memory,
+                )
+            except MemoryBudgetError as e:
+                self.history_error = str(e)
+            else:
+                self.data_listener.add_sink(self.history.write)
+
         self.init_ui()
 
+    def make_data_processor(self, config, tr):
+        return DataProcessor(
+            self.n_channels,
+            self.fs,
+            tr,
+            dtype=config.get("buffer_dtype", "float64"),
+            lsb=[ch.get("lsb", ADC_LSB) for ch in self.channels],
+            budget=memory,
+            name="live",
+        )
+
+    def time_range_index(self, tr):
+        """Return the index of the longest time range not longer than tr."""
+        return max([i for i, t in enumerate(self.time_ranges) if t <= tr], default=0)
+
     def init_ui(self):
         self.setWindowTitle("Live plotting")
         # add maximize button
         self.setWindowFlags(self.windowFlags() | Qt.WindowMaximizeButtonHint)
 
-        self.multi_graph = MultiGraphWidget(self.channels, self.fs, self.tr, self)
+        # Page the channels through a fixed grid if they do not fit in it
+        self.paged = bool(self.page_grid) and (
+            self.n_channels > self.page_grid[0] * self.page_grid[1]
+        )
+        if self.paged:
+            self.multi_graph = MultiGraphPagedWidget(
+                self.channels, self.fs, self.tr, self.page_grid, self
+            )
+        else:
+            self.multi_graph = MultiGraphWidget(self.channels, self.fs, self.tr, self)
 
         self.psd_widget = MultiGraphPSDWidget(self.channels, self.fs, self.tr, self)
         self.psd_widget.hide()
@@ -112,15 +184,50 @@ class PlotDialog(QDialog):
         )
         self.spectral_widget.hide()
 
+        self.stacked_widget = MultiGraphStackedWidget(
+            self.channels, self.fs, self.tr, opengl=self.opengl, parent=self
+        )
+        self.stacked_widget.hide()
+
         self.glued_checkbox = QCheckBox("Glued")
         self.glued_checkbox.setChecked(True)
         self.glued_checkbox.setToolTip("Glue the plot dialog to the main window")
+        self.stats_checkbox = QCheckBox("Stats")
+        self.stats_checkbox.setToolTip("Show the performance overlay")
+        self.stats_checkbox.stateChanged.connect(self.show_stats)
+
+        # Performance overlay, drawn on top of the plots
+        self.stats_label = QLabel(self)
+        self.stats_label.setFont(QFont("Courier New", 9))
+        self.stats_label.setStyleSheet(
+            "background-color: rgba(255, 255, 255, 200); padding: 4px"
+        )
+        self.stats_label.setAttribute(Qt.WA_TransparentForMouseEvents)
+        self.stats_label.hide()
+        self.stats_timer = QTimer(self)
+        self.stats_timer.timeout.connect(self.update_stats)
         self.timeseries_radio = QRadioButton("Time series")
         self.timeseries_radio.setChecked(True)
         self.timeseries_radio.clicked.connect(self.change_plot)
         self.compact_view_checkbox = QCheckBox("Compact")
         self.compact_view_checkbox.setChecked(False)
         self.compact_view_checkbox.stateChanged.connect(self.multi_graph.set_compact)
+        self.autoscale_checkbox = QCheckBox("Autoscale")
+        self.autoscale_checkbox.setToolTip(
+            "Scale the y axes from the tracked extrema of the data"
+        )
+        self.autoscale_checkbox.stateChanged.connect(self.update_autoscale)
+        self.autoscale_checkbox.setChecked(True)
+        self.spikes_checkbox = QCheckBox("Spikes")
+        self.spikes_checkbox.setToolTip(
+            "Detect the spikes in the filtered samples (threshold of {threshold} times the "
+            "noise) and mark them on the time series".format(**self.spike_settings)
+        )
+        self.spikes_checkbox.stateChanged.connect(self.update_detection)
+        self.compact_view_checkbox.stateChanged.connect(self.stacked_widget.set_compact)
+        self.stacked_radio = QRadioButton("Stacked")
+        self.stacked_radio.setToolTip("Plot all the channels in a single stacked view")
+        self.stacked_radio.clicked.connect(self.change_plot)
         self.psd_radio = QRadioButton("PSD")
         self.psd_radio.clicked.connect(self.change_plot)
         self.spectrogram_radio = QRadioButton("Spectrogram")
@@ -135,24 +242,55 @@ class PlotDialog(QDialog):
         self.time_range_label = QLabel("Time range")
         self.time_range_combo = QComboBox(self)
         self.time_range_combo.addItems([s2string(tr) for tr in self.time_ranges])
-        self.time_range_combo.setCurrentIndex(self.time_ranges.index(self.tr))
+        self.time_range_combo.setCurrentIndex(self.time_range_index(self.tr))
         self.time_range_combo.activated.connect(self.update_time_range)
         self.channel_sel_button = QPushButton("Channels", self)
         self.channel_sel_button.setToolTip("Select channels to plot")
         self.channel_sel_button.clicked.connect(self.channel_selection_dialog.exec_)
+        self.page_label = QLabel("Page")
+        self.page_spin = QSpinBox(self)
+        self.page_spin.setToolTip("Page of channels to plot")
+        self.update_page_range()
+        self.page_spin.valueChanged.connect(self.update_page)
+        self.page_label.setVisible(self.paged)
+        self.page_spin.setVisible(self.paged)
+        self.history_button = QToolButton(self)
+        self.history_button.setText("History")
+        self.history_button.setCheckable(True)
+        self.history_button.setEnabled(self.history is not None)
+        self.history_button.setToolTip(
+            self.history_error
+            or "Freeze the time series and scroll back over the raw history of the session "
+            "(the acquisition continues)"
+        )
+        self.history_button.toggled.connect(self.toggle_history)
+        self.history_bar = QScrollBar(Qt.Horizontal, self)
+        self.history_bar.valueChanged.connect(self.show_history)
+        self.history_bar.hide()
+        self.history_label = QLabel(self)
+        self.history_label.hide()
 
         self.layout = QVBoxLayout()
         self.layout.addWidget(self.multi_graph)
         self.layout.addWidget(self.psd_widget)
         self.layout.addWidget(self.spectral_widget)
+        self.layout.addWidget(self.stacked_widget)
+        self.history_layout = QHBoxLayout()
+        self.history_layout.addWidget(self.history_bar)
+        self.history_layout.addWidget(self.history_label)
+        self.layout.addLayout(self.history_layout)
         self.footer_layout = QHBoxLayout()
         self.footer_layout.addWidget(self.glued_checkbox)
+        self.footer_layout.addWidget(self.stats_checkbox)
         self.footer_layout.addStretch()
         self.freq_layout = QVBoxLayout()
         self.ts_layout = QHBoxLayout()
         self.ts_layout.addWidget(self.timeseries_radio)
         self.ts_layout.addWidget(self.compact_view_checkbox)
+        self.ts_layout.addWidget(self.autoscale_checkbox)
+        self.ts_layout.addWidget(self.spikes_checkbox)
         self.freq_layout.addLayout(self.ts_layout)
+        self.freq_layout.addWidget(self.stacked_radio)
         self.freq_layout.addWidget(self.psd_radio)
         self.freq_layout.addWidget(self.spectrogram_radio)
         self.footer_layout.addLayout(self.freq_layout)
@@ -163,6 +301,9 @@ class PlotDialog(QDialog):
         self.live_layout.addWidget(self.time_range_label, 1, 0)
         self.live_layout.addWidget(self.time_range_combo, 1, 1)
         self.live_layout.addWidget(self.channel_sel_button, 2, 0, 1, 2)
+        self.live_layout.addWidget(self.page_label, 3, 0)
+        self.live_layout.addWidget(self.page_spin, 3, 1)
+        self.live_layout.addWidget(self.history_button, 4, 0, 1, 2)
         self.footer_layout.addLayout(self.live_layout)
         self.layout.addLayout(self.footer_layout)
 
@@ -179,17 +320,167 @@ class PlotDialog(QDialog):
         """
         points = data
 
-        self.data_processer.update_data(points)
-        if self.multi_graph.isVisible():
-            self.multi_graph.update_curves(self.data_processer.get_data())
-        elif self.psd_widget.isVisible():
-            self.psd_widget.update_curves(self.data_processer.get_data())
-        elif self.spectral_widget.isVisible():
-            self.spectral_widget.update_curves(self.data_processer.get_data())
+        with metrics.span("update_data"):
+            self.data_processer.update_data(points)
+        metrics.count("chunks_processed")
+        metrics.count("samples", len(points))
+        self.refresh_plots()
+
+    def current_widget(self):
+        """
+        Return the plot widget currently shown, if any.
+        """
+        for widget in (
+            self.multi_graph,
+            self.stacked_widget,
+            self.psd_widget,
+            self.spectral_widget,
+        ):
+            if widget.isVisible():
+                return widget
+        return None
+
+    def refresh_plots(self):
+        """
+        Redraw the shown plot widget from the buffered data. Only the channels visible in the
+        widget are processed.
+        """
+        if self.history_button.isChecked():
+            self.update_history_range()
+            return
+        widget = self.current_widget()
+        if widget is not None and self.data_processer.ptr > 0:
+            channels = widget.visible_channels()
+            data = self.data_processer.get_data(channels)
+            with metrics.span("setData"):
+                widget.update_curves(data)
+            if widget is self.multi_graph:
+                widget.set_y_ranges(self.data_processer.get_ranges(data))
+                if self.data_processer.detector is not None:
+                    self.show_events(data, channels)
+
+    def show_events(self, data, channels):
+        """
+        Mark the events detected in the buffered data on the time series.
+        """
+        positions, chs, _ = self.data_processer.get_events(channels)
+        self.multi_graph.set_events(
+            self.multi_graph.x_values[positions], chs, data[chs, positions]
+        )
+
+    def show_stats(self, state):
+        """
+        Show or hide the performance overlay.
+        """
+        if state:
+            self.update_stats()
+            self.stats_label.show()
+            self.stats_label.raise_()
+            self.stats_timer.start(500)
+        else:
+            self.stats_timer.stop()
+            self.stats_label.hide()
+
+    def update_stats(self):
+        """
+        Update the performance overlay with the FPS, the ingest rate, the backlog of chunks and
+        the cost of each stage.
+        """
+        backlog = max(
+            metrics.totals.get("chunks_emitted", 0)
+            - metrics.totals.get("chunks_processed", 0),
+            0,
+        )
+        lines = [
+            f"FPS      {metrics.rate('frames'):8.1f}",
+            f"Ingest   {size2string(metrics.rate('ingest_bytes')):>8}/s",
+            f"Samples  {metrics.rate('samples'):8.0f}/s",
+            f"Backlog  {backlog:8d} chunks",
+        ]
+        if self.data_processer.detector is not None:
+            lines.append(f"Events   {metrics.rate('events'):8.1f}/s")
+        lines += [
+            "Stage        mean    p95 (ms)",
+        ]
+        for name, stats in metrics.summary()["stages"].items():
+            lines.append(f"{name:<10} {stats['mean']:7.2f} {stats['p95']:7.2f}")
+
+        if isinstance(self.data_listener, BoardMerger):
+            lines.append("Board     ingest/s  dropped   padded  gaps")
+            for name, stats in self.data_listener.stats().items():
+                lines.append(
+                    f"{name:<8} {size2string(stats['throughput']):>9} "
+                    f"{stats['dropped']:8d} {stats['padded']:8d} {stats['gaps']:5d}"
+                )
+
+        self.stats_label.setText("\n".join(lines))
+        self.stats_label.adjustSize()
+        self.stats_label.move(10, 10)
+
+    def update_detection(self, state):
+        """
+        Start or stop the detection of the spikes.
+        """
+        if self.data_processer.detector is not None:
+            self.data_processer.detector.release()
+        detector = None
+        if state:
+            detector = SpikeDetector(
+                self.n_channels,
+                self.fs,
+                budget=memory,
+                name="spikes",
+                **self.spike_settings,
+            )
+        self.data_processer.set_detector(detector)
+        self.multi_graph.clear_events()
+
+    def update_autoscale(self, state):
+        """
+        Enable or disable the autoscale of the time series from the tracked extrema.
+        """
+        self.multi_graph.set_autoscale(bool(state), self.autoscale_hysteresis)
+
+    def set_channels(self, channels):
+        """
+        Set the enabled channels of all the plot widgets.
+
+        Parameters
+        ----------
+        channels : list
+            Indices of the enabled channels.
+        """
+        self.multi_graph.set_channels(channels)
+        self.psd_widget.set_channels(channels)
+        self.spectral_widget.set_channels(channels)
+        self.stacked_widget.set_channels(channels)
+        self.update_page_range()
+        self.refresh_plots()
+
+    def update_page_range(self):
+        """
+        Update the range of the page selector from the enabled channels.
+        """
+        if self.paged:
+            self.page_spin.setRange(1, self.multi_graph.n_pages())
+            self.page_spin.setSuffix(f"/{self.multi_graph.n_pages()}")
+
+    def update_page(self, page):
+        """
+        Show the given page of channels and redraw it from the buffered data.
+
+        Parameters
+        ----------
+        page : int
+            Index of the page (1-based).
+        """
+        self.multi_graph.set_page(page - 1)
+        self.refresh_plots()
 
     def clear_plots(self):
         self.data_processer.clear_data()
         self.multi_graph.clear_plots()
+        self.stacked_widget.clear_plots()
 
     def pause_plots(self):
         """
@@ -211,34 +502,103 @@ class PlotDialog(QDialog):
         index : int
             Index of the time range in the time_ranges list.
         """
-        self.time_range = self.time_ranges[index]
+        try:
+            self.data_processer.change_max_time(self.time_ranges[index])
+        except MemoryBudgetError as e:
+            QMessageBox.warning(self, "Memory budget", str(e))
+            self.time_range_combo.setCurrentIndex(self.time_range_index(self.tr))
+            return
+        # The time range may be shortened to fit in the memory budget
+        self.time_range = self.tr = self.data_processer.max_time
         self.data_listener.set_bytes_to_emit(
             self.n_channels * int(self.fs * self.time_range) * 100
         )
-        self.data_processer.change_max_time(self.time_range)
         self.multi_graph.change_time_range(self.time_range)
+        self.stacked_widget.change_time_range(self.time_range)
 
         self.psd_widget.change_time_range(self.time_range)
         self.spectral_widget.change_time_range(self.time_range)
+        if self.history_button.isChecked():
+            self.update_history_range()
+            self.show_history()
+
+    def toggle_history(self, checked):
+        """
+        Enter or leave the scrollback of the history. The time series are frozen at the newest
+        samples, and the scroll bar moves the window (of the time range) back in the history.
+        """
+        if checked:
+            self.timeseries_radio.setChecked(True)
+            self.change_plot()
+            self.multi_graph.clear_events()
+        for radio in (self.stacked_radio, self.psd_radio, self.spectrogram_radio):
+            radio.setEnabled(not checked)
+        self.history_bar.setVisible(checked)
+        self.history_label.setVisible(checked)
+
+        if checked:
+            self.update_history_range()
+            self.history_bar.setValue(self.history_bar.maximum())
+            self.show_history()
+        else:
+            self.multi_graph.set_history(None)
+            self.refresh_plots()
+
+    def update_history_range(self):
+        """
+        Update the range of the scroll bar (the end of the window) with the history available.
+        """
+        start = min(self.history.start + self.tr, self.history.end)
+        self.history_bar.blockSignals(True)
+        self.history_bar.setRange(
+            int(start / self.HISTORY_STEP), int(self.history.end / self.HISTORY_STEP)
+        )
+        self.history_bar.setPageStep(int(self.tr / self.HISTORY_STEP))
+        self.history_bar.setSingleStep(max(int(self.tr / 10 / self.HISTORY_STEP), 1))
+        self.history_bar.blockSignals(False)
+        self.update_history_label()
+
+    def update_history_label(self):
+        back = self.history.end - self.history_bar.value() * self.HISTORY_STEP
+        self.history_label.setText(f"-{s2hhmmss(max(back, 0))}")
+
+    def show_history(self):
+        """
+        Draw the window of the history ending at the position of the scroll bar.
+        """
+        stop = self.history_bar.value() * self.HISTORY_STEP
+        channels = self.multi_graph.visible_channels()
+        t, data = self.history.read(
+            stop - self.tr,
+            stop,
+            n_points=max(self.multi_graph.width(), 500),
+            channels=channels,
+        )
+        self.update_history_label()
+        if len(t) == 0:
+            return
+        self.multi_graph.set_history(t)
+        with metrics.span("setData"):
+            self.multi_graph.update_curves(data)
+        self.multi_graph.set_y_ranges(
+            np.column_stack(
+                [np.fmin.reduce(data, axis=1), np.fmax.reduce(data, axis=1)]
+            )
+        )
 
     def change_plot(self):
         """
-        Change the plot mode, i.e., time series, PSD or spectrogram.
+        Change the plot mode, i.e., time series, stacked, PSD or spectrogram.
         """
-        if self.timeseries_radio.isChecked():
-            self.multi_graph.show()
-            self.psd_widget.hide()
-            self.spectral_widget.hide()
-        elif self.psd_radio.isChecked():
-            self.multi_graph.hide()
-            self.psd_widget.show()
-            self.spectral_widget.hide()
-        elif self.spectrogram_radio.isChecked():
-            self.multi_graph.hide()
-            self.psd_widget.hide()
-            self.spectral_widget.show()
+        self.multi_graph.setVisible(self.timeseries_radio.isChecked())
+        self.stacked_widget.setVisible(self.stacked_radio.isChecked())
+        self.psd_widget.setVisible(self.psd_radio.isChecked())
+        self.spectral_widget.setVisible(self.spectrogram_radio.isChecked())
 
-        self.compact_view_checkbox.setEnabled(self.timeseries_radio.isChecked())
+        self.compact_view_checkbox.setEnabled(
+            self.timeseries_radio.isChecked() or self.stacked_radio.isChecked()
+        )
+        self.autoscale_checkbox.setEnabled(self.timeseries_radio.isChecked())
 
     def connect(self):
         """
@@ -274,6 +634,17 @@ class PlotDialog(QDialog):
         )
         event.accept()
 
+    def release(self):
+        """
+        Release the live buffer and close the history.
+        """
+        self.data_processer.release()
+        if self.data_processer.detector is not None:
+            self.data_processer.detector.release()
+        if self.history:
+            self.data_listener.remove_sink(self.history.write)
+            self.history.close()
+
     def closeEvent(self, event):
         self.data_listener.stop_listening()
         self.disconnect()
@@ -2,16 +2,15 @@ import yaml
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import QDialog, QGridLayout, QLabel, QPushButton
 
-from ocmfet_client.gui.AnalysisWindow import AnalysisWindow
-from ocmfet_client.gui.dialogs.ConfigDialog import ConfigDialog
-from ocmfet_client.gui.dialogs.DownloadDialog import DownloadDialog
-from ocmfet_client.gui.LiveWindow import LiveWindow
 from ocmfet_client.utils import config_path
 
 
 class SplashDialog(QDialog):
     """
     SplashDialog class
+
+    The windows (and the heavy modules they need, e.g., pyqtgraph and SciPy) are imported when
+    they are opened, so the splash is shown as soon as possible.
     """
 
     def __init__(self, version, title="Splash"):
@@ -44,19 +43,35 @@ class SplashDialog(QDialog):
 
         self.setLayout(self.layout)
 
+    def load_plotting(self):
+        """Import and configure PyQtGraph before creating a window that uses it."""
+        from ocmfet_client import config_pyqtgraph
+
+        config_pyqtgraph()
+
     def open_config(self):
+        from ocmfet_client.gui.dialogs.ConfigDialog import ConfigDialog
+
         config_dialog = ConfigDialog(self.config)
         if config_dialog.exec_() == QDialog.Accepted:
             self.config = config_dialog.config
 
     def open_live(self):
+        self.load_plotting()
+        from ocmfet_client.gui.LiveWindow import LiveWindow
+
         self.selected = LiveWindow("Live acquisition", self.config)
         self.accept()
 
     def open_analysis(self):
+        self.load_plotting()
+        from ocmfet_client.gui.AnalysisWindow import AnalysisWindow
+
         self.selected = AnalysisWindow("Data analysis", self.config)
         self.accept()
 
     def open_downloader(self):
+        from ocmfet_client.gui.dialogs.DownloadDialog import DownloadDialog
+
         download_dialog = DownloadDialog(self.config)
         download_dialog.exec_()
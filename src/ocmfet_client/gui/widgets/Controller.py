@@ -7,30 +7,66 @@ from PyQt5.QtWidgets import (
     QGroupBox,
     QHBoxLayout,
     QLabel,
+    QTabWidget,
     QToolButton,
     QVBoxLayout,
     QWidget,
 )
 
+from ocmfet_client.gui.widgets.Sweep import SweepWidget
 from ocmfet_client.utils.formatting import sub
 
 
 class ControllerDialog(QDialog):
-    def __init__(self, channels, udp_client, parent=None):
+    """
+    Dialog with the controller and, if the live buffer is given, the sweep of the bias (see
+    SweepWidget).
+    """
+
+    def __init__(
+        self,
+        channels,
+        udp_client,
+        parent=None,
+        data_processor=None,
+        data_channels=None,
+        tag=None,
+        batch_separator=None,
+    ):
         super().__init__(parent)
         self.controller = ControllerWidget(channels, udp_client, parent=self)
+        self.sweep = None
+        if data_processor is not None:
+            self.sweep = SweepWidget(
+                self.controller,
+                data_processor,
+                data_channels,
+                tag,
+                batch_separator,
+                parent=self,
+            )
         self.init_ui()
 
     def init_ui(self):
         self.setWindowTitle("OCMFET Controller")
         self.layout = QVBoxLayout()
-        self.layout.addWidget(self.controller)
+        if self.sweep:
+            self.tabs = QTabWidget(self)
+            self.tabs.addTab(self.controller, "Bias")
+            self.tabs.addTab(self.sweep, "Sweep")
+            self.layout.addWidget(self.tabs)
+        else:
+            self.layout.addWidget(self.controller)
         self.setLayout(self.layout)
 
 
 class ControllerWidget(QWidget):
     """
     Widget for controlling the OCMFET device
+
+    The values are shown in orange while the command is pending, and in green (or red, for a
+    reset of a value different from zero) when the server confirms it. If the server does not
+    reply, the value is shown in red.
     """
 
     def __init__(self, channels, udp_client, parent=None):
@@ -39,8 +75,12 @@ class ControllerWidget(QWidget):
         self.channels = channels
         self.n_channels = len(channels)
         self.udp_client = udp_client
+        self.pending = {}  # Command id -> (spin boxes, color when confirmed)
         self.init_ui()
 
+        self.udp_client.commands.confirmed.connect(self.command_confirmed)
+        self.udp_client.commands.failed.connect(self.command_failed)
+
     def init_ui(self):
         self.layout = QGridLayout()
         self.Ids_controls = {}
@@ -148,44 +188,50 @@ class ControllerWidget(QWidget):
 
         self.setLayout(self.layout)
 
-    def send_command(self, command):
-        self.udp_client.send_message(command)
+    def send_command(self, command, spin_boxes=(), color="green"):
+        command = self.udp_client.commands.send(command)
+        for spin_box in spin_boxes:
+            spin_box.setStyleSheet("color: orange")
+        if spin_boxes:
+            self.pending[command["id"]] = (spin_boxes, color)
+
+    def command_confirmed(self, command):
+        if command["id"] in self.pending:
+            spin_boxes, color = self.pending.pop(command["id"])
+            for spin_box in spin_boxes:
+                spin_box.setStyleSheet(f"color: {color}")
+
+    def command_failed(self, command):
+        if command["id"] in self.pending:
+            spin_boxes, _ = self.pending.pop(command["id"])
+            for spin_box in spin_boxes:
+                spin_box.setStyleSheet("color: red")
+
+    def reset_color(self, spin_box):
+        if not math.isclose(spin_box.value(), 0, abs_tol=1e-3):
+            return "red"
+        return "green"
 
     def set_Ids(self, channel, value):
-        self.Ids_controls[channel]["spin_box"].setStyleSheet("color: green")
-        self.send_command(f"id{channel+1:02} {value:.2f}")
+        spin_box = self.Ids_controls[channel]["spin_box"]
+        self.send_command(f"id{channel+1:02} {value:.2f}", [spin_box])
 
     def reset_Ids(self, channel):
-        if not math.isclose(
-            self.Ids_controls[channel]["spin_box"].value(), 0, abs_tol=1e-3
-        ):
-            self.Ids_controls[channel]["spin_box"].setStyleSheet("color: red")
-        else:
-            self.Ids_controls[channel]["spin_box"].setStyleSheet("color: green")
-        self.send_command(f"id{channel+1:02} 0")
+        spin_box = self.Ids_controls[channel]["spin_box"]
+        self.send_command(f"id{channel+1:02} 0", [spin_box], self.reset_color(spin_box))
 
     def set_Vg(self, channel, value):
-        self.Vg_controls[channel]["spin_box"].setStyleSheet("color: green")
-        self.send_command(f"vg{channel+1:02} {value:.2f}")
+        spin_box = self.Vg_controls[channel]["spin_box"]
+        self.send_command(f"vg{channel+1:02} {value:.2f}", [spin_box])
 
     def reset_Vg(self, channel):
-        if not math.isclose(
-            self.Vg_controls[channel]["spin_box"].value(), 0, abs_tol=1e-3
-        ):
-            self.Vg_controls[channel]["spin_box"].setStyleSheet("color: red")
-        else:
-            self.Vg_controls[channel]["spin_box"].setStyleSheet("color: green")
-        self.send_command(f"vg{channel+1:02} 0")
+        spin_box = self.Vg_controls[channel]["spin_box"]
+        self.send_command(f"vg{channel+1:02} 0", [spin_box], self.reset_color(spin_box))
 
     def set_Vs(self, channel, value):
-        self.Ids_controls[channel]["spin_box"].setStyleSheet("color: green")
-        self.send_command(f"vs{channel+1:02} {value:.2f}")
+        spin_box = self.Ids_controls[channel]["spin_box"]
+        self.send_command(f"vs{channel+1:02} {value:.2f}", [spin_box])
 
     def reset_Vs(self, channel):
-        if not math.isclose(
-            self.Ids_controls[channel]["spin_box"].value(), 0, abs_tol=1e-3
-        ):
-            self.Ids_controls[channel]["spin_box"].setStyleSheet("color: red")
-        else:
-            self.Ids_controls[channel]["spin_box"].setStyleSheet("color: green")
-        self.send_command(f"vs{channel+1:02} 0")
+        spin_box = self.Ids_controls[channel]["spin_box"]
+        self.send_command(f"vs{channel+1:02} 0", [spin_box], self.reset_color(spin_box))
@@ -0,0 +1,43 @@
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QLabel
+
+from ocmfet_client.utils.formatting import size2string
+from ocmfet_client.utils.memory import memory
+
+
+class MemoryLabel(QLabel):
+    """
+    Label with the memory used by the buffers of the client and the budget. The tooltip lists
+    the size of each buffer and the last degradations.
+
+    Parameters
+    ----------
+    budget : MemoryBudget
+        Memory budget shown. Default: the shared one
+    """
+
+    def __init__(self, parent=None, budget=memory):
+        super().__init__(parent)
+        self.budget = budget
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.update_usage)
+        self.timer.start(1000)
+        self.update_usage()
+
+    def update_usage(self):
+        used = self.budget.used()
+        if self.budget.budget is None:
+            self.setText(f"Memory: {size2string(used)}")
+        else:
+            self.setText(
+                f"Memory: {size2string(used)} / {size2string(self.budget.budget)}"
+            )
+
+        lines = [f"{name}: {size2string(n)}" for name, n in self.budget.usage().items()]
+        if self.budget.degradations:
+            lines.append("")
+            lines.extend(
+                f"{name} degraded: {description}"
+                for name, description in list(self.budget.degradations)[-5:]
+            )
+        self.setToolTip("\n".join(lines) or "No buffers")
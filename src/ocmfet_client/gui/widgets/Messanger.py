@@ -1,11 +1,17 @@
+import logging
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+from PyQt5.QtCore import QTimer
 from PyQt5.QtGui import QFont
 from PyQt5.QtWidgets import (
     QComboBox,
     QHBoxLayout,
     QLineEdit,
+    QPlainTextEdit,
     QPushButton,
     QShortcut,
-    QTextEdit,
     QVBoxLayout,
     QWidget,
 )
@@ -15,7 +21,13 @@ class Messanger(QWidget):
     """
     Messanger class
 
-    The widget allows the user to send commands to the server and visualize the response.
+    The widget allows the user to send commands to the server and visualize the response. The
+    commands are tracked by the command tracker of the client (without retries, since they may
+    not be idempotent), and the commands without reply are reported in the console.
+
+    The console is a plain-text view that keeps only the last max_lines lines, and the lines are
+    appended in batches by a timer, so its cost does not grow over long runs. The lines can also
+    be mirrored to a rotating log file.
 
     Parameters
     ----------
@@ -24,24 +36,66 @@ class Messanger(QWidget):
 
     udp_client : UDPClient
         UDP client object
+
+    max_lines : scalar
+        Maximum number of lines kept in the console
+
+    log_file : str, optional
+        Path of the log file mirroring the console
+
+    log_max_bytes : scalar
+        Size in bytes after which the log file is rotated
+
+    log_backups : scalar
+        Number of rotated log files kept
     """
 
-    def __init__(self, commands, udp_client, parent=None):
+    def __init__(
+        self,
+        commands,
+        udp_client,
+        parent=None,
+        max_lines=5000,
+        log_file=None,
+        log_max_bytes=10 << 20,
+        log_backups=5,
+    ):
         super().__init__(parent)
         self.parent = parent
         self.commands = commands
         self.udp_client = udp_client
+        self.max_lines = max_lines
         self.is_connected = False
         self.history = []
         self.history_index = 0
+        self.pending = deque(maxlen=max_lines)
+        self.skipped = 0
+
+        self.logger = None
+        if log_file:
+            self.logger = logging.getLogger(f"ocmfet_client.console.{id(self)}")
+            self.logger.propagate = False
+            self.logger.setLevel(logging.INFO)
+            handler = RotatingFileHandler(
+                log_file, maxBytes=log_max_bytes, backupCount=log_backups
+            )
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self.logger.addHandler(handler)
+
         self.init_ui()
 
+        self.flush_timer = QTimer(self)
+        self.flush_timer.timeout.connect(self.flush)
+        self.flush_timer.start(100)
+
     def init_ui(self):
-        self.console = QTextEdit(self)
+        self.console = QPlainTextEdit(self)
         font = QFont()
         font.setFamily("Courier")
         self.console.setFont(font)
         self.console.setReadOnly(True)
+        self.console.setMaximumBlockCount(self.max_lines)
+        self.console.setUndoRedoEnabled(False)
         self.console.setContextMenuPolicy(3)
         self.console.customContextMenuRequested.connect(self.console_menu)
 
@@ -84,9 +138,22 @@ class Messanger(QWidget):
         """Show context menu for the console."""
         menu = self.console.createStandardContextMenu()
         clear_action = menu.addAction("Clear")
+        stats_action = menu.addAction("Command statistics")
         action = menu.exec_(self.console.viewport().mapToGlobal(pos))
         if action == clear_action:
             self.console.clear()
+        elif action == stats_action:
+            self.show_stats()
+
+    def show_stats(self):
+        """Show the statistics of the commands in the console."""
+        for command_type, stats in self.udp_client.commands.stats().items():
+            self.log(
+                f"stats> {command_type}: {stats['sent']} sent, "
+                f"{stats['confirmed']} confirmed, {stats['retries']} retries, "
+                f"{stats['timeouts']} timeouts, RTT {stats['rtt']['p50']:.1f} ms (median), "
+                f"{stats['rtt']['p95']:.1f} ms (p95)"
+            )
 
     def history_up_cmd(self):
         """Move up the command history."""
@@ -116,21 +183,51 @@ class Messanger(QWidget):
                 self.history.append(cmd)
 
             self.history_index = 0
-            self.udp_client.send_message(cmd)
-            self.console.append(f"<b>client></b> {cmd}")
+            self.udp_client.commands.send(cmd, retries=0)
+            self.log(f"client> {cmd}")
             self.command_line.clear()
 
     def update_console(self, msg):
         """Update the console with the received message."""
-        log = f"<b style='color: #0000FF'>server></b> <i>{msg}</i>"
-        self.console.append(log)
+        self.log(f"server> {msg}")
+
+    def report_failure(self, command):
+        """Report a command without reply in the console."""
+        self.log(f"client> no reply to {command['text']}")
+
+    def log(self, line):
+        """Queue a line for the console (and write it to the log file)."""
+        if len(self.pending) == self.pending.maxlen:
+            self.skipped += 1
+        self.pending.append(f"{time.strftime('%H:%M:%S')} {line}")
+        if self.logger:
+            self.logger.info(line)
+
+    def flush(self):
+        """Append the queued lines to the console at once."""
+        if not self.pending:
+            return
+
+        lines = list(self.pending)
+        self.pending.clear()
+        if self.skipped:
+            lines.insert(0, f"... {self.skipped} lines skipped")
+            self.skipped = 0
+
+        scrollbar = self.console.verticalScrollBar()
+        at_bottom = scrollbar.value() == scrollbar.maximum()
+        self.console.appendPlainText("\n".join(lines))
+        if at_bottom:
+            scrollbar.setValue(scrollbar.maximum())
 
     def connect(self):
         """Connect the UDP client."""
         self.udp_client.msg_listener.received_msg.connect(self.update_console)
+        self.udp_client.commands.failed.connect(self.report_failure)
         self.is_connected = True
 
     def disconnect(self):
         """Disconnect the UDP client."""
         self.udp_client.msg_listener.received_msg.disconnect(self.update_console)
+        self.udp_client.commands.failed.disconnect(self.report_failure)
         self.is_connected = False
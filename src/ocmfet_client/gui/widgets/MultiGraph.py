@@ -5,12 +5,17 @@ This module contains the MultiGraphWidget class for plotting the data coming fro
 real-time.
 """
 
+import itertools
+import time
+
 import numpy as np
 import pyqtgraph as pg
 from pyqtgraph.Qt import QtCore
 from scipy.signal import spectrogram, welch
 
-from ocmfet_client.utils.formatting import datetime_range, sup
+from ocmfet_client.utils.formatting import sup
+from ocmfet_client.utils.memory import memory
+from ocmfet_client.utils.metrics import metrics
 
 
 class MultiGraphWidget(pg.GraphicsLayoutWidget):
@@ -57,6 +62,10 @@ class MultiGraphWidget(pg.GraphicsLayoutWidget):
         self.compact = False
         self.enabled_channels = [i for i in range(self.n)]
         # self.enabled_channels = [8, 9, 10, 11, 12, 13, 14, 15]
+        self.autoscale = False
+        self.hysteresis = 0.25
+        self.y_ranges = {}
+        self.markers = []  # Markers of the events, created at the first events
 
         self.initUI()
         self.init_x_values()
@@ -85,6 +94,11 @@ class MultiGraphWidget(pg.GraphicsLayoutWidget):
         for i, ch in enumerate(self.channels):
             self.plot_items[i].setLabels(**ch["labels"])
 
+    def paintEvent(self, event):
+        with metrics.span("paint"):
+            super().paintEvent(event)
+        metrics.count("frames")
+
     def change_sample_rate(self, fs):
         """
         Change the sample rate of the widget.
@@ -117,6 +131,17 @@ class MultiGraphWidget(pg.GraphicsLayoutWidget):
             pi.setXRange(0, self.tr)
             pi.setXLink(self.plot_items[0])
 
+    def set_history(self, t):
+        """
+        Plot the curves against the times t (of a window of the history), or back against the
+        time range if t is None.
+        """
+        if t is None:
+            self.init_x_values()
+            return
+        self.x_values = t
+        self.plot_items[0].setXRange(t[0], t[-1], padding=0)
+
     def update_curves(self, data):
         """Update the curves of the plots."""
         for i in self.enabled_channels:
@@ -128,10 +153,42 @@ class MultiGraphWidget(pg.GraphicsLayoutWidget):
 
         self.curves[i].setData(x=self.x_values[: len(data)], y=data)
 
+    def set_events(self, t, channels, y):
+        """
+        Mark the events on the plots of their channels.
+
+        Parameters
+        ----------
+        t : ndarray
+            Time of each event in s (in the x values of the plots)
+
+        channels : ndarray
+            Channel of each event
+
+        y : ndarray
+            Value of the plotted data at each event
+        """
+        if not self.markers:
+            for pi in self.plot_items:
+                markers = pg.ScatterPlotItem(
+                    symbol="t1", size=8, pen=None, brush=(0, 0, 255)
+                )
+                pi.addItem(markers)
+                self.markers.append(markers)
+        for k, i in self.visible_plots():
+            keep = channels == i
+            self.markers[k].setData(x=t[keep], y=y[keep])
+
+    def clear_events(self):
+        """Remove the markers of the events."""
+        for markers in self.markers:
+            markers.clear()
+
     def clear_plots(self):
         """Clear the plots."""
         for curve in self.curves:
             curve.clear()
+        self.clear_events()
 
     def set_compact(self, compact):
         """Set the compact mode of the widget."""
@@ -144,25 +201,442 @@ class MultiGraphWidget(pg.GraphicsLayoutWidget):
         """Set the enabled channels of the widget."""
         self.enabled_channels = channels
 
+    def visible_channels(self):
+        """Return the channels currently drawn by the widget."""
+        return self.enabled_channels
 
-class MultiGraph_dt(MultiGraphWidget):
-    """Wrapper for MultiRemoteGraph class with datetime x-axis."""
+    def visible_plots(self):
+        """Return the (plot index, channel index) pairs currently drawn by the widget."""
+        return [(i, i) for i in self.enabled_channels]
+
+    def set_autoscale(self, autoscale, hysteresis=None):
+        """
+        Enable or disable the autoscale of the y axes from the tracked extrema. When enabled, the
+        pyqtgraph autorange of the y axes is disabled.
+
+        Parameters
+        ----------
+        autoscale : bool
+            If True, the y ranges are set by set_y_ranges
+
+        hysteresis : scalar, optional
+            Fraction of the range used as margin when expanding, and as threshold for shrinking
+        """
+        self.autoscale = bool(autoscale)
+        if hysteresis is not None:
+            self.hysteresis = hysteresis
+        self.y_ranges = {}
+        for pi in self.plot_items:
+            if self.autoscale:
+                pi.disableAutoRange(axis="y")
+            else:
+                pi.enableAutoRange(axis="y")
+
+    def set_y_ranges(self, ranges):
+        """
+        Set the y ranges of the plots with hysteresis. A range is expanded as soon as the data
+        exceeds it, and it is shrunk only when the data spans less than (1 - hysteresis) of it.
+
+        Parameters
+        ----------
+        ranges : ndarray
+            Array with shape (n, 2) with the minimum and the maximum of each channel.
+        """
+        if not self.autoscale:
+            return
+
+        for k, i in self.visible_plots():
+            lo, hi = ranges[i]
+            if not (np.isfinite(lo) and np.isfinite(hi)):
+                continue
+
+            current = self.y_ranges.get(k)
+            if current is not None:
+                expand = lo < current[0] or hi > current[1]
+                shrink = hi - lo < (1 - self.hysteresis) * (current[1] - current[0])
+                if not (expand or shrink):
+                    continue
+
+            span = hi - lo if hi > lo else max(abs(hi), 1e-12)
+            margin = span * self.hysteresis / 2
+            self.y_ranges[k] = (lo - margin, hi + margin)
+            self.plot_items[k].setYRange(*self.y_ranges[k], padding=0)
+
+
+class MultiGraphPagedWidget(MultiGraphWidget):
+    """
+    MultiGraphPagedWidget
+
+    Virtualized version of the MultiGraphWidget. Only a fixed grid of plots (a page) is created,
+    and the enabled channels are paged through it. The channels outside the current page are not
+    drawn nor processed, but they are still buffered by the DataProcessor, so they are shown
+    immediately when their page is selected.
+
+    Parameters
+    -----------
+    channels: list
+        List with the channels configuration
+
+    fs : scalar
+        Sample rate in kHz
+
+    tr : scalar
+        Time range in s
+
+    grid : tuple
+        Number of rows and columns of a page, e.g., (4, 4)
+
+    parent : QWidget
+        Parent widget
+
+    title : str
+        Title of the widget
+    """
+
+    def __init__(self, channels, fs, tr, grid=(4, 4), parent=None, title=""):
+        self.grid = tuple(grid)
+        self.page_size = self.grid[0] * self.grid[1]
+        self.page = 0
+
+        super().__init__(channels, fs, tr, parent, title)
+
+    def initUI(self):
+        """Initialize the plots of a page."""
+        self.plot_items = []
+        self.curves = []
+
+        cols = self.grid[1]
+        for k in range(self.page_size):
+            pi = self.addPlot(row=k // cols, col=k % cols)
+            pi.setDownsampling(True, mode="peak")
+            pi.setClipToView(True)
+            pi.showGrid(x=True, y=True)
+            self.plot_items.append(pi)
+
+        self.curves = [pi.plot() for pi in self.plot_items]
+
+        for curve in self.curves:
+            curve.setPen((255, 0, 0))
+
+        self.update_page()
+
+    def n_pages(self):
+        """Return the number of pages needed for the enabled channels."""
+        return max(1, -(-len(self.enabled_channels) // self.page_size))
+
+    def set_page(self, page):
+        """
+        Select the page to be shown.
+
+        Parameters
+        ----------
+        page : int
+            Index of the page (0-based)
+        """
+        self.page = min(max(page, 0), self.n_pages() - 1)
+        self.update_page()
+
+    def update_page(self):
+        """Assign the channels of the current page to the plots."""
+        visible = self.visible_channels()
+        self.y_ranges = {}
+        for k, (pi, curve) in enumerate(zip(self.plot_items, self.curves, strict=True)):
+            curve.clear()
+            if k < len(visible):
+                ch = self.channels[visible[k]]
+                pi.setTitle(f"<b>({visible[k] + 1})</b>")
+                pi.setLabels(**ch["labels"])
+                pi.show()
+            else:
+                pi.hide()
+
+    def visible_channels(self):
+        """Return the enabled channels of the current page."""
+        start = self.page * self.page_size
+        return self.enabled_channels[start : start + self.page_size]
+
+    def visible_plots(self):
+        """Return the (plot index, channel index) pairs of the current page."""
+        return list(enumerate(self.visible_channels()))
+
+    def update_curves(self, data):
+        """Update the curves of the plots of the current page."""
+        for k, i in enumerate(self.visible_channels()):
+            self.update_curve(k, data[i])
 
-    def __init__(self, n, fs, tr, x_label, y_label, parent=None):
-        super().__init__(n, fs, tr, x_label, y_label, parent)
+    def set_channels(self, channels):
+        """Set the enabled channels of the widget."""
+        self.enabled_channels = channels
+        self.set_page(self.page)
+
+
+class MultiGraphStackedWidget(pg.GraphicsLayoutWidget):
+    """
+    MultiGraphStackedWidget
+
+    This class draws all the enabled channels as vertically offset traces in a single plot. The
+    traces are batched in a single PlotCurveItem using a connect array, so the paint cost does not
+    grow with the number of plots as in the MultiGraphWidget grid. It is meant for arrays with
+    32-128 channels.
+
+    Parameters
+    -----------
+    channels: list
+        List with the channels configuration
+
+    fs : scalar
+        Sample rate in kHz
+
+    tr : scalar
+        Time range in s
+
+    spacing : scalar
+        Vertical distance between two adjacent traces (in normalized units)
+
+    opengl : bool
+        If True, the plot is rendered with OpenGL
+
+    parent : QWidget
+        Parent widget
+
+    title : str
+        Title of the widget
+    """
+
+    def __init__(
+        self, channels, fs, tr, spacing=1.0, opengl=False, parent=None, title=""
+    ):
+        super().__init__(parent, title=title)
+
+        self.channels = channels
+        self.n = len(channels)
+        self.fs = fs * 1e3
+        self.tr = tr
+        self.max_samples = int(self.fs * self.tr)
+        self.spacing = spacing
+        self.compact = False
+        self.enabled_channels = [i for i in range(self.n)]
+        # Per-channel gain (None means autoscale to the peak-to-peak of the trace)
+        self.gains = [None] * self.n
+        self.offsets = np.zeros(self.n)
+        self._connect = None
+
+        if opengl:
+            self.useOpenGL(True)
+
+        self.initUI()
+        self.init_x_values()
+
+    def initUI(self):
+        """Initialize the UI of the widget."""
+        self.plot_item = self.addPlot(row=0, col=0)
+        self.plot_item.setDownsampling(True, mode="peak")
+        self.plot_item.setClipToView(True)
+        self.plot_item.showGrid(x=True, y=False)
+        self.plot_item.setMouseEnabled(x=True, y=False)
+        self.plot_item.setLabels(bottom=self.channels[0]["labels"]["bottom"])
+
+        self.curve = pg.PlotCurveItem(pen=(255, 0, 0))
+        self.plot_item.addItem(self.curve)
+
+        self.update_ticks()
+
+    def update_ticks(self):
+        """Label the y axis with the names of the enabled channels."""
+        ticks = [
+            (self.offset(k), self.channels[i]["name"])
+            for k, i in enumerate(self.enabled_channels)
+        ]
+        self.plot_item.getAxis("left").setTicks([ticks])
+        self.plot_item.setYRange(
+            -self.spacing, self.spacing * max(len(self.enabled_channels), 1)
+        )
+
+    def offset(self, k):
+        """Return the vertical offset of the k-th enabled trace (first one on top)."""
+        return self.spacing * (len(self.enabled_channels) - 1 - k)
+
+    def paintEvent(self, event):
+        with metrics.span("paint"):
+            super().paintEvent(event)
+        metrics.count("frames")
+
+    def change_sample_rate(self, fs):
+        """
+        Change the sample rate of the widget.
+
+        Parameters
+        ----------
+        fs : scalar
+            Sample rate in kHz
+        """
+        self.fs = fs * 1e3
+        self.init_x_values()
+
+    def change_time_range(self, tr):
+        """
+        Change the time range of the widget.
+
+        Parameters
+        ----------
+        tr : scalar
+            Time range in s
+        """
+        self.tr = tr
+        self.init_x_values()
 
     def init_x_values(self):
-        self.x_values = datetime_range(self.max_samples, self.tr)
+        """Initialize the x values of the plot."""
+        self.max_samples = int(self.fs * self.tr)
+        self.x_values = np.linspace(0, self.tr, self.max_samples)
+        self._connect = None
+        self.plot_item.setXRange(0, self.tr)
 
+    def set_gain(self, i, gain):
+        """
+        Set the gain of the i-th channel.
+
+        Parameters
+        ----------
+        i : int
+            Channel index
+
+        gain : scalar or None
+            Gain applied to the trace after removing its mean. If None, the trace is scaled to
+            fit the spacing.
+        """
+        self.gains[i] = gain
+
+    def set_offset(self, i, offset):
+        """Set an additional vertical offset (in normalized units) for the i-th channel."""
+        self.offsets[i] = offset
+
+    def get_connect(self, n_traces, n_samples):
+        """Return the (cached) connect array for n_traces traces of n_samples points."""
+        size = n_traces * n_samples
+        if self._connect is None or len(self._connect) != size:
+            self._connect = np.ones(size, dtype=bool)
+            self._connect[n_samples - 1 :: n_samples] = False
+        return self._connect
+
+    def update_curves(self, data):
+        """Update the stacked traces with the data of the enabled channels."""
+        if not self.enabled_channels:
+            self.curve.clear()
+            return
+
+        data = np.asarray(data)[self.enabled_channels]
+        n_traces, n_samples = data.shape
+        if n_samples == 0:
+            return
+
+        y = data - data.mean(axis=1, keepdims=True)
+        for k, i in enumerate(self.enabled_channels):
+            gain = self.gains[i]
+            if gain is None:
+                ptp = np.ptp(y[k])
+                gain = 0.9 * self.spacing / ptp if ptp > 0 else 1.0
+            y[k] *= gain
+            y[k] += self.offset(k) + self.offsets[i]
+
+        x = np.tile(self.x_values[:n_samples], n_traces)
+        self.curve.setData(
+            x=x, y=y.ravel(), connect=self.get_connect(n_traces, n_samples)
+        )
+
+    def clear_plots(self):
+        """Clear the plot."""
+        self.curve.clear()
+
+    def set_compact(self, compact):
+        """Set the compact mode of the widget."""
+        self.compact = compact
+        self.plot_item.showAxis("left", show=not compact)
+        self.plot_item.showLabel("bottom", show=not compact)
+
+    def set_channels(self, channels):
+        """Set the enabled channels of the widget."""
+        self.enabled_channels = channels
+        self._connect = None
+        self.update_ticks()
+
+    def visible_channels(self):
+        """Return the channels currently drawn by the widget."""
+        return self.enabled_channels
+
+
+class DateOffsetAxisItem(pg.DateAxisItem):
+    """
+    DateAxisItem for plots whose x values are relative to an offset, i.e., the axis shows the
+    timestamp (x + offset). Moving the time window only changes the offset, so the x values of the
+    curves do not need to be recomputed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.offset = 0.0
+
+    def set_offset(self, offset):
+        """Set the timestamp (in s) corresponding to x = 0."""
+        if offset != self.offset:
+            self.offset = offset
+            self.picture = None
+            self.update()
+
+    def tickValues(self, minVal, maxVal, size):
+        levels = super().tickValues(minVal + self.offset, maxVal + self.offset, size)
+        return [
+            (spacing, [v - self.offset for v in values]) for spacing, values in levels
+        ]
+
+    def tickStrings(self, values, scale, spacing):
+        return super().tickStrings([v + self.offset for v in values], scale, spacing)
+
+
+class MultiGraph_dt(MultiGraphWidget):
+    """
+    Wrapper for MultiGraphWidget class with datetime x-axis.
+
+    The curves use the same relative x values of the MultiGraphWidget, and the wall-clock time is
+    obtained with an affine mapping on the axes, anchored to the acquisition start by a TimeBase.
+    """
+
+    def __init__(self, channels, fs, tr, parent=None, title=""):
+        self.time_base = None
+        super().__init__(channels, fs, tr, parent, title)
+
+    def initUI(self):
+        super().initUI()
+
+        self.axes = []
         for plot_item in self.plot_items:
-            axis = pg.DateAxisItem(orientation="bottom")
+            axis = DateOffsetAxisItem(orientation="bottom")
             plot_item.setAxisItems({"bottom": axis})
+            self.axes.append(axis)
 
-    def update_curves(self, data):
-        self.x_values = datetime_range(self.max_samples, self.tr)
+    def set_time_base(self, time_base):
+        """
+        Set the time base used to timestamp the samples.
+
+        Parameters
+        ----------
+        time_base : TimeBase
+            Time base of the acquisition, e.g., the one of the DataProcessor
+        """
+        self.time_base = time_base
 
+    def update_curves(self, data):
         super().update_curves(data)
 
+        n_samples = len(data[0]) if len(data) else 0
+        if self.time_base is not None and self.time_base.t0 is not None:
+            offset = self.time_base.offset(n_samples)
+        else:
+            # The last sample is assumed to be acquired now
+            offset = time.time() - n_samples / self.fs
+        for axis in self.axes:
+            axis.set_offset(offset)
+
 
 class MultiGraphPSDWidget(MultiGraphWidget):
     """Wrapper for MultiGraphs class to plot the PSD of the data."""
@@ -204,9 +678,14 @@ class MultiGraphPSDWidget(MultiGraphWidget):
 class MultiGraphSpectrogramWidget(MultiGraphWidget):
     """Spectrogram widget."""
 
+    instances = itertools.count(1)
+
     def __init__(self, n, fs, tr, parent=None):
         super().__init__(n, fs, tr, parent, title="Spectrogram")
         self.cmap = pg.colormap.get("viridis")
+        # Size of the images, registered in the memory budget
+        self.memory_name = f"spectrogram {next(self.instances)}"
+        self.image_bytes = {}
 
     def initUI(self):
         """Initialize the UI of the widget."""
@@ -261,6 +740,11 @@ class MultiGraphSpectrogramWidget(MultiGraphWidget):
         # set the rect
         self.images[i].setRect(QtCore.QRectF(0, 0, t[-1], f[-1]))
 
+        self.image_bytes[i] = Sxx.nbytes
+        memory.register(self.memory_name, sum(self.image_bytes.values()))
+
     def clear_plots(self):
         for i in range(self.n):
             self.images[i].clear()
+        self.image_bytes.clear()
+        memory.release(self.memory_name)
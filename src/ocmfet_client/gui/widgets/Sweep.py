@@ -0,0 +1,391 @@
+import csv
+import time
+
+import numpy as np
+from PyQt5.QtCore import QObject, Qt, QTimer, pyqtSignal
+from PyQt5.QtWidgets import (
+    QAbstractItemView,
+    QComboBox,
+    QDoubleSpinBox,
+    QFileDialog,
+    QGridLayout,
+    QLabel,
+    QListWidget,
+    QListWidgetItem,
+    QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QWidget,
+)
+
+
+class SweepEngine(QObject):
+    """
+    SweepEngine
+
+    Steps a bias parameter of some channels through a range of values on top of a
+    ControllerWidget. The steps are dispatched by a precise timer on a fixed schedule (so the
+    timing does not drift with the processing time), each step is tagged in the stream, and at the
+    end of each dwell the mean of the last settle seconds of the raw samples of each channel is
+    collected from the live buffer.
+
+    Parameters
+    ----------
+    controller : ControllerWidget
+        Controller sending the commands
+
+    data_processor : DataProcessor
+        Live buffer
+
+    data_channels : list
+        Index in the live buffer of each channel of the controller
+
+    tag : callable, optional
+        Function tagging the stream with a text. Default: the tag command is sent to the server
+
+    batch_separator : str, optional
+        If given, the commands of a step are sent in a single datagram, joined by it (the server
+        must accept it). Only with request IDs (see CommandTracker.use_ids): the batch is tracked
+        as a single command, and without IDs its extra replies would be matched in order to the
+        following commands. Without IDs, the commands are sent one per datagram
+
+    Signals
+    -------
+    step_started : int, float
+        Emitted with the index and the value of a step when it is dispatched
+
+    step_done : int, float, ndarray
+        Emitted with the index, the value and the settled response of each channel of a step
+
+    finished
+        Emitted when the sweep is completed or aborted
+    """
+
+    step_started = pyqtSignal(int, float)
+    step_done = pyqtSignal(int, float, object)
+    finished = pyqtSignal()
+
+    PARAMETERS = {"vg": "Vg_controls", "id": "Ids_controls", "vs": "Ids_controls"}
+
+    def __init__(
+        self,
+        controller,
+        data_processor,
+        data_channels,
+        tag=None,
+        batch_separator=None,
+        parent=None,
+    ):
+        super().__init__(parent)
+        self.controller = controller
+        self.data_processor = data_processor
+        self.data_channels = data_channels
+        self.tag = tag or (
+            lambda text: controller.udp_client.commands.send(f"tag {text}", retries=0)
+        )
+        self.batch_separator = batch_separator
+
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.tick)
+        self.running = False
+
+    @staticmethod
+    def channel_parameters(channel):
+        """
+        Return the parameters that can be swept on a channel: the second bias is Vs on the zero
+        version (type 1) and Ids on the others, both set by the Ids controls.
+        """
+        return ("vg", "vs") if channel["type"] == 1 else ("vg", "id")
+
+    @staticmethod
+    def sweep_values(start, stop, step):
+        """
+        Return the values from start to stop (included) with the given step.
+        """
+        n = int(round(abs(stop - start) / step)) + 1 if step > 0 else 1
+        return np.round(np.linspace(start, stop, n), 6)
+
+    def start(self, channels, parameter, start, stop, step, dwell, settle):
+        """
+        Start a sweep.
+
+        Parameters
+        ----------
+        channels : list
+            Indices of the channels of the controller
+
+        parameter : str
+            "vg", "id" or "vs"
+
+        start, stop, step : scalar
+            Range of the values
+
+        dwell : scalar
+            Duration of each step in s
+
+        settle : scalar
+            Duration in s, at the end of each step, of the samples averaged as the response
+
+        Raises
+        ------
+        ValueError
+            If the parameter cannot be swept on some of the channels
+        """
+        unsupported = [
+            self.controller.channels[ch]["name"]
+            for ch in channels
+            if parameter not in self.channel_parameters(self.controller.channels[ch])
+        ]
+        if unsupported:
+            raise ValueError(f"{parameter} cannot be swept on {', '.join(unsupported)}")
+
+        self.channels = channels
+        self.parameter = parameter
+        self.values = self.sweep_values(start, stop, step)
+        self.dwell = dwell
+        self.settle = min(settle, dwell)
+        self.controls = getattr(self.controller, self.PARAMETERS[parameter])
+
+        self.k = 0
+        self.t0 = time.perf_counter()
+        self.running = True
+        self.tick()
+
+    def abort(self):
+        if self.running:
+            self.timer.stop()
+            self.running = False
+            self.finished.emit()
+
+    def tick(self):
+        if not self.running:
+            return
+
+        # The previous step has settled
+        if self.k > 0:
+            self.step_done.emit(self.k - 1, self.values[self.k - 1], self.response())
+
+        if self.k == len(self.values):
+            self.running = False
+            self.finished.emit()
+            return
+
+        self.dispatch(self.values[self.k])
+        self.step_started.emit(self.k, self.values[self.k])
+        self.k += 1
+
+        due = self.t0 + self.k * self.dwell
+        self.timer.start(max(int(round((due - time.perf_counter()) * 1e3)), 0))
+
+    def dispatch(self, value):
+        commands = []
+        spin_boxes = []
+        for ch in self.channels:
+            spin_box = self.controls[ch]["spin_box"]
+            spin_box.setValue(value)
+            commands.append(f"{self.parameter}{ch+1:02} {value:.2f}")
+            spin_boxes.append(spin_box)
+
+        if self.batch_separator and self.controller.udp_client.commands.use_ids:
+            self.controller.send_command(
+                self.batch_separator.join(commands), spin_boxes
+            )
+        else:
+            for command, spin_box in zip(commands, spin_boxes, strict=True):
+                self.controller.send_command(command, [spin_box])
+        self.tag(f"{self.parameter} {value:.2f}")
+
+    def response(self):
+        n_samples = self.settle * self.data_processor.fs
+        data = self.data_processor.get_recent(
+            n_samples, [self.data_channels[ch] for ch in self.channels]
+        )
+        if data.shape[1] == 0:
+            return np.full(len(self.channels), np.nan)
+        return data.mean(axis=1)
+
+
+class SweepWidget(QWidget):
+    """
+    Widget for configuring and running a sweep (see SweepEngine), with a table of the settled
+    responses. The parameters offered are the ones supported by all the selected channels.
+    """
+
+    PARAMETER_LABELS = [("Vg", "vg"), ("Ids", "id"), ("Vs", "vs")]
+
+    def __init__(
+        self,
+        controller,
+        data_processor,
+        data_channels,
+        tag=None,
+        batch_separator=None,
+        parent=None,
+    ):
+        super().__init__(parent)
+        self.controller = controller
+        self.engine = SweepEngine(
+            controller, data_processor, data_channels, tag, batch_separator, self
+        )
+        self.engine.step_started.connect(self.update_progress)
+        self.engine.step_done.connect(self.add_row)
+        self.engine.finished.connect(self.sweep_finished)
+        self.init_ui()
+
+    def init_ui(self):
+        self.channels_list = QListWidget(self)
+        self.channels_list.setSelectionMode(QAbstractItemView.NoSelection)
+        for ch in self.controller.channels:
+            item = QListWidgetItem(ch["name"])
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Checked)
+            self.channels_list.addItem(item)
+
+        self.parameter_combo = QComboBox(self)
+        self.update_parameters()
+        self.channels_list.itemChanged.connect(self.update_parameters)
+
+        self.start_spin = self.make_spin(0, 4, 0.0)
+        self.stop_spin = self.make_spin(0, 4, 1.0)
+        self.step_spin = self.make_spin(0.01, 4, 0.1)
+        self.dwell_spin = self.make_spin(0.1, 3600, 5.0, " s")
+        self.settle_spin = self.make_spin(0.01, 3600, 1.0, " s")
+
+        self.start_button = QPushButton("Start sweep", self)
+        self.start_button.clicked.connect(self.start_sweep)
+        self.abort_button = QPushButton("Abort", self)
+        self.abort_button.setEnabled(False)
+        self.abort_button.clicked.connect(self.engine.abort)
+        self.save_button = QPushButton("Save table", self)
+        self.save_button.clicked.connect(self.save_table)
+        self.progress_label = QLabel("Idle", self)
+
+        self.table = QTableWidget(0, 2, self)
+        self.table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+
+        layout = QGridLayout()
+        layout.addWidget(self.channels_list, 0, 0, 7, 1)
+        for row, (label, widget) in enumerate(
+            [
+                ("Parameter", self.parameter_combo),
+                ("Start", self.start_spin),
+                ("Stop", self.stop_spin),
+                ("Step", self.step_spin),
+                ("Dwell", self.dwell_spin),
+                ("Settle", self.settle_spin),
+            ]
+        ):
+            layout.addWidget(QLabel(label), row, 1)
+            layout.addWidget(widget, row, 2)
+        layout.addWidget(self.start_button, 6, 1)
+        layout.addWidget(self.abort_button, 6, 2)
+        layout.addWidget(self.progress_label, 7, 0, 1, 2)
+        layout.addWidget(self.save_button, 7, 2)
+        layout.addWidget(self.table, 8, 0, 1, 3)
+        self.setLayout(layout)
+
+    def make_spin(self, low, high, value, suffix=""):
+        spin_box = QDoubleSpinBox(self)
+        spin_box.setRange(low, high)
+        spin_box.setDecimals(2)
+        spin_box.setSingleStep(0.1)
+        spin_box.setValue(value)
+        spin_box.setSuffix(suffix)
+        return spin_box
+
+    def selected_channels(self):
+        return [
+            i
+            for i in range(self.channels_list.count())
+            if self.channels_list.item(i).checkState() == Qt.Checked
+        ]
+
+    def update_parameters(self):
+        current = self.parameter_combo.currentData()
+        channels = [self.controller.channels[ch] for ch in self.selected_channels()]
+        self.parameter_combo.clear()
+        for label, parameter in self.PARAMETER_LABELS:
+            if all(parameter in SweepEngine.channel_parameters(ch) for ch in channels):
+                self.parameter_combo.addItem(label, parameter)
+        self.parameter_combo.setCurrentIndex(
+            max(self.parameter_combo.findData(current), 0)
+        )
+
+    def start_sweep(self):
+        channels = self.selected_channels()
+        if not channels:
+            self.progress_label.setText("Select at least a channel")
+            return
+        parameter = self.parameter_combo.currentData()
+        if any(
+            parameter
+            not in SweepEngine.channel_parameters(self.controller.channels[ch])
+            for ch in channels
+        ):
+            self.progress_label.setText(
+                "The selected channels have different types, sweep Vg or select "
+                "channels of the same type"
+            )
+            return
+
+        self.table.setRowCount(0)
+        self.table.setColumnCount(2 + len(channels))
+        self.table.setHorizontalHeaderLabels(
+            ["Step", self.parameter_combo.currentText()]
+            + [self.controller.channels[ch]["name"] for ch in channels]
+        )
+
+        self.start_button.setEnabled(False)
+        self.abort_button.setEnabled(True)
+        self.engine.start(
+            channels,
+            parameter,
+            self.start_spin.value(),
+            self.stop_spin.value(),
+            self.step_spin.value(),
+            self.dwell_spin.value(),
+            self.settle_spin.value(),
+        )
+
+    def update_progress(self, k, value):
+        self.progress_label.setText(
+            f"Step {k + 1}/{len(self.engine.values)}: {value:.2f}"
+        )
+
+    def add_row(self, k, value, response):
+        row = self.table.rowCount()
+        self.table.insertRow(row)
+        self.table.setItem(row, 0, QTableWidgetItem(str(k + 1)))
+        self.table.setItem(row, 1, QTableWidgetItem(f"{value:.2f}"))
+        for i, mean in enumerate(response):
+            self.table.setItem(row, 2 + i, QTableWidgetItem(f"{mean:.6e}"))
+
+    def sweep_finished(self):
+        self.progress_label.setText(f"Done ({self.table.rowCount()} steps)")
+        self.start_button.setEnabled(True)
+        self.abort_button.setEnabled(False)
+
+    def save_table(self):
+        file, _ = QFileDialog.getSaveFileName(
+            self, "Save table", "sweep.csv", "CSV files (*.csv)"
+        )
+        if not file:
+            return
+
+        with open(file, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                [
+                    self.table.horizontalHeaderItem(c).text()
+                    for c in range(self.table.columnCount())
+                ]
+            )
+            for row in range(self.table.rowCount()):
+                writer.writerow(
+                    [
+                        self.table.item(row, c).text()
+                        for c in range(self.table.columnCount())
+                    ]
+                )
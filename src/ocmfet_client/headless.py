@@ -0,0 +1,449 @@
+"""
+Headless module
+
+This module runs the acquisition without Qt, for unattended long runs: the UDP client, the
+decoding, the streaming filters, the client-side recording and the metrics run on plain threads,
+driven by the same YAML configuration of the GUI and by a command script.
+
+Usage::
+
+    ocmfet_client --headless [script.yaml] [-c config.yaml] [--replay file] [--speed N]
+
+Script
+------
+The script is a YAML list of steps, each one a dictionary with a single key:
+
+- ``start``: start the acquisition and the stream (as the live window does)
+- ``stop``: stop the acquisition
+- ``send: <command>``: send a command to the server
+- ``wait: <s>``: wait
+- ``record: {name: <name>, duration: <s>, client: true}``: record on the server (and on the
+  client, unless client is false) for the given duration; the server files are saved every
+  max_record_time seconds
+- ``tag: <text>``: tag the recordings
+- ``bias: {channel: <ch>, vg: <V>, vs: <V>, id: <A>}``: change the bias of a channel (1-based)
+- ``repeat: {times: <n>, steps: [...]}``: repeat the steps
+
+Without a script, the acquisition is started and it runs until it is interrupted.
+
+If shm_name (broadcast_port) is set in the configuration, the samples (filtered as recorded) are
+also published in shared memory for other local processes (see the shm module), or re-broadcast
+over TCP (see the broadcast module).
+"""
+
+import logging
+import math
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+import oCPPmfet as oc
+import yaml
+
+from ocmfet_client.network.broadcast import BroadcastServer
+from ocmfet_client.network.capture import CaptureSocket, PacketCapture, ReplaySocket
+from ocmfet_client.network.shm import SharedRingPublisher
+from ocmfet_client.utils import config_path
+from ocmfet_client.utils.metrics import metrics
+from ocmfet_client.utils.processing import StreamingFilter, design_filters
+from ocmfet_client.utils.storage import StreamRecorder
+
+logger = logging.getLogger("ocmfet_client.headless")
+
+
+class HeadlessAcquisition:
+    """
+    HeadlessAcquisition
+
+    The receiver thread reads the data datagrams and queues them in chunks of bytes_to_emit
+    bytes; the processing thread decodes and filters the chunks and passes the samples to the
+    client-side recorder. If the processing falls behind and the queue is full, the chunks are
+    dropped and counted. The message thread logs the messages of the server.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration (the same of the GUI)
+
+    Attributes
+    ----------
+    dropped : scalar
+        Number of chunks dropped because the queue was full
+
+    n_samples : scalar
+        Number of samples per channel processed
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.host = config["server_ip"]
+        self.msg_port = config["msg_port"]
+        self.channels = config["channels"]
+        self.n_channels = len(self.channels)
+        self.fs = config["sample_rate"]
+        self.BUF_LEN = config["BUF_LEN"]
+        self.bytes_to_emit = self.n_channels * int(self.fs * 1e3 * 0.05) * 2  # 50 ms
+        self.log_interval = config.get("log_interval", 10)
+
+        replay = config.get("replay_file")
+        if replay:
+            speed = config.get("replay_speed", 1.0)
+            self.msg_socket = ReplaySocket(replay, b"M", speed)
+            self.data_socket = ReplaySocket(replay, b"D", speed)
+        else:
+            self.msg_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.data_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.msg_socket.bind(("", config["msg_port"]))
+            self.data_socket.bind(("", config["data_port"]))
+            self.msg_socket.settimeout(0.5)
+            self.data_socket.settimeout(0.5)
+
+        self.capture = None
+        if config.get("capture_file") and not replay:
+            self.capture = PacketCapture(config["capture_file"])
+            self.msg_socket = CaptureSocket(self.msg_socket, b"M", self.capture)
+            self.data_socket = CaptureSocket(self.data_socket, b"D", self.capture)
+
+        filters = design_filters(
+            self.fs,
+            (
+                config.get("bandpass")
+                if "bandpass" in config.get("headless_filters", [])
+                else None
+            ),
+            (
+                config.get("notch")
+                if "notch" in config.get("headless_filters", [])
+                else None
+            ),
+        )
+        self.filter = StreamingFilter(self.n_channels, filters)
+
+        self.queue = queue.Queue(maxsize=config.get("headless_queue", 256))
+        self.recorder = None
+        self.publisher = None
+        if config.get("shm_name"):
+            self.publisher = SharedRingPublisher(
+                config["shm_name"],
+                self.n_channels,
+                self.fs,
+                config.get("shm_seconds", 10),
+                [ch["name"] for ch in self.channels],
+            )
+        self.broadcast = None
+        if config.get("broadcast_port") is not None:
+            self.broadcast = BroadcastServer(
+                config["broadcast_port"],
+                self.n_channels,
+                self.fs,
+                [ch["name"] for ch in self.channels],
+                host=config.get("broadcast_host", "0.0.0.0"),
+                queue_size=config.get("broadcast_queue", 64),
+                filter_names=config.get("headless_filters", []),
+            )
+        self.lock = threading.Lock()
+        self.running = False
+        self.stopped = threading.Event()
+        self.dropped = 0
+        self.n_samples = 0
+        self.t_start = None
+        self.threads = [
+            threading.Thread(target=self.receive, name="receive", daemon=True),
+            threading.Thread(target=self.process, name="process", daemon=True),
+            threading.Thread(target=self.listen, name="messages", daemon=True),
+            threading.Thread(target=self.log_stats, name="stats", daemon=True),
+        ]
+
+    def start(self):
+        self.running = True
+        self.t_start = time.perf_counter()
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+        self.stopped.set()
+        self.msg_socket.close()
+        self.data_socket.close()
+        for thread in self.threads:
+            thread.join(timeout=2.0)
+        # The queued chunks are processed before closing the recording
+        self.stop_recording()
+        if self.publisher:
+            self.publisher.close()
+        if self.broadcast:
+            self.broadcast.close()
+        if self.capture:
+            self.capture.close()
+        self.log_summary()
+
+    def send(self, command):
+        logger.info("> %s", command)
+        self.msg_socket.sendto(command.encode(), (self.host, self.msg_port))
+
+    def receive(self):
+        chunk = []
+        n_bytes = 0
+        while self.running:
+            try:
+                with metrics.span("receive"):
+                    data = self.data_socket.recv(self.BUF_LEN)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            metrics.count("ingest_bytes", len(data))
+
+            chunk.append(data)
+            n_bytes += len(data)
+            if n_bytes >= self.bytes_to_emit:
+                try:
+                    self.queue.put_nowait(b"".join(chunk))
+                except queue.Full:
+                    self.dropped += 1
+                    metrics.count("dropped_chunks")
+                chunk = []
+                n_bytes = 0
+
+        if chunk:
+            self.queue.put(b"".join(chunk))
+
+    def process(self):
+        converter = oc.Converter(self.bytes_to_emit // 2)
+        remainder = np.empty(0)
+        while self.running or not self.queue.empty():
+            try:
+                chunk = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            with metrics.span("convert"):
+                converter.append(chunk)
+                samples = np.concatenate([remainder, converter.get_samples()])
+                converter.clear()
+            n = len(samples) // self.n_channels * self.n_channels
+            remainder = samples[n:]
+
+            with metrics.span("filter"):
+                data = self.filter.process(samples[:n].reshape(-1, self.n_channels).T)
+
+            with self.lock:
+                if self.recorder:
+                    self.recorder.write(data.T.ravel())
+            if self.publisher:
+                self.publisher.write(data.T.ravel())
+            if self.broadcast:
+                self.broadcast.write(data.T.ravel())
+            self.n_samples += n // self.n_channels
+            metrics.count("chunks_processed")
+
+    def listen(self):
+        while self.running:
+            try:
+                msg = self.msg_socket.recv(512)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            logger.info("< %s", msg.decode(errors="replace").strip())
+
+    def log_stats(self):
+        last = (time.perf_counter(), 0, 0)
+        while not self.stopped.wait(self.log_interval):
+            now = time.perf_counter()
+            n_bytes = metrics.totals.get("ingest_bytes", 0)
+            dt = now - last[0]
+            logger.info(
+                "%.1f kB/s, %.0f samples/s per channel, %d dropped chunks, %d missing samples",
+                (n_bytes - last[1]) / dt / 1e3,
+                (self.n_samples - last[2]) / dt,
+                self.dropped,
+                self.missing_samples(),
+            )
+            last = (now, n_bytes, self.n_samples)
+
+    def missing_samples(self):
+        """
+        Return the number of samples per channel missing with respect to the sample rate.
+        """
+        if self.t_start is None:
+            return 0
+        expected = (time.perf_counter() - self.t_start) * self.fs * 1e3
+        return max(int(expected) - self.n_samples, 0)
+
+    def log_summary(self):
+        elapsed = time.perf_counter() - self.t_start if self.t_start else 0.0
+        logger.info(
+            "Stopped after %.1f s: %d bytes, %d samples per channel, %d dropped chunks",
+            elapsed,
+            metrics.totals.get("ingest_bytes", 0),
+            self.n_samples,
+            self.dropped,
+        )
+        for name in ("receive", "convert", "filter"):
+            stats = metrics.stage_stats(name)
+            if stats["n"]:
+                logger.info("%s: %s", name, stats)
+
+    def start_recording(self, name):
+        recorder = StreamRecorder(
+            self.config.get("record_dir", "recordings"),
+            name,
+            self.n_channels,
+            self.fs,
+            self.config["max_record_time"],
+            self.config.get("fsync", "rollover"),
+            channels=self.channels,
+            format=self.config.get("record_format", "ocm"),
+        )
+        recorder.start()
+        with self.lock:
+            self.recorder = recorder
+
+    def stop_recording(self):
+        with self.lock:
+            recorder, self.recorder = self.recorder, None
+        if recorder:
+            recorder.stop()
+            logger.info("Recorded %s", ", ".join(recorder.files))
+
+    def tag(self, text):
+        self.send(f"tag {text}")
+        with self.lock:
+            if self.recorder:
+                self.recorder.tag(text)
+
+
+class ScriptRunner:
+    """
+    ScriptRunner
+
+    Runs the steps of a command script (see the module documentation) on a HeadlessAcquisition.
+
+    Parameters
+    ----------
+    acquisition : HeadlessAcquisition
+        Acquisition controlled by the script
+
+    stop_event : threading.Event
+        Event that interrupts the script
+    """
+
+    def __init__(self, acquisition, stop_event):
+        self.acquisition = acquisition
+        self.stop_event = stop_event
+
+    def wait(self, seconds):
+        return self.stop_event.wait(seconds)
+
+    def run(self, steps):
+        for step in steps:
+            if self.stop_event.is_set():
+                return
+            ((action, args),) = step.items()
+            logger.info("Step: %s %s", action, "" if args is None else args)
+            getattr(self, f"do_{action}")(args)
+
+    def do_start(self, args):
+        self.acquisition.send("start")
+        self.acquisition.send("stream")
+
+    def do_stop(self, args):
+        self.acquisition.send("stop")
+
+    def do_send(self, command):
+        self.acquisition.send(command)
+
+    def do_wait(self, seconds):
+        self.wait(seconds)
+
+    def do_tag(self, text):
+        self.acquisition.tag(text or "tag")
+
+    def do_bias(self, args):
+        channel = args["channel"]
+        for key in ("id", "vg", "vs"):
+            if key in args:
+                self.acquisition.send(f"{key}{channel:02} {args[key]:.2f}")
+
+    def do_repeat(self, args):
+        for _ in range(args["times"]):
+            self.run(args["steps"])
+
+    def do_record(self, args):
+        name = args.get("name", "data")
+        duration = args["duration"]
+        max_record_time = self.acquisition.config["max_record_time"]
+
+        self.acquisition.send("rec")
+        if args.get("client", True):
+            self.acquisition.start_recording(name)
+
+        # Save the server files every max_record_time seconds, as the live window does (a
+        # non-positive max_record_time records a single file)
+        if max_record_time > 0:
+            n_files = max(math.ceil(duration / max_record_time), 1)
+        else:
+            n_files, max_record_time = 1, duration
+        for k in range(n_files):
+            if self.wait(min(max_record_time, duration - k * max_record_time)):
+                break
+            if k < n_files - 1:
+                self.acquisition.send(f"save {name}")
+                self.acquisition.send("rec")
+
+        self.acquisition.send(f"save {name}")
+        self.acquisition.stop_recording()
+
+
+def main(argv=None):
+    """
+    Run the headless acquisition, see the module documentation for the options.
+    """
+    argv = sys.argv if argv is None else argv
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    config_file = argv[argv.index("-c") + 1] if "-c" in argv else config_path
+    config = yaml.safe_load(open(config_file))
+    for option, key, type_ in [
+        ("--capture", "capture_file", str),
+        ("--replay", "replay_file", str),
+        ("--speed", "replay_speed", float),
+    ]:
+        if option in argv:
+            config[key] = type_(argv[argv.index(option) + 1])
+
+    script = None
+    idx = argv.index("--headless") if "--headless" in argv else 0
+    if idx + 1 < len(argv) and not argv[idx + 1].startswith("-"):
+        script = yaml.safe_load(open(argv[idx + 1])) or []
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGINT, lambda *args: stop_event.set())
+    signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+
+    acquisition = HeadlessAcquisition(config)
+    acquisition.start()
+    runner = ScriptRunner(acquisition, stop_event)
+    try:
+        if script is None:
+            runner.do_start(None)
+            stop_event.wait()
+        else:
+            runner.run(script)
+    finally:
+        acquisition.stop()
+        if config.get("metrics_file"):
+            metrics.dump(config["metrics_file"])
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+"""
+Asyncio module
+
+This module contains an asyncio transport for the server, with the same public surface of
+MsgDataClient: the datagrams are received by asyncio.DatagramProtocol objects in the event loop,
+instead of blocking recv loops on two QThreads, so several clients (e.g., one per board) can share
+a single loop. The listeners still expose the Qt signals used by the GUI (emitted from the thread
+running the loop), and in addition:
+
+- the decoded data chunks can be consumed from an asyncio.Queue (AsyncDataListener.chunks);
+- the commands sent by AsyncMsgDataClient.command return an awaitable resolved by the reply of
+  the server (as matched by the command tracker).
+
+LoopThread runs the loop in a worker thread: the loop sleeps in its selector until a datagram is
+ready, the samples are decoded (and the sinks called) in that thread, and the signals reach the
+GUI thread through the Qt event loop, as with the QThread listeners.
+"""
+
+import asyncio
+import json
+import socket
+import threading
+
+import numpy as np
+import oCPPmfet as oc
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+
+from ocmfet_client.network.commands import CommandTracker
+from ocmfet_client.network.listeners import MessageAssembler
+from ocmfet_client.utils.metrics import metrics
+
+
+class DatagramListener(QObject, asyncio.DatagramProtocol):
+    """
+    Base class of the listeners. The asyncio transport reads a single datagram per readiness
+    event, so the other queued datagrams are read at once from the (non-blocking) socket.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.socket = None
+        self.capture = None
+
+    def datagram_received(self, data, addr):
+        self.handle(data)
+        while self.socket is not None:
+            try:
+                data = self.socket.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                return
+            self.handle(data)
+
+    def handle(self, data):
+        raise NotImplementedError
+
+
+class AsyncDataListener(DatagramListener):
+    """
+    Receives the data of the server in the event loop, and emits the decoded samples by
+    received_data (after calling the sinks), as DataListener does. If queue_size is given, the
+    samples are also put in the chunks queue; when it is full the oldest chunk is dropped.
+    """
+
+    received_data = pyqtSignal(np.ndarray)
+
+    def __init__(self, bytes_to_emit, queue_size=0):
+        super().__init__()
+        self.set_bytes_to_emit(bytes_to_emit)
+        self.listening = False
+        self.ptr = 0
+        self.sinks = []
+        self.chunks = asyncio.Queue(queue_size) if queue_size else None
+        self.dropped = 0
+
+    def add_sink(self, sink):
+        """Add a function called with the decoded samples."""
+        self.sinks = self.sinks + [sink]
+
+    def remove_sink(self, sink):
+        """Remove a function added by add_sink."""
+        self.sinks = [s for s in self.sinks if s is not sink]
+
+    def set_bytes_to_emit(self, n_bytes):
+        self.bytes_to_emit = int(n_bytes)
+        self.converter = oc.Converter(self.bytes_to_emit // 2)
+        self.ptr = 0
+
+    def handle(self, data):
+        if self.capture:
+            self.capture.write(b"D", data)
+        if not self.listening:
+            return
+        metrics.count("ingest_bytes", len(data))
+
+        self.converter.append(data)
+        self.ptr += len(data)
+        if self.ptr >= self.bytes_to_emit:
+            with metrics.span("convert"):
+                points = self.converter.get_samples()
+            for sink in self.sinks:
+                sink(points)
+            self.received_data.emit(points)
+            if self.chunks is not None:
+                if self.chunks.full():
+                    self.chunks.get_nowait()
+                    self.dropped += 1
+                self.chunks.put_nowait(points)
+            metrics.count("chunks_emitted")
+            self.converter.clear()
+            self.ptr = 0
+
+    def start_listening(self):
+        self.listening = True
+
+    def stop_listening(self):
+        self.listening = False
+
+
+class AsyncMessageListener(DatagramListener):
+    """
+    Receives the messages of the server in the event loop, and emits them by received_msg and
+    received_json, as MessageListener does.
+    """
+
+    received_msg = pyqtSignal(str)
+    received_json = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.listening = True
+        self.assembler = MessageAssembler()
+
+    def handle(self, data):
+        if self.capture:
+            self.capture.write(b"M", data)
+        if not self.listening:
+            return
+        msg = data.decode()
+        self.received_msg.emit(msg)
+        message = self.assembler.feed(msg)
+        if message is not None and message.lstrip().startswith(("{", "[")):
+            try:
+                self.received_json.emit(json.loads(message))
+            except json.JSONDecodeError:
+                pass
+
+    def start_listening(self):
+        self.listening = True
+
+    def stop_listening(self):
+        self.listening = False
+
+
+class AsyncMsgDataClient:
+    """
+    Asyncio client of the message and data ports of the server, with the same public surface of
+    MsgDataClient (data_len is accepted for compatibility, the datagrams are received whole).
+
+    The endpoints are opened by open (awaitable) or by start_listening (scheduled on the loop, from
+    any thread).
+
+    Parameters
+    ----------
+    host : str
+        Address of the server
+
+    msg_port : scalar
+        Message port
+
+    data_port : scalar
+        Data port
+
+    data_len : scalar
+        Not used
+
+    bytes_to_emit : scalar
+        Number of bytes decoded at once
+
+    msg_len : scalar
+        Not used
+
+    queue_size : scalar
+        Size of the queue of the data chunks (0 to disable it)
+
+    loop : asyncio.AbstractEventLoop, optional
+        Event loop. Default: the current one
+    """
+
+    def __init__(
+        self,
+        host,
+        msg_port,
+        data_port,
+        data_len=None,
+        bytes_to_emit=1024,
+        msg_len=512,
+        queue_size=0,
+        loop=None,
+    ):
+        self.host = host
+        self.msg_port = msg_port
+        self.data_port = data_port
+        self.loop = loop or asyncio.get_event_loop()
+        self.capture = None
+        self.transports = []
+
+        self.msg_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.data_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.msg_socket.bind(("", self.msg_port))
+        self.data_socket.bind(("", self.data_port))
+
+        self.msg_listener = AsyncMessageListener()
+        self.data_listener = AsyncDataListener(bytes_to_emit, queue_size)
+
+        self.commands = CommandTracker(self.send_message)
+        self.msg_listener.received_msg.connect(self.commands.handle_reply)
+        self.futures = {}  # Futures of the commands sent by command, by command id
+        self.futures_lock = threading.Lock()
+        self.commands.confirmed.connect(self.resolve_command)
+        self.commands.failed.connect(self.resolve_command)
+
+    async def open(self):
+        """
+        Open the datagram endpoints on the loop.
+        """
+        if self.transports:
+            return
+        for sock, protocol in [
+            (self.msg_socket, self.msg_listener),
+            (self.data_socket, self.data_listener),
+        ]:
+            transport, _ = await self.loop.create_datagram_endpoint(
+                lambda protocol=protocol: protocol, sock=sock
+            )
+            protocol.socket = sock
+            self.transports.append(transport)
+
+    def start_listening(self):
+        asyncio.run_coroutine_threadsafe(self.open(), self.loop)
+
+    def in_loop(self):
+        """Return True if called from the thread running the loop."""
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def start_capture(self, file):
+        """
+        Start capturing the received data and messages to a file (see the capture module).
+        """
+        from ocmfet_client.network.capture import PacketCapture
+
+        if self.capture is None:
+            self.capture = PacketCapture(file)
+            self.msg_listener.capture = self.capture
+            self.data_listener.capture = self.capture
+
+    def stop_capture(self):
+        if self.capture:
+            self.msg_listener.capture = None
+            self.data_listener.capture = None
+            self.capture.close()
+            self.capture = None
+
+    def replay_stats(self):
+        # The replay is available with MsgDataClient only
+        return None
+
+    def send_message(self, msg):
+        self.msg_socket.sendto(msg.encode(), (self.host, self.msg_port))
+
+    def command(self, msg, retries=None):
+        """
+        Send a command through the command tracker and return an awaitable resolved by its reply,
+        or raising asyncio.TimeoutError if it fails (after the timeout and the retries of the
+        tracker). It can be called from any thread.
+        """
+        future = self.loop.create_future()
+        # The reply can be handled before the future is stored, the lock keeps it waiting
+        with self.futures_lock:
+            command = self.commands.send(msg, retries)
+            self.futures[command["id"]] = future
+        return future
+
+    def resolve_command(self, command):
+        with self.futures_lock:
+            future = self.futures.pop(command["id"], None)
+        if future is not None:
+            self.loop.call_soon_threadsafe(self.settle, future, command)
+
+    @staticmethod
+    def settle(future, command):
+        if future.done():
+            return
+        if command["status"] == "confirmed":
+            future.set_result(command["reply"])
+        else:
+            future.set_exception(
+                asyncio.TimeoutError(f"No reply to {command['text']!r}")
+            )
+
+    def close_transports(self):
+        for transport in self.transports:
+            transport.close()
+        self.transports = []
+        self.msg_listener.socket = None
+        self.data_listener.socket = None
+
+    def close(self):
+        self.commands.timer.stop()
+        self.stop_capture()
+        with self.futures_lock:
+            futures, self.futures = list(self.futures.values()), {}
+        for future in futures:
+            self.loop.call_soon_threadsafe(future.cancel)
+
+        if self.loop.is_running() and not self.in_loop():
+            # The transports are closed in the thread of the loop
+            closed = threading.Event()
+            self.loop.call_soon_threadsafe(
+                lambda: (self.close_transports(), closed.set())
+            )
+            closed.wait(1.0)
+        else:
+            self.close_transports()
+        self.msg_socket.close()
+        self.data_socket.close()
+
+
+class LoopThread(QThread):
+    """
+    Runs an asyncio event loop in a worker thread, until stop is called.
+
+    Parameters
+    ----------
+    loop : asyncio.AbstractEventLoop, optional
+        Event loop. Default: a new loop
+    """
+
+    def __init__(self, loop=None, parent=None):
+        super().__init__(parent)
+        self.loop = loop or asyncio.new_event_loop()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self):
+        if self.isRunning():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.wait()
+        self.loop.close()
@@ -0,0 +1,478 @@
+"""
+Broadcast module
+
+This module re-broadcasts the live stream (optionally filtered) over TCP to other machines. The
+BroadcastServer is fed with the decoded samples as a sink of the data listener, and each
+subscriber can request its own decimation and channels. A slow subscriber never slows the
+acquisition: the chunks are handed to a fan-out thread, and each subscriber has its own sender
+thread and a bounded queue from which the oldest chunks are dropped.
+
+Protocol
+--------
+Every message of the server is a frame: a header (FRAME) with the magic b"OCMB", the kind (u16),
+the number of channels (u16) and of samples (u32), the index of the first sample (u64, at the
+rate of the subscriber), the number of chunks dropped for the subscriber so far (u32) and the
+length of the payload (u32), followed by the payload:
+
+- INFO frames: a JSON document with the channels, the sample rate in kHz (after the decimation),
+  the decimation and the filters, sent at the connection and after each request. If a request is
+  not valid, the configuration is unchanged and the document also has its error;
+- DATA frames: the samples as little-endian float32, interleaved (n_samples, n_channels).
+
+A subscriber sends its requests as JSON lines, e.g. ``{"decimate": 10, "channels": [0, 2]}``.
+BroadcastClient implements the subscriber side::
+
+    client = BroadcastClient("192.168.1.10", 9000, decimate=10)
+    for index, data in client:  # data has shape (n_channels, n_samples)
+        ...
+"""
+
+import json
+import select
+import socket
+import struct
+import threading
+from collections import deque
+
+import numpy as np
+from scipy.signal import butter
+
+from ocmfet_client.utils.processing import StreamingFilter
+
+FRAME = struct.Struct("<4sHHIQII")
+FRAME_MAGIC = b"OCMB"
+INFO = 0
+DATA = 1
+
+
+def frame(kind, n_channels, n_samples, index, dropped, payload):
+    return (
+        FRAME.pack(
+            FRAME_MAGIC, kind, n_channels, n_samples, index, dropped, len(payload)
+        )
+        + payload
+    )
+
+
+class Subscriber(threading.Thread):
+    """
+    Subscriber
+
+    Sends the stream to a connected client, from its own thread. The chunks are queued by
+    BroadcastServer.fanout; when the queue is full the oldest chunk is dropped. The decimation
+    (with an anti-aliasing low-pass filter) and the selection of the channels are done in this
+    thread.
+
+    Parameters
+    ----------
+    server : BroadcastServer
+        Server of the subscriber
+
+    connection : socket.socket
+        Connected socket
+
+    address : tuple
+        Address of the client
+
+    queue_size : scalar
+        Number of chunks queued before dropping the oldest ones
+    """
+
+    def __init__(self, server, connection, address, queue_size):
+        super().__init__(daemon=True)
+        self.server = server
+        self.connection = connection
+        self.address = address
+        self.queue = deque(maxlen=queue_size)
+        self.condition = threading.Condition()
+        self.running = True
+        self.dropped = 0
+        self.sent = 0
+        self.requests = b""
+        self.configure(1, None)
+
+    def configure(self, decimate, channels):
+        self.decimate = max(int(decimate), 1)
+        self.channels = (
+            list(range(self.server.n_channels)) if channels is None else list(channels)
+        )
+        self.filter = None
+        if self.decimate > 1:
+            b, a = butter(4, 0.8 / self.decimate)
+            self.filter = StreamingFilter(len(self.channels), [(b, a)])
+
+    def info(self):
+        return {
+            "channels": [self.server.channels[ch] for ch in self.channels],
+            "fs": self.server.fs / self.decimate,
+            "decimate": self.decimate,
+            "filters": self.server.filter_names,
+        }
+
+    def put(self, index, data):
+        """
+        Queue a chunk (called from the fan-out thread).
+        """
+        with self.condition:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append((index, data))
+            self.condition.notify()
+
+    def run(self):
+        try:
+            self.send_info()
+            while self.running:
+                self.read_requests()
+                with self.condition:
+                    if not self.queue:
+                        self.condition.wait(0.1)
+                    chunks = list(self.queue)
+                    self.queue.clear()
+                for index, data in chunks:
+                    self.send(index, data)
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.running = False
+            self.connection.close()
+            self.server.remove(self)
+
+    def read_requests(self):
+        readable, _, _ = select.select([self.connection], [], [], 0)
+        if not readable:
+            return
+        data = self.connection.recv(4096)
+        if not data:
+            raise OSError("Connection closed by the subscriber")
+
+        self.requests += data
+        *lines, self.requests = self.requests.split(b"\n")
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                self.configure(*self.parse_request(line))
+            except ValueError as e:
+                self.send_info(error=str(e))
+            else:
+                self.send_info()
+
+    def parse_request(self, line):
+        """
+        Return the decimation and the channels of a request, or raise ValueError if it is not
+        valid.
+        """
+        try:
+            request = json.loads(line)
+        except ValueError:
+            raise ValueError(f"Invalid request {line[:100]!r}") from None
+        if not isinstance(request, dict):
+            raise ValueError("The request must be a JSON object")
+
+        decimate = request.get("decimate", self.decimate)
+        if not isinstance(decimate, int) or isinstance(decimate, bool) or decimate < 1:
+            raise ValueError(f"Invalid decimation {decimate!r}")
+
+        channels = request.get("channels", self.channels)
+        if channels is not None:
+            if (
+                not isinstance(channels, list)
+                or not channels
+                or any(
+                    not isinstance(ch, int)
+                    or isinstance(ch, bool)
+                    or not 0 <= ch < self.server.n_channels
+                    for ch in channels
+                )
+            ):
+                raise ValueError(
+                    f"Invalid channels {channels!r} "
+                    f"({self.server.n_channels} channels available)"
+                )
+        return decimate, channels
+
+    def send_info(self, error=None):
+        info = self.info()
+        if error is not None:
+            info["error"] = error
+        payload = json.dumps(info).encode()
+        self.connection.sendall(
+            frame(INFO, len(self.channels), 0, 0, self.dropped, payload)
+        )
+
+    def send(self, index, data):
+        data = data[self.channels]
+        if self.filter:
+            data = self.filter.process(data)
+        # Keep the samples whose index is a multiple of the decimation
+        first = -index % self.decimate
+        data = data[:, first :: self.decimate]
+        if data.shape[1] == 0:
+            return
+
+        payload = np.ascontiguousarray(data.T, dtype="<f4").tobytes()
+        self.connection.sendall(
+            frame(
+                DATA,
+                data.shape[0],
+                data.shape[1],
+                (index + first) // self.decimate,
+                self.dropped,
+                payload,
+            )
+        )
+        self.sent += 1
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify()
+
+
+class BroadcastServer:
+    """
+    BroadcastServer
+
+    TCP server re-broadcasting the live stream. The write method has the signature of the sinks
+    of the data listeners: it only queues the samples, which are filtered and handed to the
+    subscribers by the fan-out thread.
+
+    Parameters
+    ----------
+    port : scalar
+        TCP port (0 to pick a free one)
+
+    n_channels : scalar
+        Number of channels
+
+    fs : scalar
+        Sample rate in kHz
+
+    channels : list, optional
+        Names of the channels
+
+    host : str
+        Address the server is bound to
+
+    queue_size : scalar
+        Number of chunks queued for each subscriber (and for the fan-out thread) before dropping
+        the oldest ones
+
+    filters : list
+        List of tuples (b, a) with the coefficients of the filters applied before the
+        broadcast (see design_filters)
+
+    filter_names : list
+        Names of the filters, sent to the subscribers
+
+    Attributes
+    ----------
+    port : scalar
+        Port the server is bound to
+
+    subscribers : list
+        Connected subscribers
+
+    dropped : scalar
+        Number of chunks dropped by the fan-out thread
+
+    index : scalar
+        Number of samples per channel received since the start
+    """
+
+    def __init__(
+        self,
+        port,
+        n_channels,
+        fs,
+        channels=None,
+        host="0.0.0.0",
+        queue_size=64,
+        filters=[],
+        filter_names=[],
+    ):
+        self.n_channels = n_channels
+        self.fs = fs
+        self.channels = channels or [f"Ch. {i + 1}" for i in range(n_channels)]
+        self.queue_size = queue_size
+        self.filter = StreamingFilter(n_channels, filters)
+        self.filter_names = filter_names
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, port))
+        self.socket.listen()
+        self.port = self.socket.getsockname()[1]
+
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.queue = deque(maxlen=queue_size)
+        self.condition = threading.Condition()
+        self.dropped = 0
+        self.index = 0
+        self.running = True
+        self.threads = [
+            threading.Thread(target=self.accept, name="broadcast", daemon=True),
+            threading.Thread(target=self.fanout, name="fanout", daemon=True),
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def write(self, points):
+        """
+        Queue new samples for the broadcast.
+
+        Parameters
+        ----------
+        points : array-like
+            Samples in the form [ch1_sample1, ch2_sample1, ..., ch1_sample2, ...]
+        """
+        index = self.index
+        self.index += len(points) // self.n_channels
+        if not self.subscribers:
+            return
+        with self.condition:
+            if len(self.queue) == self.queue.maxlen:
+                self.dropped += 1
+            self.queue.append((index, points))
+            self.condition.notify()
+
+    def accept(self):
+        while self.running:
+            try:
+                connection, address = self.socket.accept()
+            except OSError:
+                break
+            connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            subscriber = Subscriber(self, connection, address, self.queue_size)
+            with self.lock:
+                self.subscribers = self.subscribers + [subscriber]
+            subscriber.start()
+
+    def fanout(self):
+        while self.running:
+            with self.condition:
+                if not self.queue:
+                    self.condition.wait(0.1)
+                chunks = list(self.queue)
+                self.queue.clear()
+
+            for index, points in chunks:
+                m = len(points) // self.n_channels
+                data = np.asarray(points[: m * self.n_channels])
+                data = self.filter.process(data.reshape(m, self.n_channels).T)
+                for subscriber in self.subscribers:
+                    subscriber.put(index, data)
+
+    def remove(self, subscriber):
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s is not subscriber]
+
+    def stats(self):
+        """
+        Return the statistics of each subscriber: its address, decimation, and the number of
+        chunks sent and dropped.
+        """
+        return [
+            {
+                "address": f"{s.address[0]}:{s.address[1]}",
+                "decimate": s.decimate,
+                "sent": s.sent,
+                "dropped": s.dropped,
+            }
+            for s in self.subscribers
+        ]
+
+    def close(self):
+        self.running = False
+        self.socket.close()
+        with self.condition:
+            self.condition.notify()
+        for subscriber in self.subscribers:
+            subscriber.stop()
+        for thread in self.threads:
+            thread.join(timeout=1.0)
+
+
+class BroadcastClient:
+    """
+    BroadcastClient
+
+    Subscriber of a BroadcastServer. Iterating over it yields the index of the first sample and
+    the samples (n_channels, n_samples) of each data frame.
+
+    Parameters
+    ----------
+    host : str
+        Address of the server
+
+    port : scalar
+        Port of the server
+
+    decimate : scalar
+        Decimation requested
+
+    channels : list, optional
+        Indices of the channels requested. Default: all the channels
+
+    Attributes
+    ----------
+    info : dict
+        Last INFO document of the server (channels, fs, decimation and filters)
+
+    dropped : scalar
+        Number of chunks dropped by the server for this subscriber
+    """
+
+    def __init__(self, host, port, decimate=1, channels=None):
+        self.socket = socket.create_connection((host, port))
+        self.file = self.socket.makefile("rb")
+        self.info = None
+        self.dropped = 0
+        self.read_frame()  # Info at the connection
+        if decimate != 1 or channels is not None:
+            self.request(decimate=decimate, channels=channels)
+
+    def request(self, **request):
+        """
+        Send a request (decimate, channels), and wait for the updated info. Raise ValueError if
+        the server refuses the request.
+        """
+        request = {k: v for k, v in request.items() if v is not None}
+        self.socket.sendall(json.dumps(request).encode() + b"\n")
+        while self.read_frame()[0] != INFO:
+            pass
+        if "error" in self.info:
+            raise ValueError(self.info["error"])
+
+    def read_frame(self):
+        header = self.file.read(FRAME.size)
+        if len(header) < FRAME.size:
+            raise EOFError("Connection closed by the server")
+        magic, kind, n_channels, n_samples, index, dropped, length = FRAME.unpack(
+            header
+        )
+        if magic != FRAME_MAGIC:
+            raise ValueError("Invalid frame")
+        payload = self.file.read(length)
+        self.dropped = dropped
+
+        if kind == INFO:
+            self.info = json.loads(payload)
+            return INFO, None, None
+        data = np.frombuffer(payload, "<f4").reshape(n_samples, n_channels).T
+        return DATA, index, data
+
+    def __iter__(self):
+        while True:
+            try:
+                kind, index, data = self.read_frame()
+            except EOFError:
+                return
+            if kind == DATA:
+                yield index, data
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
@@ -0,0 +1,282 @@
+"""
+Capture module
+
+This module contains the classes for capturing the datagrams received from the server to a file,
+and for replaying them through the same listeners, at the original speed, N times faster or as
+fast as possible. Replaying the data as fast as possible is also a reproducible benchmark of the
+ingest path::
+
+    python -m ocmfet_client.network.capture <file> [--speed 0] [--bytes-to-emit 1024]
+
+Format
+------
+A capture file starts with the magic b"OCMCAP01", followed by a record for each datagram: the kind
+(b"D" for data, b"M" for messages), the receive timestamp in s (float64) and the length (u32) of
+the payload, and the payload.
+"""
+
+import struct
+import threading
+import time
+
+CAP_MAGIC = b"OCMCAP01"
+RECORD = struct.Struct("<cdI")
+
+
+class PacketCapture:
+    """
+    PacketCapture
+
+    Writes the datagrams to a capture file. It can be shared by the listener threads.
+
+    Parameters
+    ----------
+    file : str
+        Path of the capture file
+
+    Attributes
+    ----------
+    n_packets : scalar
+        Number of datagrams captured
+
+    n_bytes : scalar
+        Number of payload bytes captured
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.n_packets = 0
+        self.n_bytes = 0
+        self.lock = threading.Lock()
+        self.f = open(file, "wb", buffering=1 << 20)
+        self.f.write(CAP_MAGIC)
+
+    def write(self, kind, data, timestamp=None):
+        """
+        Write a datagram of the given kind (b"D" or b"M").
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            if self.f.closed:
+                return
+            self.f.write(RECORD.pack(kind, timestamp, len(data)))
+            self.f.write(data)
+            self.n_packets += 1
+            self.n_bytes += len(data)
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+
+class CaptureSocket:
+    """
+    CaptureSocket
+
+    Wraps a socket and writes every received datagram to a PacketCapture. The other attributes
+    are forwarded to the socket.
+
+    Parameters
+    ----------
+    socket : socket.socket
+        Wrapped socket
+
+    kind : bytes
+        Kind of the captured datagrams (b"D" or b"M")
+
+    capture : PacketCapture
+        Capture file
+    """
+
+    def __init__(self, socket, kind, capture):
+        self.socket = socket
+        self.kind = kind
+        self.capture = capture
+
+    def recv(self, bufsize):
+        data = self.socket.recv(bufsize)
+        self.capture.write(self.kind, data)
+        return data
+
+    def __getattr__(self, name):
+        return getattr(self.socket, name)
+
+
+def read_capture(file, kinds=(b"D", b"M")):
+    """
+    Iterate over the datagrams of a capture file.
+
+    Parameters
+    ----------
+    file : str
+        Path of the capture file
+
+    kinds : tuple
+        Kinds of the returned datagrams
+
+    Yields
+    ------
+    kind : bytes
+        Kind of the datagram
+
+    timestamp : scalar
+        Receive timestamp in s
+
+    data : bytes
+        Payload
+    """
+    with open(file, "rb") as f:
+        if f.read(len(CAP_MAGIC)) != CAP_MAGIC:
+            raise ValueError(f"{file} is not a capture file")
+        while header := f.read(RECORD.size):
+            if len(header) < RECORD.size:
+                break  # Truncated capture
+            kind, timestamp, length = RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                break
+            if kind in kinds:
+                yield kind, timestamp, data
+
+
+class ReplaySocket:
+    """
+    ReplaySocket
+
+    Socket-like source that returns the datagrams of a capture file from recv, paced by their
+    receive timestamps. It replaces the socket of a listener, so the replayed datagrams go through
+    the same ingest path of the live ones. If the replay falls behind by more than max_lag (e.g.,
+    when the listener is paused) the clock is re-anchored instead of bursting to catch up. At the
+    end of the file recv blocks until the socket is closed.
+
+    Parameters
+    ----------
+    file : str
+        Path of the capture file
+
+    kind : bytes
+        Kind of the replayed datagrams (b"D" or b"M")
+
+    speed : scalar
+        Replay speed (1 for real time, N for N times faster, 0 for as fast as possible)
+
+    max_lag : scalar
+        Maximum delay in s of the replay before re-anchoring the clock
+
+    Attributes
+    ----------
+    finished : threading.Event
+        Set when all the datagrams have been returned
+    """
+
+    def __init__(self, file, kind=b"D", speed=1.0, max_lag=1.0):
+        self.file = file
+        self.kind = kind
+        self.speed = speed
+        self.max_lag = max_lag
+        self.packets = read_capture(file, (kind,))
+        self.closed = threading.Event()
+        self.finished = threading.Event()
+
+        self.n_packets = 0
+        self.n_bytes = 0
+        self.t0 = None
+        self.wall0 = None
+        self.start_time = None
+        self.end_time = None
+
+    def recv(self, bufsize):
+        packet = next(self.packets, None)
+        if packet is None:
+            if not self.finished.is_set():
+                self.end_time = time.perf_counter()
+                self.finished.set()
+            self.closed.wait()
+            raise OSError("Replay socket closed")
+
+        _, timestamp, data = packet
+        now = time.perf_counter()
+        if self.start_time is None:
+            self.start_time = now
+        if self.speed > 0:
+            if self.t0 is None:
+                self.t0, self.wall0 = timestamp, now
+            due = self.wall0 + (timestamp - self.t0) / self.speed
+            if now - due > self.max_lag:
+                self.t0, self.wall0 = timestamp, now
+            elif due > now:
+                time.sleep(due - now)
+
+        self.n_packets += 1
+        self.n_bytes += len(data)
+        return data[:bufsize]
+
+    def sendto(self, data, address):
+        # The commands are not sent while replaying
+        return len(data)
+
+    def close(self):
+        self.closed.set()
+
+    def stats(self):
+        """
+        Return the statistics of the replay.
+
+        Returns
+        -------
+        stats : dict
+            Number of datagrams and bytes replayed, elapsed time in s, throughput in B/s and
+            datagrams/s
+        """
+        if self.start_time is None:
+            return {
+                "packets": 0,
+                "bytes": 0,
+                "elapsed": 0.0,
+                "throughput": 0.0,
+                "rate": 0.0,
+            }
+        end = self.end_time or time.perf_counter()
+        elapsed = max(end - self.start_time, 1e-9)
+        return {
+            "packets": self.n_packets,
+            "bytes": self.n_bytes,
+            "elapsed": elapsed,
+            "throughput": self.n_bytes / elapsed,
+            "rate": self.n_packets / elapsed,
+        }
+
+
+def benchmark(file, bytes_to_emit=1024, BUF_LEN=32, speed=0):
+    """
+    Replay the data of a capture file through a DataListener and return the replay statistics
+    and the metrics of the ingest stages.
+    """
+    from ocmfet_client.network.listeners import DataListener
+    from ocmfet_client.utils.metrics import metrics
+
+    metrics.reset()
+    replay = ReplaySocket(file, b"D", speed)
+    listener = DataListener(replay, BUF_LEN, bytes_to_emit)
+    listener.start_listening()
+    listener.start()
+    replay.finished.wait()
+    stats = replay.stats()
+    listener.terminate()
+    listener.wait()
+    return stats, metrics.summary()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Replay benchmark of a capture file")
+    parser.add_argument("file", help="capture file")
+    parser.add_argument("--speed", type=float, default=0)
+    parser.add_argument("--bytes-to-emit", type=int, default=1024)
+    parser.add_argument("--buf-len", type=int, default=32)
+    args = parser.parse_args()
+
+    stats, summary = benchmark(args.file, args.bytes_to_emit, args.buf_len, args.speed)
+    print(json.dumps({"replay": stats, "metrics": summary}, indent=2))
@@ -0,0 +1,192 @@
+"""
+Commands module
+
+This module contains the CommandTracker class, which tracks the commands sent to the server until
+they are confirmed by a reply, retrying them on timeout, and measures their round-trip latency.
+
+The replies of the server do not carry the command they answer, so they are matched to the
+outstanding commands in order (FIFO). In this mode the commands are never sent again: the late
+reply to the first attempt and the reply to the retransmission would confirm two commands, so all
+the commands must be sent through the tracker, and a command without reply fails at its timeout.
+If the server supports request IDs, the commands are sent as ``@<id> <command>`` and the replies
+starting with ``@<id>`` are matched by ID, so the replies to untracked commands (or unsolicited
+messages) cannot be mistaken for confirmations, and the commands are retried on timeout.
+"""
+
+import itertools
+import re
+import threading
+import time
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from ocmfet_client.utils.metrics import metrics
+
+
+class CommandTracker(QObject):
+    """
+    CommandTracker
+
+    Each command is a dictionary with its id, text, type (the first word without the channel
+    number, e.g., "vg" for "vg01 0.50"), status ("pending", "confirmed" or "failed"), number of
+    attempts, reply and round-trip time (from the last attempt, in ms). The round-trip times are
+    also recorded in the metrics as the stages rtt_<type>.
+
+    Parameters
+    ----------
+    send : callable
+        Function sending a message to the server
+
+    timeout : scalar
+        Time in s after which a command without reply is sent again (or fails)
+
+    retries : scalar
+        Default number of retries after the first attempt (with request IDs only)
+
+    use_ids : bool
+        If True, the commands are tagged with request IDs
+
+    Signals
+    -------
+    confirmed : dict
+        Emitted with the command when its reply is received
+
+    failed : dict
+        Emitted with the command when all the attempts timed out
+    """
+
+    confirmed = pyqtSignal(object)
+    failed = pyqtSignal(object)
+
+    ID = re.compile(r"@(\d+)\s?")
+
+    def __init__(self, send, timeout=1.0, retries=2, use_ids=False, parent=None):
+        super().__init__(parent)
+        self.send_message = send
+        self.timeout = timeout
+        self.retries = retries
+        self.use_ids = use_ids
+
+        self.ids = itertools.count(1)
+        self.pending = {}  # In order of sending
+        self.counts = {}
+        # The commands can be sent from any thread (e.g., the one of an asyncio loop)
+        self.lock = threading.Lock()
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.check_timeouts)
+        self.timer.start(50)
+
+    @staticmethod
+    def command_type(text):
+        return re.sub(r"\d+$", "", text.split()[0]) if text.split() else ""
+
+    def send(self, text, retries=None):
+        """
+        Send a command and track it.
+
+        Parameters
+        ----------
+        text : str
+            Command
+
+        retries : scalar, optional
+            Number of retries with request IDs (0 for the commands that must not be repeated,
+            e.g., toggles). Default: the retries of the tracker
+
+        Returns
+        -------
+        command : dict
+            Tracked command
+        """
+        command = {
+            "id": next(self.ids),
+            "text": text,
+            "type": self.command_type(text),
+            "status": "pending",
+            "retries": self.retries if retries is None else retries,
+            "attempts": 0,
+            "reply": None,
+            "rtt": None,
+        }
+        with self.lock:
+            self.pending[command["id"]] = command
+            self.count(command["type"], "sent")
+            self.transmit(command)
+        return command
+
+    def transmit(self, command):
+        command["attempts"] += 1
+        command["t_sent"] = time.perf_counter_ns()
+        if command["attempts"] > 1:
+            self.count(command["type"], "retries")
+        if self.use_ids:
+            self.send_message(f"@{command['id']} {command['text']}")
+        else:
+            self.send_message(command["text"])
+
+    def handle_reply(self, msg):
+        """
+        Match a reply of the server to an outstanding command.
+        """
+        with self.lock:
+            if not self.pending:
+                return
+
+            if self.use_ids:
+                match = self.ID.match(msg)
+                if not match or int(match.group(1)) not in self.pending:
+                    return
+                command = self.pending.pop(int(match.group(1)))
+                msg = msg[match.end() :]
+            else:
+                command = self.pending.pop(next(iter(self.pending)))
+
+            rtt = time.perf_counter_ns() - command["t_sent"]
+            metrics.record(f"rtt_{command['type']}", rtt)
+            command["rtt"] = rtt / 1e6
+            command["reply"] = msg
+            command["status"] = "confirmed"
+            self.count(command["type"], "confirmed")
+        self.confirmed.emit(command)
+
+    def check_timeouts(self):
+        now = time.perf_counter_ns()
+        failed = []
+        with self.lock:
+            for command in list(self.pending.values()):
+                if now - command["t_sent"] < self.timeout * 1e9:
+                    continue
+                # Without IDs a retransmission would shift the FIFO matching of the replies
+                if self.use_ids and command["attempts"] <= command["retries"]:
+                    self.transmit(command)
+                else:
+                    del self.pending[command["id"]]
+                    command["status"] = "failed"
+                    self.count(command["type"], "timeouts")
+                    failed.append(command)
+        for command in failed:
+            self.failed.emit(command)
+
+    def count(self, command_type, name):
+        counts = self.counts.setdefault(
+            command_type, {"sent": 0, "confirmed": 0, "retries": 0, "timeouts": 0}
+        )
+        counts[name] += 1
+
+    def stats(self):
+        """
+        Return the statistics of each command type: the number of commands sent, confirmed,
+        retried and timed out, and the round-trip time statistics (see Metrics.stage_stats).
+        """
+        return {
+            command_type: dict(counts, rtt=metrics.stage_stats(f"rtt_{command_type}"))
+            for command_type, counts in self.counts.items()
+        }
+
+    def clear(self):
+        """
+        Forget the outstanding commands.
+        """
+        with self.lock:
+            self.pending = {}
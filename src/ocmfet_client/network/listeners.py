@@ -1,22 +1,147 @@
+import json
+import re
+import time
+
 import numpy as np
 import oCPPmfet as oc
 from PyQt5.QtCore import QThread, pyqtSignal
 
+from ocmfet_client.utils.metrics import metrics
+
+
+class MessageAssembler:
+    """
+    MessageAssembler
+
+    Reassembles the messages split by the server in several datagrams. Two kinds of messages are
+    supported:
+
+    - framed messages, whose datagrams start with the header ``#<id>:<seq>/<total>|`` (seq from 1
+      to total), reassembled by sequence number (also if reordered);
+    - JSON documents sent in consecutive datagrams without header, whose end is detected by
+      tracking the nesting of brackets (outside strings) incrementally, so each datagram is
+      scanned only once.
+
+    Any other datagram is a complete message.
+
+    Parameters
+    ----------
+    timeout : scalar
+        Time in s after which an incomplete message is discarded
+    """
+
+    FRAME = re.compile(r"#(\w+):(\d+)/(\d+)\|")
+    TOKENS = re.compile(r'[{}\[\]"\\]')
+
+    def __init__(self, timeout=2.0):
+        self.timeout = timeout
+        self.frames = {}
+        self.reset()
+
+    def reset(self):
+        """
+        Discard the incomplete messages.
+        """
+        self.parts = []
+        self.depth = 0
+        self.in_string = False
+        self.escaped = -1  # Position of the escaped character in the next datagram
+        self.t_last = 0.0
+        self.frames.clear()
+
+    def feed(self, msg):
+        """
+        Feed a datagram.
+
+        Parameters
+        ----------
+        msg : str
+            Received datagram
+
+        Returns
+        -------
+        message : str or None
+            The complete message, or None if the message is not complete yet
+        """
+        now = time.monotonic()
+        if now - self.t_last > self.timeout:
+            self.reset()
+        self.t_last = now
+
+        m = self.FRAME.match(msg)
+        if m:
+            msg_id, seq, total = m.group(1), int(m.group(2)), int(m.group(3))
+            parts = self.frames.setdefault(msg_id, {})
+            parts[seq] = msg[m.end() :]
+            if len(parts) < total:
+                return None
+            del self.frames[msg_id]
+            return "".join(parts[i] for i in range(1, total + 1))
+
+        if not self.parts and not msg.lstrip().startswith(("{", "[")):
+            return msg
+
+        self.parts.append(msg)
+        self.scan(msg)
+        if self.depth > 0:
+            return None
+
+        message = "".join(self.parts)
+        self.reset()
+        return message
+
+    def scan(self, text):
+        for token in self.TOKENS.finditer(text):
+            pos = token.start()
+            if pos == self.escaped:
+                continue
+
+            c = token.group()
+            if self.in_string:
+                if c == "\\":
+                    self.escaped = pos + 1
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c in "{[":
+                self.depth += 1
+            elif c in "}]":
+                self.depth -= 1
+
+        self.escaped = 0 if self.escaped == len(text) else -1
+
 
 class MessageListener(QThread):
+    """
+    Listens to the messages of the server. Every datagram is emitted by received_msg; the JSON
+    documents (e.g., the data listing) are reassembled and parsed once, and emitted by
+    received_json.
+    """
+
     received_msg = pyqtSignal(str)
+    received_json = pyqtSignal(object)
 
     def __init__(self, msg_socket, msg_len):
         super().__init__()
         self.socket = msg_socket
         self.msg_len = msg_len
         self.listening = True
+        self.assembler = MessageAssembler()
 
     def run(self):
         while True:
             if self.listening:
                 self.msg = self.socket.recv(self.msg_len)
-                self.received_msg.emit(self.msg.decode())
+                msg = self.msg.decode()
+                self.received_msg.emit(msg)
+
+                message = self.assembler.feed(msg)
+                if message is not None and message.lstrip().startswith(("{", "[")):
+                    try:
+                        self.received_json.emit(json.loads(message))
+                    except json.JSONDecodeError:
+                        pass
 
     def start_listening(self):
         self.listening = True
@@ -26,6 +151,12 @@ class MessageListener(QThread):
 
 
 class DataListener(QThread):
+    """
+    Listens to the data of the server, and emits the decoded samples by received_data. The sinks
+    (e.g., a client-side recorder) are called with the same samples directly from the listener
+    thread, before the samples are emitted.
+    """
+
     received_data = pyqtSignal(np.ndarray)
 
     def __init__(self, data_socket, BUF_LEN, bytes_to_emit):
@@ -35,6 +166,16 @@ class DataListener(QThread):
         self.set_bytes_to_emit(bytes_to_emit)
         self.listening = False
         self.ptr = 0
+        self.sinks = []
+        self.chunks_counter = "chunks_emitted"
+
+    def add_sink(self, sink):
+        """Add a function called with the decoded samples from the listener thread."""
+        self.sinks = self.sinks + [sink]
+
+    def remove_sink(self, sink):
+        """Remove a function added by add_sink."""
+        self.sinks = [s for s in self.sinks if s is not sink]
 
     def set_bytes_to_emit(self, n_bytes):
         self.bytes_to_emit = int(n_bytes)
@@ -43,7 +184,10 @@ class DataListener(QThread):
     def run(self):
         while True:
             if self.listening:
-                data = self.socket.recv(self.BUF_LEN)
+                # The receive stage includes the time waiting for a datagram
+                with metrics.span("receive"):
+                    data = self.socket.recv(self.BUF_LEN)
+                metrics.count("ingest_bytes", len(data))
 
                 if self.ptr < self.bytes_to_emit:
                     self.converter.append(data)
@@ -51,8 +195,12 @@ class DataListener(QThread):
                     # print data in hex format
                     # print(" ".join("{:02x}".format(x) for x in data))
                 else:
-                    points = self.converter.get_samples()
+                    with metrics.span("convert"):
+                        points = self.converter.get_samples()
+                    for sink in self.sinks:
+                        sink(points)
                     self.received_data.emit(points)
+                    metrics.count(self.chunks_counter)
                     self.converter.clear()
                     self.ptr = 0
 
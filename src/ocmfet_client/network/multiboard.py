@@ -0,0 +1,554 @@
+"""
+Multi-board module
+
+This module contains the MultiBoardClient class, which acquires from several servers (boards) at
+once and merges their channels in a single logical channel space, with the same public surface of
+MsgDataClient. Each board has its own MsgDataClient, so its own ingest thread and decoder; the
+decoded samples are merged by a BoardMerger thread, so the GUI thread only receives the merged
+chunks, as from a single board.
+
+The boards are not synchronized by the hardware, so the samples are aligned by their arrival
+timestamps: the first sample of the merged stream is the first one acquired by all the boards,
+and each block received afterwards is checked against the time at which it is expected. If a
+board falls behind by more than max_skew (e.g., datagrams lost or delayed), its samples are
+padded (holding its last sample, so the filters and the detection downstream only see finite
+values) or discarded to keep it aligned with the other boards. The gaps are reported in the
+statistics of the boards.
+
+The board of each channel command (e.g., ``vg05 0.50``) is found from the channel number, which
+is the global one and is renumbered for the board. A command prefixed by the name of a board
+(e.g., ``b2: info``) is sent to that board only, the file commands (listing and downloads) to the
+first board, and any other command to all the boards. The commands batched in a single message
+(see the batch_separator of the sweeps) are routed one by one, and the ones addressing the same
+board are batched again. The files are best downloaded with the block transfer, which does not
+use the data port.
+"""
+
+import itertools
+import re
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
+
+from ocmfet_client.network.udp import MsgDataClient
+from ocmfet_client.utils.metrics import metrics
+
+
+class BoardMerger(QThread):
+    """
+    BoardMerger
+
+    Merges the samples decoded by the data listeners of the boards, and emits them by
+    received_data interleaved in the global channel order (the channels of the first board, then
+    the ones of the second board, ...), as DataListener does. The sinks are called with the same
+    samples from the merger thread, before the samples are emitted.
+
+    Parameters
+    ----------
+    listeners : list
+        Data listener of each board
+
+    n_channels : list
+        Number of channels of each board
+
+    names : list
+        Name of each board
+
+    fs : scalar
+        Sample rate in kHz
+
+    bytes_to_emit : scalar
+        Number of bytes (of all the boards) emitted at once
+
+    max_skew : scalar
+        Time in s after which a board without samples is padded, and maximum misalignment of the
+        received blocks before they are realigned
+    """
+
+    received_data = pyqtSignal(np.ndarray)
+
+    def __init__(self, listeners, n_channels, names, fs, bytes_to_emit, max_skew=0.5):
+        super().__init__()
+        self.listeners = listeners
+        self.n_channels = n_channels
+        self.names = names
+        self.fs = fs * 1e3
+        self.max_skew = max_skew
+        self.offsets = np.concatenate([[0], np.cumsum(n_channels)]).astype(int)
+        self.set_bytes_to_emit(bytes_to_emit)
+
+        self.sinks = []
+        self.listening = False
+        self.running = True
+        self.condition = threading.Condition()
+        self.reset()
+
+        for k, listener in enumerate(listeners):
+            listener.chunks_counter = "board_chunks"
+            listener.add_sink(lambda points, k=k: self.push(k, points))
+
+    def reset(self):
+        """
+        Discard the buffered samples and the statistics, the boards are aligned again at the
+        next samples.
+        """
+        with self.condition:
+            self.blocks = [deque() for _ in self.listeners]
+            self.available = [0] * len(self.listeners)
+            self.position = [0] * len(self.listeners)  # Merged index of the next sample
+            self.t0 = None  # Arrival time of the merged sample 0
+            self.t_reset = time.monotonic()
+            # Last sample of each board, held while it is padded
+            self.last = [np.zeros(n) for n in self.n_channels]
+            self.boards = [
+                {
+                    "chunks": 0,
+                    "samples": 0,
+                    "dropped": 0,
+                    "padded": 0,
+                    "gaps": 0,
+                    "t_first": None,
+                    "t_last": None,
+                }
+                for _ in self.listeners
+            ]
+
+    def add_sink(self, sink):
+        """Add a function called with the merged samples from the merger thread."""
+        self.sinks = self.sinks + [sink]
+
+    def remove_sink(self, sink):
+        """Remove a function added by add_sink."""
+        self.sinks = [s for s in self.sinks if s is not sink]
+
+    def set_bytes_to_emit(self, n_bytes):
+        self.bytes_to_emit = int(n_bytes)
+        self.samples_to_emit = max(self.bytes_to_emit // 2 // sum(self.n_channels), 1)
+        # The boards emit smaller chunks, so the merged chunks are not delayed by them
+        for listener, n in zip(self.listeners, self.n_channels, strict=True):
+            listener.set_bytes_to_emit(2 * n * max(self.samples_to_emit // 4, 1))
+
+    def push(self, k, points):
+        """
+        Buffer the samples decoded by the board k (called from its listener thread).
+        """
+        now = time.monotonic()
+        n = self.n_channels[k]
+        m = len(points) // n
+        block = np.asarray(points[: m * n]).reshape(m, n)
+        metrics.count(f"ingest_bytes_{self.names[k]}", 2 * len(points))
+
+        with self.condition:
+            stats = self.boards[k]
+            stats["chunks"] += 1
+            stats["samples"] += m
+            stats["t_first"] = stats["t_first"] or now
+            stats["t_last"] = now
+
+            if self.t0 is not None:
+                # Merged index of the first sample of the block, from its arrival time
+                expected = int(round((now - self.t0) * self.fs)) - m
+                skew = expected - self.position[k]
+                if skew > self.max_skew * self.fs:
+                    self.pad(k, skew)
+                elif skew < -self.max_skew * self.fs:
+                    drop = min(-skew, m)
+                    block = block[drop:]
+                    stats["dropped"] += drop
+
+            if len(block):
+                self.last[k] = block[-1]
+                self.blocks[k].append((now, block))
+                self.available[k] += len(block)
+                self.position[k] += len(block)
+            self.condition.notify()
+
+    def pad(self, k, n_samples):
+        """
+        Pad the board k with n_samples copies of its last sample.
+        """
+        self.blocks[k].append(
+            (None, np.broadcast_to(self.last[k], (n_samples, self.n_channels[k])))
+        )
+        self.available[k] += n_samples
+        self.position[k] += n_samples
+        self.boards[k]["padded"] += n_samples
+        self.boards[k]["gaps"] += 1
+
+    def align(self):
+        """
+        Align the boards at the first sample acquired by all of them, estimated from the arrival
+        time of their first block.
+        """
+        starts = {
+            k: blocks[0][0] - len(blocks[0][1]) / self.fs
+            for k, blocks in enumerate(self.blocks)
+            if blocks
+        }
+        self.t0 = max(starts.values())
+        for k, start in starts.items():
+            self.take(k, int(round((self.t0 - start) * self.fs)))
+            self.position[k] = self.available[k]
+
+    def take(self, k, n_samples):
+        """
+        Remove n_samples (at most the available ones) from the buffer of the board k.
+        """
+        n_samples = min(n_samples, self.available[k])
+        parts = []
+        remaining = n_samples
+        while remaining > 0:
+            t, block = self.blocks[k].popleft()
+            if len(block) > remaining:
+                self.blocks[k].appendleft((t, block[remaining:]))
+                block = block[:remaining]
+            parts.append(block)
+            remaining -= len(block)
+        self.available[k] -= n_samples
+        if not parts:
+            return np.empty((0, self.n_channels[k]))
+        return np.concatenate(parts)
+
+    def merge(self):
+        """
+        Return the next merged samples (interleaved), or None if some board has not enough
+        samples yet.
+        """
+        with self.condition:
+            now = time.monotonic()
+            if self.t0 is None:
+                # The boards not sending yet are not waited for more than max_skew
+                first = [s["t_first"] for s in self.boards if s["t_first"] is not None]
+                if not first or (
+                    not all(self.blocks) and now - min(first) < self.max_skew
+                ):
+                    return None
+                self.align()
+
+            # Pad the boards stalled for more than max_skew, so the others are not blocked
+            most = max(self.available)
+            for k, stats in enumerate(self.boards):
+                if (
+                    most - self.available[k] >= self.samples_to_emit
+                    and now - (stats["t_last"] or self.t_reset) > self.max_skew
+                ):
+                    self.pad(k, most - self.available[k])
+
+            if min(self.available) < self.samples_to_emit:
+                return None
+            n = min(self.available)
+            data = np.empty((n, self.offsets[-1]))
+            for k in range(len(self.listeners)):
+                data[:, self.offsets[k] : self.offsets[k + 1]] = self.take(k, n)
+        return data.ravel()
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                self.condition.wait(self.max_skew / 2)
+            while self.running:
+                with metrics.span("merge"):
+                    points = self.merge()
+                if points is None:
+                    break
+                if not self.listening:
+                    continue
+                for sink in self.sinks:
+                    sink(points)
+                self.received_data.emit(points)
+                metrics.count("chunks_emitted")
+
+    def start_listening(self):
+        # The samples buffered while not listening are stale, the boards are aligned again
+        self.reset()
+        self.listening = True
+        for listener in self.listeners:
+            listener.start_listening()
+
+    def stop_listening(self):
+        self.listening = False
+        for listener in self.listeners:
+            listener.stop_listening()
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify()
+        self.wait()
+
+    def stats(self):
+        """
+        Return the statistics of each board: the number of chunks and samples received, the
+        samples dropped and padded to keep it aligned (and the number of gaps padded), the
+        samples buffered waiting for the other boards, and the throughput in bytes/s.
+        """
+        stats = {}
+        with self.condition:
+            for k, board in enumerate(self.boards):
+                elapsed = (board["t_last"] or 0) - (board["t_first"] or 0)
+                stats[self.names[k]] = {
+                    "chunks": board["chunks"],
+                    "samples": board["samples"],
+                    "dropped": board["dropped"],
+                    "padded": board["padded"],
+                    "gaps": board["gaps"],
+                    "backlog": self.available[k],
+                    "throughput": (
+                        2 * board["samples"] * self.n_channels[k] / elapsed
+                        if elapsed > 0
+                        else 0.0
+                    ),
+                }
+        return stats
+
+
+class BoardMessages(QObject):
+    """
+    Relays the messages of the boards with the signals of MessageListener. If there are several
+    boards, the messages are prefixed by the name of the board.
+    """
+
+    received_msg = pyqtSignal(str)
+    received_json = pyqtSignal(object)
+
+    def __init__(self, clients, names, parent=None):
+        super().__init__(parent)
+        self.clients = clients
+        for client, name in zip(clients, names, strict=True):
+            prefix = f"[{name}] " if len(clients) > 1 else ""
+            client.msg_listener.received_msg.connect(
+                lambda msg, prefix=prefix: self.received_msg.emit(prefix + msg)
+            )
+            client.msg_listener.received_json.connect(self.received_json.emit)
+
+    @property
+    def assembler(self):
+        return self.clients[0].msg_listener.assembler
+
+
+def tracker_setting(name):
+    """Property applying a setting to the trackers of all the boards."""
+    return property(
+        lambda self: getattr(self.trackers[0], name),
+        lambda self, value: [setattr(t, name, value) for t in self.trackers],
+    )
+
+
+class BoardCommands(QObject):
+    """
+    Tracks the commands sent to the boards with the surface of CommandTracker: each command is
+    tracked by the tracker of the board it is sent to (the one of the first board if it is sent
+    to all of them), and the confirmed and failed signals of all the trackers are relayed. The
+    trackers share the command ids, so they are unique among the boards.
+    """
+
+    confirmed = pyqtSignal(object)
+    failed = pyqtSignal(object)
+
+    timeout = tracker_setting("timeout")
+    retries = tracker_setting("retries")
+    use_ids = tracker_setting("use_ids")
+
+    def __init__(self, client, parent=None):
+        super().__init__(parent)
+        self.client = client
+        self.trackers = [c.commands for c in client.clients]
+        ids = itertools.count(1)
+        for tracker in self.trackers:
+            tracker.ids = ids
+            tracker.confirmed.connect(self.confirmed.emit)
+            tracker.failed.connect(self.failed.emit)
+
+    def send(self, text, retries=None):
+        """
+        Send a command to its board(s) and track it (see CommandTracker.send).
+        """
+        command = None
+        for k, routed in self.client.route(text):
+            sent = self.trackers[k].send(routed, retries)
+            command = command or sent
+        return command
+
+    def stats(self):
+        """
+        Return the statistics of each command type of all the boards (see CommandTracker.stats).
+        """
+        stats = {}
+        for tracker in self.trackers:
+            for command_type, tracker_stats in tracker.stats().items():
+                if command_type not in stats:
+                    stats[command_type] = dict(tracker_stats)
+                    continue
+                for name in ("sent", "confirmed", "retries", "timeouts"):
+                    stats[command_type][name] += tracker_stats[name]
+        return stats
+
+    def clear(self):
+        for tracker in self.trackers:
+            tracker.clear()
+
+
+class MultiBoardClient:
+    """
+    Client of several boards, with the same public surface of MsgDataClient.
+
+    Parameters
+    ----------
+    boards : list
+        List of dictionaries with the name (optional), server_ip, msg_port, data_port and
+        n_channels of each board. The local ports must be different for each board.
+
+    fs : scalar
+        Sample rate in kHz
+
+    data_len : scalar
+        Buffer length of the data sockets
+
+    bytes_to_emit : scalar
+        Number of bytes (of all the boards) emitted at once
+
+    msg_len : scalar
+        Buffer length of the message sockets
+
+    max_skew : scalar
+        See BoardMerger
+
+    batch_separator : str, optional
+        Separator of the commands batched in a single message
+
+    Attributes
+    ----------
+    clients : list
+        MsgDataClient of each board
+
+    data_listener : BoardMerger
+        Merged data of the boards
+
+    msg_listener : BoardMessages
+        Messages of the boards
+
+    commands : BoardCommands
+        Tracked commands of the boards
+    """
+
+    CHANNEL_COMMAND = re.compile(r"([a-z]+)(\d+)(\s.*)?$")
+    FILE_COMMANDS = ("data", "getf", "getb", "crcf")
+
+    def __init__(
+        self,
+        boards,
+        fs,
+        data_len,
+        bytes_to_emit=1024,
+        msg_len=512,
+        max_skew=0.5,
+        batch_separator=None,
+    ):
+        self.batch_separator = batch_separator
+        self.names = [board.get("name", f"b{k + 1}") for k, board in enumerate(boards)]
+        self.n_channels = [board["n_channels"] for board in boards]
+        self.first_channel = np.concatenate([[0], np.cumsum(self.n_channels)])
+        self.clients = [
+            MsgDataClient(
+                board["server_ip"],
+                board["msg_port"],
+                board["data_port"],
+                data_len,
+                2 * board["n_channels"],
+                msg_len,
+            )
+            for board in boards
+        ]
+        # The file commands (e.g., downloads) address the first board
+        self.host = self.clients[0].host
+        self.msg_port = self.clients[0].msg_port
+        self.data_port = self.clients[0].data_port
+
+        self.data_listener = BoardMerger(
+            [c.data_listener for c in self.clients],
+            self.n_channels,
+            self.names,
+            fs,
+            bytes_to_emit,
+            max_skew,
+        )
+        self.msg_listener = BoardMessages(self.clients, self.names)
+        self.commands = BoardCommands(self)
+
+    def route(self, msg):
+        """
+        Return the boards a message is sent to, as a list of (board index, message).
+        """
+        if not self.batch_separator or self.batch_separator not in msg:
+            return self.route_command(msg)
+
+        parts = {}  # Board index -> commands
+        for command in msg.split(self.batch_separator):
+            if command.strip():
+                for k, routed in self.route_command(command):
+                    parts.setdefault(k, []).append(routed)
+        return [(k, self.batch_separator.join(parts[k])) for k in sorted(parts)]
+
+    def route_command(self, msg):
+        """
+        Return the boards a single command is sent to, as a list of (board index, command).
+        """
+        name, sep, rest = msg.partition(":")
+        if sep and name.strip() in self.names:
+            return [(self.names.index(name.strip()), rest.strip())]
+
+        if msg.split(" ", 1)[0] in self.FILE_COMMANDS:
+            return [(0, msg)]
+
+        match = self.CHANNEL_COMMAND.match(msg)
+        if match and int(match.group(2)) >= 1:
+            channel = int(match.group(2)) - 1
+            k = int(np.searchsorted(self.first_channel, channel, side="right")) - 1
+            if k < len(self.clients):
+                local = channel - self.first_channel[k] + 1
+                digits = len(match.group(2))
+                return [(k, f"{match.group(1)}{local:0{digits}}{match.group(3) or ''}")]
+
+        return [(k, msg) for k in range(len(self.clients))]
+
+    def start_listening(self):
+        for client in self.clients:
+            client.start_listening()
+        self.data_listener.start()
+
+    def start_capture(self, file):
+        """
+        Start capturing the datagrams of each board to a file (the name of the board is added
+        to the file name).
+        """
+        base, dot, ext = file.rpartition(".")
+        for client, name in zip(self.clients, self.names, strict=True):
+            client.start_capture(
+                f"{base}_{name}{dot}{ext}" if dot else f"{file}_{name}"
+            )
+
+    def stop_capture(self):
+        for client in self.clients:
+            client.stop_capture()
+
+    def replay_stats(self):
+        # The replay is available with a single board only
+        return None
+
+    def board_stats(self):
+        """
+        Return the statistics of each board (see BoardMerger.stats).
+        """
+        return self.data_listener.stats()
+
+    def send_message(self, msg):
+        for k, routed in self.route(msg):
+            self.clients[k].send_message(routed)
+
+    def close(self):
+        self.data_listener.stop()
+        for client in self.clients:
+            client.close()
@@ -0,0 +1,344 @@
+"""
+Shared memory module
+
+This module publishes the live decoded samples in a shared memory ring
+(multiprocessing.shared_memory), so any number of local processes (e.g., a notebook or a
+closed-loop script) can consume the stream while the client owns the UDP sockets. The publisher
+only copies each chunk once in the ring, the readers do not slow it down.
+
+Layout of the shared memory block:
+
+- the header (HEADER_SIZE bytes): the magic b"OCMSHM01", the version (u32), the number of channels
+  (u32), the capacity in samples per channel (u64), the sample rate in kHz (f8), the write index
+  (u64, number of samples per channel written since the start), the time of the last write (f8),
+  the closed flag (u64), then the length (u32) and the JSON of the channel names and the start
+  time;
+- the ring: float64 samples, channel-major (n_channels, capacity), the sample with index i is at
+  column i % capacity.
+
+The samples of a chunk are written before the write index is advanced, so the samples before the
+write index are complete. The chunks are written in pieces of at most 1/8 of the ring (the
+guard), and only the last 7/8 of the ring are readable, so a reader checking the write index
+after copying the samples detects the ones overwritten in the meantime.
+
+Usage::
+
+    from ocmfet_client.network.shm import SharedRingReader
+
+    reader = SharedRingReader("ocmfet")
+    data = reader.latest(20000)  # (n_channels, 20000) copy of the last samples
+    while not reader.closed:
+        data, lost = reader.read_new()  # Samples since the last call
+"""
+
+import json
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from ocmfet_client.utils.memory import memory
+
+SHM_MAGIC = b"OCMSHM01"
+HEADER = struct.Struct("<8sIIQdQdQI")
+HEADER_SIZE = 4096
+WRITE_INDEX = 32  # Offsets of the fields updated by the publisher
+T_WRITE = 40
+CLOSED = 48
+
+# Blocks published by this process, registered once with the resource tracker
+published = set()
+
+
+def guard_samples(capacity):
+    """
+    Return the number of samples of the ring that can be being written, which are not readable.
+    """
+    return max(capacity // 8, 1)
+
+
+class SharedRingPublisher:
+    """
+    SharedRingPublisher
+
+    Publishes the live samples in a shared memory ring. The write method has the signature of the
+    sinks of the data listeners, so it can be called with the decoded samples from the listener
+    thread.
+
+    Parameters
+    ----------
+    name : str
+        Name of the shared memory block. A block left with the same name (e.g., by a crash) is
+        replaced
+
+    n_channels : scalar
+        Number of channels
+
+    fs : scalar
+        Sample rate in kHz
+
+    seconds : scalar
+        Duration of the ring in s
+
+    channels : list, optional
+        Names of the channels
+    """
+
+    def __init__(self, name, n_channels, fs, seconds=10, channels=None):
+        self.name = name
+        self.n_channels = n_channels
+        self.capacity = int(fs * 1e3 * seconds)
+        self.guard = guard_samples(self.capacity)
+        meta = json.dumps({"channels": channels or [], "start_time": time.time()})
+        size = HEADER_SIZE + 8 * n_channels * self.capacity
+
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            stale = shared_memory.SharedMemory(name)
+            stale.unlink()
+            stale.close()
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        published.add(name)
+        memory.register(f"shared memory {name}", size)
+
+        HEADER.pack_into(
+            self.shm.buf,
+            0,
+            SHM_MAGIC,
+            1,
+            n_channels,
+            self.capacity,
+            fs,
+            0,
+            0.0,
+            0,
+            len(meta),
+        )
+        self.shm.buf[HEADER.size : HEADER.size + len(meta)] = meta.encode()
+        self.write_index = np.ndarray(1, np.uint64, self.shm.buf, WRITE_INDEX)
+        self.t_write = np.ndarray(1, np.float64, self.shm.buf, T_WRITE)
+        self.closed = np.ndarray(1, np.uint64, self.shm.buf, CLOSED)
+        self.ring = np.ndarray(
+            (n_channels, self.capacity), np.float64, self.shm.buf, HEADER_SIZE
+        )
+        self.index = 0
+        self.lock = threading.Lock()
+
+    def write(self, points):
+        """
+        Write new samples in the ring.
+
+        Parameters
+        ----------
+        points : array-like
+            Samples in the form [ch1_sample1, ch2_sample1, ..., ch1_sample2, ...]
+        """
+        m = len(points) // self.n_channels
+        data = np.asarray(points[: m * self.n_channels]).reshape(m, self.n_channels).T
+
+        with self.lock:
+            if m == 0 or self.ring is None:
+                return
+
+            # Only the last samples fitting in the ring are kept, written in pieces of at most
+            # guard samples, so the readers never see a sample being overwritten (see valid)
+            skip = max(m - self.capacity, 0)
+            self.index += skip
+            for start in range(skip, m, self.guard):
+                stop = min(start + self.guard, m)
+                pos = self.index % self.capacity
+                first = min(stop - start, self.capacity - pos)
+                self.ring[:, pos : pos + first] = data[:, start : start + first]
+                self.ring[:, : stop - start - first] = data[:, start + first : stop]
+
+                self.index += stop - start
+                self.t_write[0] = time.time()
+                self.write_index[0] = self.index
+
+    def close(self):
+        """
+        Mark the stream as closed and remove the shared memory block (the attached readers can
+        still read the last samples).
+        """
+        with self.lock:
+            if self.ring is None:
+                return
+            self.closed[0] = 1
+            # The views must be released before closing the block
+            self.ring = self.write_index = self.t_write = self.closed = None
+            self.shm.close()
+            self.shm.unlink()
+            published.discard(self.name)
+            memory.release(f"shared memory {self.name}")
+
+
+class SharedRingReader:
+    """
+    SharedRingReader
+
+    Reads the samples published by a SharedRingPublisher.
+
+    Parameters
+    ----------
+    name : str
+        Name of the shared memory block
+
+    Attributes
+    ----------
+    n_channels : scalar
+        Number of channels
+
+    fs : scalar
+        Sample rate in kHz
+
+    capacity : scalar
+        Number of samples per channel of the ring (the readable ones are capacity - guard)
+
+    channels : list
+        Names of the channels
+
+    start_time : scalar
+        Timestamp of the start of the publisher
+
+    position : scalar
+        Index of the next sample returned by read_new
+    """
+
+    def __init__(self, name):
+        try:
+            self.shm = shared_memory.SharedMemory(name, track=False)
+        except TypeError:  # Python < 3.13, the block must not be removed at exit
+            self.shm = shared_memory.SharedMemory(name)
+            if name not in published:
+                resource_tracker.unregister(self.shm._name, "shared_memory")
+
+        magic, version, n_channels, capacity, fs, _, _, _, meta_len = (
+            HEADER.unpack_from(self.shm.buf, 0)
+        )
+        if magic != SHM_MAGIC:
+            self.shm.close()
+            raise ValueError(f"{name} is not a stream of the client")
+        meta = json.loads(bytes(self.shm.buf[HEADER.size : HEADER.size + meta_len]))
+
+        self.version = version
+        self.n_channels = n_channels
+        self.capacity = capacity
+        self.guard = guard_samples(capacity)
+        self.fs = fs
+        self.channels = meta["channels"]
+        self.start_time = meta["start_time"]
+        self.index = np.ndarray(1, np.uint64, self.shm.buf, WRITE_INDEX)
+        self.t_write = np.ndarray(1, np.float64, self.shm.buf, T_WRITE)
+        self.flag = np.ndarray(1, np.uint64, self.shm.buf, CLOSED)
+        self.ring = np.ndarray(
+            (n_channels, capacity), np.float64, self.shm.buf, HEADER_SIZE
+        )
+        self.position = self.write_index
+
+    @property
+    def write_index(self):
+        """Number of samples per channel written since the start."""
+        return int(self.index[0])
+
+    @property
+    def closed(self):
+        """True if the publisher has been closed."""
+        return bool(self.flag[0])
+
+    @property
+    def last_write(self):
+        """Timestamp of the last write."""
+        return float(self.t_write[0])
+
+    def segments(self, start, stop):
+        """
+        Return the samples from start to stop (indices since the start of the stream) as views
+        of the ring, without copying them: one array, or two if the samples wrap around the end
+        of the ring. The views are overwritten by the publisher, check valid(start) after using
+        them.
+        """
+        if stop - start > self.capacity - self.guard:
+            raise ValueError("The samples exceed the readable part of the ring")
+        a, b = start % self.capacity, stop % self.capacity
+        if stop == start:
+            return [self.ring[:, :0]]
+        if a < b:
+            return [self.ring[:, a:b]]
+        return [self.ring[:, a:], self.ring[:, :b]]
+
+    def valid(self, start):
+        """
+        Return True if the sample at index start (and the following ones) has not been
+        overwritten, nor is being overwritten.
+        """
+        return self.write_index - start <= self.capacity - self.guard
+
+    def read(self, start, stop):
+        """
+        Return a copy of the samples from start to stop, or None if they have been overwritten
+        while copying them.
+        """
+        data = np.concatenate(self.segments(start, stop), axis=1)
+        return data if self.valid(start) else None
+
+    def latest(self, n_samples):
+        """
+        Return a copy of the last n_samples samples of each channel (fewer at the start of the
+        stream), as an array with shape (n_channels, n_samples).
+        """
+        while True:
+            stop = self.write_index
+            start = max(stop - min(int(n_samples), self.capacity - self.guard), 0)
+            data = self.read(start, stop)
+            if data is not None:
+                return data
+
+    def read_new(self, max_samples=None):
+        """
+        Return a copy of the samples written since the last call.
+
+        Parameters
+        ----------
+        max_samples : scalar, optional
+            Maximum number of samples per channel returned (the oldest ones)
+
+        Returns
+        -------
+        data : ndarray
+            Samples with shape (n_channels, n)
+
+        lost : scalar
+            Number of samples per channel overwritten before being read
+        """
+        while True:
+            stop = self.write_index
+            start = max(self.position, stop - self.capacity + self.guard)
+            lost = start - self.position
+            if max_samples is not None:
+                stop = min(stop, start + int(max_samples))
+            data = self.read(start, stop)
+            if data is not None:
+                self.position = stop
+                return data, lost
+
+    def wait(self, timeout=None, interval=1e-3):
+        """
+        Wait for new samples (polling the write index every interval seconds). Return True if
+        there are new samples, False on timeout or if the publisher has been closed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.write_index == self.position:
+            if self.closed or (deadline is not None and time.monotonic() > deadline):
+                return False
+            time.sleep(interval)
+        return True
+
+    def close(self):
+        """
+        Detach from the shared memory block.
+        """
+        self.ring = self.index = self.t_write = self.flag = None
+        self.shm.close()
@@ -0,0 +1,142 @@
+"""
+Simulator module
+
+This module contains the ServerSimulator class, a minimal local stand-in for the acquisition server
+that serves the files of a folder with the block transfer commands (see the transfer module). It
+can drop and reorder the datagrams to test the client on a lossy network.
+
+Usage::
+
+    python -m ocmfet_client.network.simulator <folder> [--port 8888] [--loss 0.01]
+        [--reorder 0.01]
+"""
+
+import argparse
+import os
+import random
+import socket
+import threading
+import zlib
+
+from ocmfet_client.network.transfer import HEADER
+
+
+class ServerSimulator(threading.Thread):
+    """
+    ServerSimulator
+
+    Parameters
+    ----------
+    root : str
+        Folder with the served files, the paths of the commands are relative to it
+
+    port : scalar
+        Message port (0 to pick a free one)
+
+    loss : scalar
+        Probability of dropping a datagram
+
+    reorder : scalar
+        Probability of delaying a datagram after the next one
+
+    seed : scalar, optional
+        Seed of the random generator
+
+    Attributes
+    ----------
+    port : scalar
+        Message port the simulator is bound to
+
+    sent : scalar
+        Number of datagrams sent
+
+    dropped : scalar
+        Number of datagrams dropped
+    """
+
+    def __init__(self, root, port=0, loss=0.0, reorder=0.0, seed=None):
+        super().__init__(daemon=True)
+        self.root = root
+        self.loss = loss
+        self.reorder = reorder
+        self.random = random.Random(seed)
+        self.sent = 0
+        self.dropped = 0
+        self.running = True
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", port))
+        self.socket.settimeout(0.1)
+        self.port = self.socket.getsockname()[1]
+
+    def run(self):
+        while self.running:
+            try:
+                msg, addr = self.socket.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.handle(msg.decode().split(), addr)
+
+    def stop(self):
+        self.running = False
+        self.join()
+        self.socket.close()
+
+    def handle(self, args, addr):
+        if not args:
+            return
+        if args[0] == "getb" and len(args) == 5:
+            self.send_blocks(args[1], int(args[2]), int(args[3]), int(args[4]), addr)
+        elif args[0] == "crcf" and len(args) == 2:
+            with open(os.path.join(self.root, args[1]), "rb") as f:
+                crc = zlib.crc32(f.read())
+            self.socket.sendto(HEADER.pack(b"C", crc), addr)
+        else:
+            self.socket.sendto(f"Unknown command: {' '.join(args)}".encode(), addr)
+
+    def send_blocks(self, path, first, count, block_size, addr):
+        delayed = None
+        with open(os.path.join(self.root, path), "rb") as f:
+            f.seek(first * block_size)
+            for b in range(first, first + count):
+                payload = f.read(block_size)
+                if not payload:
+                    break
+                packet = HEADER.pack(b"D", b) + payload
+
+                if self.random.random() < self.loss:
+                    self.dropped += 1
+                    continue
+                if delayed is None and self.random.random() < self.reorder:
+                    delayed = packet
+                    continue
+
+                self.socket.sendto(packet, addr)
+                self.sent += 1
+                if delayed is not None:
+                    self.socket.sendto(delayed, addr)
+                    self.sent += 1
+                    delayed = None
+
+        if delayed is not None:
+            self.socket.sendto(delayed, addr)
+            self.sent += 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OCMFET server simulator")
+    parser.add_argument("root", help="folder with the served files")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--reorder", type=float, default=0.0)
+    args = parser.parse_args()
+
+    simulator = ServerSimulator(args.root, args.port, args.loss, args.reorder)
+    print(f"Serving {args.root} on port {simulator.port}")
+    simulator.start()
+    try:
+        simulator.join()
+    except KeyboardInterrupt:
+        simulator.stop()
@@ -0,0 +1,493 @@
+"""
+Transfer module
+
+This module contains the BlockTransfer class for downloading files from the server over UDP with
+a sliding window and selective repeat, and the TransferQueue class for running several transfers
+concurrently, resuming the partially downloaded files.
+
+Protocol
+--------
+The transfer uses its own UDP socket, and the server replies to the address of the request.
+
+``getb <path> <first> <count> <block_size>``
+    The server sends the blocks first, ..., first + count - 1 of the file, each in a datagram
+    made of the header ``<cI`` (b"D", block index) followed by the block payload. Blocks past the
+    end of the file are ignored.
+
+``crcf <path>``
+    The server sends a datagram with the header ``<cI`` (b"C", CRC-32 of the whole file).
+"""
+
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+HEADER = struct.Struct("<cI")
+
+
+class TransferError(Exception):
+    """Raised when a block transfer fails."""
+
+
+class BlockTransfer:
+    """
+    BlockTransfer
+
+    This class downloads a file from the server in numbered blocks. At most `window` blocks are
+    outstanding at once; the blocks are written at their offset as they arrive (in any order),
+    missing blocks are requested again (selective repeat), and the CRC-32 of the file is verified
+    at the end.
+
+    A block is requested again when it is outstanding for more than `timeout` seconds, or for more
+    than timeout / 4 if later blocks have already been received (gap).
+
+    Parameters
+    ----------
+    host : str
+        IP address of the server
+
+    msg_port : scalar
+        Message port of the server
+
+    path : str
+        Path of the file on the server
+
+    size : scalar
+        Size of the file in bytes
+
+    file : str
+        Path of the local file
+
+    block_size : scalar
+        Size of a block in bytes
+
+    window : scalar
+        Maximum number of outstanding blocks
+
+    timeout : scalar
+        Time in s after which an outstanding block is requested again
+
+    max_retries : scalar
+        Maximum number of requests of a single block
+
+    first_block : scalar
+        First block to be requested, the previous ones are assumed to be already in the local
+        file (resume)
+
+    progress : callable, optional
+        Function called with the number of bytes in the local file
+
+    checkpoint : callable, optional
+        Function called with the number of blocks received without gaps from the start of the
+        file, after they are flushed to the local file
+
+    checkpoint_interval : scalar
+        Number of received blocks between two checkpoints
+
+    Attributes
+    ----------
+    stats : dict
+        Statistics of the transfer: size of the file, bytes transferred in this run, elapsed
+        time, throughput (of the bytes transferred), re-requested and duplicate blocks
+    """
+
+    def __init__(
+        self,
+        host,
+        msg_port,
+        path,
+        size,
+        file,
+        block_size=1024,
+        window=64,
+        timeout=0.2,
+        max_retries=20,
+        first_block=0,
+        progress=None,
+        checkpoint=None,
+        checkpoint_interval=256,
+    ):
+        self.host = host
+        self.msg_port = msg_port
+        self.path = path
+        self.size = size
+        self.file = file
+        self.block_size = block_size
+        self.window = window
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.first_block = first_block
+        self.progress = progress
+        self.checkpoint = checkpoint
+        self.checkpoint_interval = checkpoint_interval
+
+        self.n_blocks = -(-size // block_size)
+        self.received = bytearray(self.n_blocks)
+        self.received[:first_block] = b"\x01" * min(first_block, self.n_blocks)
+        self.cancelled = False
+        self.stats = {}
+
+    def cancel(self):
+        """Stop the transfer, run raises TransferError."""
+        self.cancelled = True
+
+    def verified_blocks(self):
+        """Return the number of blocks received without gaps from the start of the file."""
+        idx = self.received.find(0)
+        return self.n_blocks if idx < 0 else idx
+
+    def request(self, first, count):
+        self.socket.sendto(
+            f"getb {self.path} {first} {count} {self.block_size}".encode(),
+            (self.host, self.msg_port),
+        )
+
+    def request_blocks(self, blocks):
+        """Request the given (sorted) blocks, coalescing them into ranges."""
+        start = prev = blocks[0]
+        for b in blocks[1:]:
+            if b != prev + 1:
+                self.request(start, prev - start + 1)
+                start = b
+            prev = b
+        self.request(start, prev - start + 1)
+
+    def run(self):
+        """
+        Run the transfer (blocking).
+
+        Returns
+        -------
+        stats : dict
+            Statistics of the transfer
+        """
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("", 0))
+        self.socket.settimeout(self.timeout / 8)
+
+        mode = "r+b" if os.path.exists(self.file) else "w+b"
+        try:
+            with open(self.file, mode) as f:
+                f.truncate(self.size)
+                self.receive_blocks(f)
+            self.verify()
+        finally:
+            self.socket.close()
+
+        return self.stats
+
+    def receive_blocks(self, f):
+        t_start = time.perf_counter()
+        pending = {}  # block -> [request time, number of requests]
+        next_block = self.verified_blocks()
+        n_received = sum(self.received)
+        n_bytes = min(n_received * self.block_size, self.size)
+        transferred = 0  # Bytes received in this run, the resumed ones excluded
+        highest = next_block - 1
+        rerequests = duplicates = 0
+        last_sweep = t_start
+
+        while n_received < self.n_blocks:
+            if self.cancelled:
+                raise TransferError("Transfer cancelled")
+
+            now = time.perf_counter()
+
+            # Fill the window with new blocks
+            if len(pending) < self.window and next_block < self.n_blocks:
+                count = min(self.window - len(pending), self.n_blocks - next_block)
+                self.request(next_block, count)
+                for b in range(next_block, next_block + count):
+                    pending[b] = [now, 1]
+                next_block += count
+
+            # Selective repeat of the lost blocks
+            if now - last_sweep > self.timeout / 8:
+                last_sweep = now
+                lost = []
+                for b, (t, n) in pending.items():
+                    timeout = self.timeout / 4 if b < highest else self.timeout
+                    if now - t > timeout:
+                        if n >= self.max_retries:
+                            raise TransferError(f"Block {b} lost {n} times")
+                        lost.append(b)
+                if lost:
+                    lost.sort()
+                    self.request_blocks(lost)
+                    for b in lost:
+                        pending[b][0] = now
+                        pending[b][1] += 1
+                    rerequests += len(lost)
+
+            try:
+                packet = self.socket.recv(self.block_size + HEADER.size)
+            except socket.timeout:
+                continue
+            if len(packet) < HEADER.size:
+                continue
+
+            kind, b = HEADER.unpack_from(packet)
+            if kind != b"D" or b >= self.n_blocks:
+                continue
+            if self.received[b]:
+                duplicates += 1
+                continue
+
+            payload = packet[HEADER.size :]
+            f.seek(b * self.block_size)
+            f.write(payload)
+            self.received[b] = 1
+            pending.pop(b, None)
+            n_received += 1
+            n_bytes += len(payload)
+            transferred += len(payload)
+            highest = max(highest, b)
+            if self.progress is not None:
+                self.progress(n_bytes)
+            if (
+                self.checkpoint is not None
+                and n_received % self.checkpoint_interval == 0
+            ):
+                f.flush()
+                self.checkpoint(self.verified_blocks())
+
+        elapsed = time.perf_counter() - t_start
+        self.stats = {
+            "bytes": self.size,
+            "transferred": transferred,
+            "elapsed": elapsed,
+            "throughput": transferred / elapsed if elapsed > 0 else 0.0,
+            "rerequests": rerequests,
+            "duplicates": duplicates,
+        }
+
+    def verify(self):
+        """
+        Compare the CRC-32 of the local file with the one computed by the server.
+        """
+        crc = 0
+        with open(self.file, "rb") as f:
+            while chunk := f.read(1 << 20):
+                crc = zlib.crc32(chunk, crc)
+
+        for _ in range(self.max_retries):
+            self.socket.sendto(f"crcf {self.path}".encode(), (self.host, self.msg_port))
+            t_end = time.perf_counter() + self.timeout * 4
+            while time.perf_counter() < t_end:
+                try:
+                    packet = self.socket.recv(self.block_size + HEADER.size)
+                except socket.timeout:
+                    continue
+                if len(packet) < HEADER.size:
+                    continue
+                kind, value = HEADER.unpack_from(packet)
+                if kind == b"C":
+                    if value != crc:
+                        raise TransferError(
+                            f"CRC mismatch: {crc:08x} (local), {value:08x} (server)"
+                        )
+                    self.stats["crc"] = f"{crc:08x}"
+                    return
+        raise TransferError("No CRC received from the server")
+
+
+def summarize(jobs, t_start):
+    """
+    Return the aggregate progress of download jobs (see TransferQueue.summary), started at
+    t_start (None if none has started).
+    """
+    total = sum(job["size"] for job in jobs if job["status"] != "cancelled")
+    done = sum(job["done"] for job in jobs if job["status"] != "cancelled")
+    transferred = sum(job["done"] - job["resumed"] for job in jobs)
+    elapsed = time.perf_counter() - t_start if t_start else 0.0
+    throughput = transferred / elapsed if elapsed > 0 else 0.0
+    eta = (total - done) / throughput if throughput > 0 else None
+
+    status = {}
+    for job in jobs:
+        status[job["status"]] = status.get(job["status"], 0) + 1
+
+    return {
+        "total": total,
+        "done": done,
+        "throughput": throughput,
+        "eta": eta,
+        "status": status,
+    }
+
+
+class TransferQueue:
+    """
+    TransferQueue
+
+    This class runs several BlockTransfer at once, with a bounded concurrency. The progress of each
+    transfer is saved in a checkpoint file (<file>.part) with the number of blocks received without
+    gaps, so an interrupted download is resumed from its last verified offset when it is queued
+    again.
+
+    Parameters
+    ----------
+    host : str
+        IP address of the server
+
+    msg_port : scalar
+        Message port of the server
+
+    concurrency : scalar
+        Maximum number of concurrent transfers
+
+    block_size : scalar
+        Size of a block in bytes
+
+    **kwargs
+        Other parameters of the transfers (window, timeout, max_retries)
+
+    Attributes
+    ----------
+    jobs : list
+        List of dictionaries with the path, size, local file, status ("queued", "running",
+        "done", "failed" or "cancelled"), bytes done and statistics of each transfer
+    """
+
+    def __init__(self, host, msg_port, concurrency=4, block_size=1024, **kwargs):
+        self.host = host
+        self.msg_port = msg_port
+        self.block_size = block_size
+        self.kwargs = kwargs
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.t_start = None
+
+    def add(self, path, size, file):
+        """
+        Queue the download of a file.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file on the server
+
+        size : scalar
+            Size of the file in bytes
+
+        file : str
+            Path of the local file
+
+        Returns
+        -------
+        job : dict
+            The queued job
+        """
+        job = {
+            "path": path,
+            "size": size,
+            "file": file,
+            "status": "queued",
+            "done": 0,
+            "resumed": 0,
+            "stats": {},
+            "transfer": None,
+        }
+        with self.lock:
+            self.jobs.append(job)
+        self.executor.submit(self.run_job, job)
+        return job
+
+    def load_checkpoint(self, job):
+        """Return the number of verified blocks of a partial download, 0 if there is none."""
+        part = job["file"] + ".part"
+        if not (os.path.exists(part) and os.path.exists(job["file"])):
+            return 0
+        try:
+            with open(part) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return 0
+        if (state.get("path"), state.get("size"), state.get("block_size")) != (
+            job["path"],
+            job["size"],
+            self.block_size,
+        ):
+            return 0
+        return state.get("blocks", 0)
+
+    def save_checkpoint(self, job, blocks):
+        state = {
+            "path": job["path"],
+            "size": job["size"],
+            "block_size": self.block_size,
+            "blocks": blocks,
+        }
+        with open(job["file"] + ".part", "w") as f:
+            json.dump(state, f)
+
+    def run_job(self, job):
+        first_block = self.load_checkpoint(job)
+        job["resumed"] = job["done"] = min(first_block * self.block_size, job["size"])
+        transfer = BlockTransfer(
+            self.host,
+            self.msg_port,
+            job["path"],
+            job["size"],
+            job["file"],
+            block_size=self.block_size,
+            first_block=first_block,
+            progress=lambda n: job.__setitem__("done", n),
+            checkpoint=lambda blocks: self.save_checkpoint(job, blocks),
+            **self.kwargs,
+        )
+        # Checked with the switch to running, so cancel either sees a queued job or stops the
+        # transfer
+        with self.lock:
+            if job["status"] == "cancelled":
+                return
+            job["transfer"] = transfer
+            job["status"] = "running"
+            if self.t_start is None:
+                self.t_start = time.perf_counter()
+
+        try:
+            job["stats"] = transfer.run()
+        except TransferError as e:
+            self.save_checkpoint(job, transfer.verified_blocks())
+            job["stats"] = {"error": str(e)}
+            job["status"] = "cancelled" if transfer.cancelled else "failed"
+        else:
+            if os.path.exists(job["file"] + ".part"):
+                os.remove(job["file"] + ".part")
+            job["status"] = "done"
+
+    def cancel(self):
+        """Cancel all the queued and running transfers."""
+        with self.lock:
+            for job in self.jobs:
+                if job["status"] == "queued":
+                    job["status"] = "cancelled"
+                elif job["status"] == "running":
+                    job["transfer"].cancel()
+
+    def summary(self):
+        """
+        Return the aggregate progress of the queue.
+
+        Returns
+        -------
+        summary : dict
+            Dictionary with the total and done bytes, the throughput (bytes/s, resumed bytes
+            excluded), the estimated time to complete in s (None if unknown) and the number of
+            jobs in each status.
+        """
+        with self.lock:
+            jobs = list(self.jobs)
+        return summarize(jobs, self.t_start)
+
+    def shutdown(self):
+        """Cancel the transfers and release the worker threads."""
+        self.cancel()
+        self.executor.shutdown(wait=False)
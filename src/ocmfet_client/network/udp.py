@@ -1,31 +1,87 @@
 import socket
 
+from .capture import CaptureSocket, PacketCapture, ReplaySocket
+from .commands import CommandTracker
 from .listeners import DataListener, MessageListener
 
 
 class MsgDataClient:
+    """
+    Client of the message and data ports of the server.
+
+    If replay is given, the datagrams are read from a capture file (see the capture module)
+    instead of the sockets, at the given speed, and the commands are not sent.
+
+    The commands sent by commands.send are tracked until the server replies (see the commands
+    module); send_message sends a message without tracking it.
+    """
+
     def __init__(
-        self, host, msg_port, data_port, data_len, bytes_to_emit=1024, msg_len=512
+        self,
+        host,
+        msg_port,
+        data_port,
+        data_len,
+        bytes_to_emit=1024,
+        msg_len=512,
+        replay=None,
+        speed=1.0,
     ):
         self.host = host
         self.msg_port = msg_port
         self.data_port = data_port
-        self.msg_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.data_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.msg_socket.bind(("", self.msg_port))
-        self.data_socket.bind(("", self.data_port))
+        self.replay = replay
+        self.capture = None
+
+        if replay:
+            self.msg_socket = ReplaySocket(replay, b"M", speed)
+            self.data_socket = ReplaySocket(replay, b"D", speed)
+        else:
+            self.msg_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.data_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.msg_socket.bind(("", self.msg_port))
+            self.data_socket.bind(("", self.data_port))
 
         self.msg_listener = MessageListener(self.msg_socket, msg_len)
         self.data_listener = DataListener(self.data_socket, data_len, bytes_to_emit)
 
+        self.commands = CommandTracker(self.send_message)
+        self.msg_listener.received_msg.connect(self.commands.handle_reply)
+
     def start_listening(self):
         self.msg_listener.start()
         self.data_listener.start()
 
+    def start_capture(self, file):
+        """
+        Start capturing the received data and messages to a file.
+        """
+        if self.replay or self.capture:
+            return
+        self.capture = PacketCapture(file)
+        self.msg_listener.socket = CaptureSocket(self.msg_socket, b"M", self.capture)
+        self.data_listener.socket = CaptureSocket(self.data_socket, b"D", self.capture)
+
+    def stop_capture(self):
+        if self.capture:
+            self.msg_listener.socket = self.msg_socket
+            self.data_listener.socket = self.data_socket
+            self.capture.close()
+            self.capture = None
+
+    def replay_stats(self):
+        """
+        Return the statistics of the replayed data (see ReplaySocket.stats), or None.
+        """
+        if self.replay:
+            return self.data_socket.stats()
+
     def send_message(self, msg):
         self.msg_socket.sendto(msg.encode(), (self.host, self.msg_port))
 
     def close(self):
+        self.commands.timer.stop()
+        self.stop_capture()
         self.msg_listener.terminate()
         self.data_listener.terminate()
         self.msg_socket.close()
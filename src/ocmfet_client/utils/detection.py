@@ -0,0 +1,311 @@
+"""
+Detection module
+
+This module contains the SpikeDetector class, the streaming detection of the events (e.g., the
+spikes of the electrophysiology recordings) in the live samples, and the EventBuffer class, the
+ring of the detected events and of their waveform snippets.
+
+The samples are filtered with a StreamingFilter (the filters of the DataProcessor), and an event
+is detected when a sample crosses the threshold, a multiple of the noise of its channel estimated
+with a running MAD (median absolute deviation). After an event, the following crossings of the
+same channel are ignored for the refractory period. The cost of the detection is constant per
+sample: the noise is updated once per block, the crossings are found with vectorized operations,
+and only the (few) crossings found are checked for the refractory period.
+"""
+
+import numpy as np
+
+from ocmfet_client.utils.processing import StreamingFilter
+
+MAD_SCALE = 0.6745  # MAD of the standard normal distribution
+
+
+class EventBuffer:
+    """
+    EventBuffer
+
+    Ring of the last detected events.
+
+    Parameters
+    ----------
+    capacity : scalar
+        Maximum number of events stored
+
+    snippet_len : scalar
+        Number of samples of each snippet
+
+    Attributes
+    ----------
+    index : ndarray
+        Index of the sample of each event (since the start of the detection)
+
+    channel : ndarray
+        Channel of each event
+
+    amplitude : ndarray
+        Peak of each event (filtered, from the baseline)
+
+    snippets : ndarray
+        Filtered waveform around each event, with shape (capacity, snippet_len)
+
+    count : scalar
+        Number of events detected since the start
+    """
+
+    def __init__(self, capacity, snippet_len):
+        self.capacity = capacity
+        self.index = np.zeros(capacity, dtype=np.int64)
+        self.channel = np.zeros(capacity, dtype=np.int16)
+        self.amplitude = np.zeros(capacity, dtype=np.float32)
+        self.snippets = np.zeros((capacity, snippet_len), dtype=np.float32)
+        self.count = 0
+
+    @property
+    def nbytes(self):
+        """Memory of the buffer in bytes."""
+        return (
+            self.index.nbytes
+            + self.channel.nbytes
+            + self.amplitude.nbytes
+            + self.snippets.nbytes
+        )
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def add(self, index, channel, amplitude, snippets):
+        """
+        Store new events, only the last capacity ones are kept.
+        """
+        k = len(index)
+        if k > self.capacity:
+            index, channel = index[-self.capacity :], channel[-self.capacity :]
+            amplitude, snippets = (
+                amplitude[-self.capacity :],
+                snippets[-self.capacity :],
+            )
+        pos = (self.count + k - len(index) + np.arange(len(index))) % self.capacity
+        self.index[pos] = index
+        self.channel[pos] = channel
+        self.amplitude[pos] = amplitude
+        self.snippets[pos] = snippets
+        self.count += k
+
+    def since(self, index):
+        """
+        Return the events from the sample index on, in chronological order, as the arrays
+        (index, channel, amplitude, snippets).
+        """
+        n = len(self)
+        order = (self.count - n + np.arange(n)) % self.capacity
+        order = order[self.index[order] >= index]
+        return (
+            self.index[order],
+            self.channel[order],
+            self.amplitude[order],
+            self.snippets[order],
+        )
+
+    def clear(self):
+        """
+        Clear the events.
+        """
+        self.count = 0
+
+
+class SpikeDetector:
+    """
+    SpikeDetector
+
+    Streaming threshold detector with a running MAD noise estimate, a refractory period and the
+    extraction of the snippets. The events are detected with a latency of post samples, the
+    samples needed to complete their snippets.
+
+    Parameters
+    ----------
+    n : scalar
+        Number of channels
+
+    fs : scalar
+        Sample rate in kHz
+
+    filters : list
+        List of tuples (b, a) with the filter coefficients applied before the detection
+
+    threshold : scalar
+        Threshold in units of the noise (the MAD scaled to the standard deviation)
+
+    polarity : str
+        "negative", "positive" or "both", the direction of the crossings detected
+
+    refractory : scalar
+        Refractory period in ms
+
+    snippet : tuple
+        Duration in ms of the snippets before and after the crossing
+
+    noise_window : scalar
+        Time constant in s of the running noise estimate
+
+    capacity : scalar
+        Number of events kept in the buffer
+
+    budget : MemoryBudget, optional
+        Memory budget the event buffer is registered with
+
+    name : str
+        Name of the event buffer in the memory budget
+
+    Attributes
+    ----------
+    events : EventBuffer
+        Detected events
+
+    index : scalar
+        Number of samples per channel processed
+
+    center : ndarray
+        Running median of each channel
+
+    noise : ndarray
+        Running noise (scaled MAD) of each channel
+    """
+
+    POLARITIES = ("negative", "positive", "both")
+
+    def __init__(
+        self,
+        n,
+        fs,
+        filters=[],
+        threshold=5,
+        polarity="negative",
+        refractory=1,
+        snippet=(0.5, 1.5),
+        noise_window=2,
+        capacity=10000,
+        budget=None,
+        name="events",
+    ):
+        if polarity not in self.POLARITIES:
+            raise ValueError(f"Unsupported polarity {polarity}")
+        self.n = n
+        self.fs = fs * 1e3
+        self.threshold = threshold
+        self.polarity = polarity
+        self.refractory = max(int(refractory * 1e-3 * self.fs), 1)
+        self.pre = max(int(snippet[0] * 1e-3 * self.fs), 1)
+        self.post = max(int(snippet[1] * 1e-3 * self.fs), 1)
+        self.noise_window = noise_window
+        self.filter = StreamingFilter(n, filters)
+        self.events = EventBuffer(capacity, self.pre + self.post)
+        self.budget = budget
+        self.name = name
+        if self.budget is not None:
+            self.budget.register(self.name, self.events.nbytes)
+
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the detection (the filters, the noise estimate and the events).
+        """
+        self.filter.reset()
+        self.events.clear()
+        self.index = 0
+        self.center = None
+        self.noise = None
+        self.last = np.full(self.n, -self.refractory, dtype=np.int64)
+        # Last filtered samples not scanned yet (with the pre samples before them)
+        self.tail = np.zeros((self.n, 0))
+
+    def change_filters(self, filters):
+        """
+        Change the filters applied before the detection.
+        """
+        self.filter = StreamingFilter(self.n, filters)
+
+    def update_noise(self, data):
+        """
+        Update the running median and noise of each channel with the MAD of a block.
+        """
+        center = np.median(data, axis=1)
+        noise = np.median(np.abs(data - center[:, np.newaxis]), axis=1) / MAD_SCALE
+        if self.center is None:
+            self.center, self.noise = center, noise
+            return
+        a = 1 - np.exp(-data.shape[1] / (self.noise_window * self.fs))
+        self.center += a * (center - self.center)
+        self.noise += a * (noise - self.noise)
+
+    def process(self, data):
+        """
+        Detect the events in new samples.
+
+        Parameters
+        ----------
+        data : ndarray
+            New (calibrated) samples in the form [ch1_samples, ch2_samples, ...].
+
+        Returns
+        -------
+        k : scalar
+            Number of events detected
+        """
+        m = data.shape[1]
+        if m == 0:
+            return 0
+        data = self.filter.process(np.asarray(data, dtype=float))
+        self.update_noise(data)
+
+        # The tail starts pre samples before the first sample not scanned, whose index is
+        # first. The crossings are scanned where the snippets are complete.
+        first = self.index - (self.tail.shape[1] - self.pre)
+        self.index += m
+        x = np.concatenate([self.tail, data], axis=1) - self.center[:, np.newaxis]
+        stop = x.shape[1] - self.post
+        if stop <= self.pre:
+            self.tail = x + self.center[:, np.newaxis]
+            return 0
+
+        threshold = (self.threshold * self.noise)[:, np.newaxis]
+        segment = x[:, self.pre - 1 : stop]
+        if self.polarity == "negative":
+            above = segment < -threshold
+        elif self.polarity == "positive":
+            above = segment > threshold
+        else:
+            above = np.abs(segment) > threshold
+        channels, offsets = np.nonzero(above[:, 1:] & ~above[:, :-1])
+        self.tail = x[:, stop - self.pre :] + self.center[:, np.newaxis]
+
+        # Refractory period, in the order of the crossings of each channel
+        accepted = np.zeros(len(channels), dtype=bool)
+        for k, (ch, offset) in enumerate(zip(channels, offsets)):
+            if first + offset - self.last[ch] >= self.refractory:
+                self.last[ch] = first + offset
+                accepted[k] = True
+        channels, offsets = channels[accepted], offsets[accepted]
+        if len(channels) == 0:
+            return 0
+
+        # Snippets from pre samples before the crossing to post samples after it
+        positions = offsets[:, np.newaxis] + np.arange(self.pre + self.post)
+        snippets = x[channels[:, np.newaxis], positions]
+        after = snippets[:, self.pre :]
+        if self.polarity == "negative":
+            amplitude = after.min(axis=1)
+        elif self.polarity == "positive":
+            amplitude = after.max(axis=1)
+        else:
+            amplitude = after[np.arange(len(after)), np.abs(after).argmax(axis=1)]
+
+        self.events.add(first + offsets, channels, amplitude, snippets)
+        return len(channels)
+
+    def release(self):
+        """
+        Unregister the event buffer from the memory budget.
+        """
+        if self.budget is not None:
+            self.budget.release(self.name)
@@ -0,0 +1,396 @@
+"""
+History module
+
+This module contains the TieredHistory class, the long history of the live session. The recent
+samples are buffered in RAM by the DataProcessor (the time range of the live view), while the
+history spills all the samples to a memory-mapped scratch file (a ring of some hours) and keeps
+a min/max pyramid of them in RAM. Any window of the history is then drawn at interactive speed:
+the long windows from a level of the pyramid, the short ones from the scratch file.
+
+The samples are written by a writer thread, as in StreamRecorder, so the listener never waits
+for the scratch file, and the lock is only held to publish (or snapshot) the indices: the reads
+copy the samples outside of it, and the samples overwritten by the writer while they were copied
+(at the oldest end of the ring) are returned as NaN.
+
+Usage::
+
+    history = TieredHistory(n_channels, fs, hours=2)
+    data_listener.add_sink(history.write)  # Fed from the listener thread
+    t, data = history.read(history.end - 60, history.end)  # Envelope of the last minute
+"""
+
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from ocmfet_client.utils.formatting import size2string
+from ocmfet_client.utils.memory import MemoryBudgetError
+
+TOP_BINS = 4096  # Maximum number of bins of the coarsest level of the pyramid
+
+
+def ring_write(ring, index, data):
+    """
+    Write data (n, m, ...) in the ring (n, capacity, ...) at the absolute index, wrapping around
+    its end. Only the last capacity samples of data are written.
+    """
+    capacity = ring.shape[1]
+    m = data.shape[1]
+    if m > capacity:
+        index, data, m = index + m - capacity, data[:, -capacity:], capacity
+    pos = index % capacity
+    first = min(m, capacity - pos)
+    ring[:, pos : pos + first] = data[:, :first]
+    ring[:, : m - first] = data[:, first:]
+
+
+def ring_read(ring, start, stop, rows=slice(None)):
+    """
+    Return a copy of the samples of the ring from the absolute index start to stop.
+    """
+    capacity = ring.shape[1]
+    a = start % capacity
+    if a + stop - start <= capacity:
+        return np.array(ring[rows, a : a + stop - start])
+    return np.concatenate(
+        [ring[rows, a:], ring[rows, : (stop - start) - (capacity - a)]], axis=1
+    )
+
+
+class TieredHistory:
+    """
+    TieredHistory
+
+    Long history of the live samples. The write method has the signature of the sinks of the
+    data listeners: it only queues the decoded samples, which are written by the writer thread,
+    while the history is read from the GUI thread.
+
+    Parameters
+    ----------
+    n : scalar
+        Number of channels
+
+    fs : scalar
+        Sample rate in kHz
+
+    hours : scalar
+        Duration of the history in hours
+
+    directory : str, optional
+        Directory of the scratch file. Default: the temporary directory of the system
+
+    decimation : scalar
+        Number of samples of each bin of the finest level of the pyramid
+
+    factor : scalar
+        Number of bins of a level merged in a bin of the next level
+
+    budget : MemoryBudget, optional
+        Memory budget the pyramid is registered with. If the pyramid does not fit, it is either
+        refused (MemoryBudgetError) or its decimation is increased
+
+    name : str
+        Name of the history in the memory budget
+
+    Attributes
+    ----------
+    capacity : scalar
+        Number of samples per channel of the scratch file
+
+    decimations : list
+        Number of samples of each bin of the levels of the pyramid, from the finest
+
+    index : scalar
+        Number of samples per channel written since the start
+
+    head : scalar
+        Number of samples per channel written since the start, including the ones being written
+    """
+
+    def __init__(
+        self,
+        n,
+        fs,
+        hours=1,
+        directory=None,
+        decimation=256,
+        factor=8,
+        budget=None,
+        name="history",
+    ):
+        self.n = n
+        self.fs = fs * 1e3
+        self.capacity = max(int(self.fs * hours * 3600), 1)
+        self.factor = factor
+        self.budget = budget
+        self.name = name
+
+        self.decimations = self.fit_budget(decimation)
+        self.levels = [
+            np.full((n, self.capacity // d + 1, 2), np.nan, dtype=np.float32)
+            for d in self.decimations
+        ]
+        # Samples (or bins) not filling a bin of each level yet
+        self.pending = [np.empty((n, 0, 1), dtype=np.float32)] + [
+            np.empty((n, 0, 2), dtype=np.float32) for _ in self.decimations[1:]
+        ]
+        self.bins = [0] * len(self.decimations)  # Bins written in each level
+        if self.budget is not None:
+            self.budget.register(f"{self.name} pyramid", self.nbytes)
+
+        fd, self.path = tempfile.mkstemp(
+            prefix="ocmfet_history_", suffix=".dat", dir=directory
+        )
+        os.close(fd)
+        self.ring = np.memmap(
+            self.path, dtype=np.float32, mode="w+", shape=(n, self.capacity)
+        )
+        # On POSIX the scratch file can be removed while mapped, its space is freed when it is
+        # unmapped, also if the client crashes
+        if os.name == "posix":
+            os.remove(self.path)
+        self.index = self.head = 0
+        self.head_bins = list(self.bins)
+        self.lock = threading.Lock()
+
+        self.front = []
+        self.busy = False
+        self.running = True
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def pyramid(self, decimation):
+        """
+        Return the decimations of the levels of the pyramid with the given finest decimation.
+        """
+        decimations = [decimation]
+        while self.capacity // decimations[-1] > TOP_BINS:
+            decimations.append(decimations[-1] * self.factor)
+        return decimations
+
+    def required(self, decimation):
+        """
+        Return the memory in bytes of the pyramid with the given finest decimation.
+        """
+        return sum(
+            self.n * (self.capacity // d + 1) * 2 * 4 for d in self.pyramid(decimation)
+        )
+
+    def fit_budget(self, decimation):
+        """
+        Check that the pyramid fits in the memory budget, increasing its decimation if it does
+        not (degrade policy). Return the decimations of the levels.
+        """
+        if self.budget is None:
+            return self.pyramid(decimation)
+        available = self.budget.available(exclude=(f"{self.name} pyramid",))
+        if self.required(decimation) <= available:
+            return self.pyramid(decimation)
+        if self.budget.policy == "refuse":
+            raise MemoryBudgetError(
+                f"The {self.name} pyramid ({size2string(self.required(decimation))}) does "
+                f"not fit in the memory budget ({size2string(available)} available)"
+            )
+
+        while self.required(decimation) > available and decimation < self.capacity:
+            decimation *= self.factor
+        self.budget.report(self.name, f"pyramid decimated 1:{decimation}")
+        return self.pyramid(decimation)
+
+    @property
+    def nbytes(self):
+        """Memory of the pyramid in bytes."""
+        return sum(level.nbytes for level in self.levels)
+
+    @property
+    def oldest(self):
+        """Index of the oldest sample of the history."""
+        return max(self.index - self.capacity, 0)
+
+    @property
+    def start(self):
+        """Time of the oldest sample of the history in s."""
+        return self.oldest / self.fs
+
+    @property
+    def end(self):
+        """Time of the newest sample of the history in s."""
+        return self.index / self.fs
+
+    def reduce(self, level, data):
+        """
+        Append data (n, m, 1 or 2) to the pending samples of a level, and return the min/max of
+        the bins completed (n, k, 2).
+        """
+        k = self.decimations[0] if level == 0 else self.factor
+        data = np.concatenate([self.pending[level], data], axis=1)
+        m = data.shape[1] // k * k
+        self.pending[level] = data[:, m:]
+        data = data[:, :m].reshape(self.n, m // k, k, data.shape[2])
+        # fmin/fmax ignore the NaN padding of the missing samples
+        return np.stack(
+            [
+                np.fmin.reduce(data[..., 0], axis=2),
+                np.fmax.reduce(data[..., -1], axis=2),
+            ],
+            axis=-1,
+        )
+
+    def write(self, points):
+        """
+        Queue new samples to be written in the history. It does not block on disk I/O.
+
+        Parameters
+        ----------
+        points : array-like
+            Samples in the form [ch1_sample1, ch2_sample1, ..., ch1_sample2, ...]
+        """
+        with self.condition:
+            if self.running:
+                self.front.append(points)
+                self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """
+        Wait until the queued samples are written. Return False on timeout.
+        """
+        with self.condition:
+            return self.condition.wait_for(
+                lambda: not (self.front or self.busy), timeout
+            )
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.front or not self.running)
+                if not self.front:
+                    break
+                back, self.front = self.front, []
+                self.busy = True
+
+            self.append(np.concatenate(back))
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+    def append(self, points):
+        """
+        Write samples in the scratch file and in the pyramid (from the writer thread).
+        """
+        m = len(points) // self.n
+        if m == 0:
+            return
+        data = np.asarray(points[: m * self.n], dtype=np.float32).reshape(m, self.n).T
+
+        levels = []
+        bins = data[:, :, np.newaxis]
+        for level in range(len(self.levels)):
+            bins = self.reduce(level, bins)
+            if bins.shape[1] == 0:
+                break
+            levels.append(bins)
+
+        # The samples (and bins) being written are reserved, the reads started before check
+        # whether they have been overwritten
+        with self.lock:
+            self.head = self.index + m
+            self.head_bins = [
+                b + (levels[k].shape[1] if k < len(levels) else 0)
+                for k, b in enumerate(self.bins)
+            ]
+
+        ring_write(self.ring, self.index, data)
+        for k, bins in enumerate(levels):
+            ring_write(self.levels[k], self.bins[k], bins)
+
+        with self.lock:
+            self.index = self.head
+            self.bins = list(self.head_bins)
+
+    def read(self, start, stop, n_points=2000, channels=None):
+        """
+        Read a window of the history. If the window has more than n_points samples, the
+        envelope of the samples (the minimum and the maximum of each bin) is read from the
+        coarsest level of the pyramid with at least n_points / 2 bins in the window.
+
+        Parameters
+        ----------
+        start : scalar
+            Start of the window in s (see the start and end properties)
+
+        stop : scalar
+            End of the window in s
+
+        n_points : scalar
+            Number of points drawn
+
+        channels : list, optional
+            Indices of the channels to be read. The rows of the other channels are left empty
+            (zeros). If None, all the channels are read.
+
+        Returns
+        -------
+        t : ndarray
+            Times of the points in s
+
+        data : ndarray
+            Points in the form [ch1_points, ch2_points, ...]
+        """
+        rows = list(range(self.n) if channels is None else channels)
+        with self.lock:
+            ring, levels = self.ring, self.levels
+            index, bins = self.index, list(self.bins)
+        if ring is None:
+            return np.empty(0), np.zeros((self.n, 0), dtype=np.float32)
+
+        first = max(index - self.capacity, 0)
+        start = min(max(int(start * self.fs), first), index)
+        stop = min(max(int(stop * self.fs), start), index)
+
+        for level in reversed(range(len(self.decimations))):
+            d = self.decimations[level]
+            if (stop - start) / d >= n_points / 2:
+                j0 = -(-start // d)
+                j1 = max(min(stop // d, bins[level]), j0)
+                envelope = ring_read(levels[level], j0, j1, rows)
+                with self.lock:
+                    lost = self.head_bins[level] - levels[level].shape[1] - j0
+                envelope[:, : max(lost, 0)] = np.nan
+                points = envelope.reshape(len(rows), -1)
+                # The minimum at the start of each bin, the maximum at its middle
+                t = (np.arange(j0, j1)[:, np.newaxis] * d + [0, d // 2]).ravel()
+                break
+        else:
+            points = ring_read(ring, start, stop, rows)
+            with self.lock:
+                lost = self.head - self.capacity - start
+            points[:, : max(lost, 0)] = np.nan
+            t = np.arange(start, stop)
+
+        data = np.zeros((self.n, points.shape[1]), dtype=np.float32)
+        data[rows] = points
+        return t / self.fs, data
+
+    def close(self):
+        """
+        Stop the writer thread (the queued samples are written), close and remove the scratch
+        file, and unregister the pyramid from the memory budget.
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+
+        with self.lock:
+            if self.ring is None:
+                return
+            self.ring = self.levels = None
+            try:
+                os.remove(self.path)
+            except OSError:  # Already removed
+                pass
+        if self.budget is not None:
+            self.budget.release(f"{self.name} pyramid")
@@ -0,0 +1,126 @@
+"""
+Memory module
+
+This module contains the MemoryBudget class, the registry of the memory used by the buffers of
+the client (the live and analysis rings, the filtered data, the spectrogram images, the history
+pyramids, the shared memory ring, ...). A shared instance, memory, is used by all the buffers:
+each one registers its size, and checks the available memory before growing, so that the total
+stays within the configured budget. When a buffer does not fit, it is either refused (the
+MemoryBudgetError is raised), or degraded (e.g., stored in a more compact type, with a shorter
+history or decimated) and the degradation is reported.
+"""
+
+import os
+import threading
+from collections import deque
+
+
+class MemoryBudgetError(MemoryError):
+    """The buffer does not fit in the memory budget."""
+
+
+def physical_memory():
+    """
+    Return the physical memory of the machine in bytes, or None if it is not known.
+    """
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class MemoryBudget:
+    """
+    MemoryBudget
+
+    Parameters
+    ----------
+    budget : scalar, optional
+        Budget in bytes. Default: no budget
+
+    Attributes
+    ----------
+    budget : scalar or None
+        Budget in bytes
+
+    policy : str
+        "degrade" or "refuse", the policy of the buffers not fitting in the budget
+
+    consumers : dict
+        Size in bytes of each registered buffer
+
+    degradations : deque
+        Last degradations, as (name, description)
+    """
+
+    def __init__(self, budget=None):
+        self.budget = budget
+        self.policy = "degrade"
+        self.consumers = {}
+        self.degradations = deque(maxlen=20)
+        self.lock = threading.Lock()
+
+    def configure(self, config):
+        """
+        Set the budget and the policy from the configuration (memory_budget in MB, by default
+        half of the physical memory, and memory_policy).
+        """
+        budget = config.get("memory_budget")
+        if budget is None:
+            total = physical_memory()
+            self.budget = total // 2 if total else None
+        else:
+            self.budget = int(budget * 1e6)
+        self.policy = config.get("memory_policy", "degrade")
+
+    def register(self, name, nbytes):
+        """
+        Register (or update) the size in bytes of a buffer.
+        """
+        with self.lock:
+            self.consumers[name] = int(nbytes)
+
+    def release(self, name):
+        """
+        Unregister a buffer.
+        """
+        with self.lock:
+            self.consumers.pop(name, None)
+
+    def used(self, exclude=()):
+        """
+        Return the memory used by the registered buffers, except the excluded ones.
+        """
+        with self.lock:
+            return sum(n for name, n in self.consumers.items() if name not in exclude)
+
+    def available(self, exclude=()):
+        """
+        Return the memory available for new buffers (or for the excluded buffers, which are
+        being resized), infinite if there is no budget.
+        """
+        if self.budget is None:
+            return float("inf")
+        return max(self.budget - self.used(exclude), 0)
+
+    def fits(self, name, nbytes):
+        """
+        Return True if the buffer name fits in the budget with the given size.
+        """
+        return nbytes <= self.available(exclude=(name,))
+
+    def report(self, name, description):
+        """
+        Report the degradation of a buffer.
+        """
+        self.degradations.append((name, description))
+
+    def usage(self):
+        """
+        Return the sizes of the registered buffers, from the largest.
+        """
+        with self.lock:
+            return dict(sorted(self.consumers.items(), key=lambda item: -item[1]))
+
+
+memory = MemoryBudget()
@@ -0,0 +1,165 @@
+"""
+Metrics module
+
+This module contains the Metrics class for timing the stages of the data pipeline (receive,
+convert, update_data, filter, setData, paint) and for counting events (bytes, chunks, frames).
+A shared instance, metrics, is used by the listeners, the DataProcessor and the plot widgets.
+"""
+
+import json
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class Metrics:
+    """
+    Metrics
+
+    This class keeps the last durations of each timed stage and the last events of each counter,
+    so that rolling statistics, histograms and rates can be computed on demand. Recording a span
+    or an event only appends to a bounded deque, so it can be done from any thread.
+
+    Parameters
+    ----------
+    size : scalar
+        Number of durations/events kept for each stage/counter
+
+    Attributes
+    ----------
+    enabled : bool
+        If False, spans and events are not recorded
+
+    spans : dict
+        Dictionary with a deque of durations (in ns) for each stage
+
+    events : dict
+        Dictionary with a deque of (timestamp in ns, value) for each counter
+
+    totals : dict
+        Dictionary with the total value of each counter
+    """
+
+    def __init__(self, size=1000):
+        self.size = size
+        self.enabled = True
+        self.reset()
+
+    def reset(self):
+        """
+        Clear all the recorded spans and events.
+        """
+        self.spans = {}
+        self.events = {}
+        self.totals = {}
+        self.t_start = time.perf_counter_ns()
+
+    @contextmanager
+    def span(self, name):
+        """
+        Context manager timing the enclosed block as the stage name.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        t = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter_ns() - t)
+
+    def record(self, name, duration):
+        """
+        Record a duration (in ns) for the stage name.
+        """
+        if not self.enabled:
+            return
+        if name not in self.spans:
+            self.spans[name] = deque(maxlen=self.size)
+        self.spans[name].append(duration)
+
+    def count(self, name, value=1):
+        """
+        Record an event with the given value for the counter name.
+        """
+        if not self.enabled:
+            return
+        if name not in self.events:
+            self.events[name] = deque(maxlen=self.size)
+            self.totals[name] = 0
+        self.events[name].append((time.perf_counter_ns(), value))
+        self.totals[name] += value
+
+    def rate(self, name, window=1.0):
+        """
+        Return the rate (per second) of the counter name over the last window seconds.
+        """
+        events = list(self.events.get(name, ()))
+        if not events:
+            return 0.0
+
+        t_min = time.perf_counter_ns() - window * 1e9
+        return sum(v for t, v in events if t >= t_min) / window
+
+    def stage_stats(self, name):
+        """
+        Return the statistics (in ms) of the last durations of the stage name.
+
+        Returns
+        -------
+        stats : dict
+            Dictionary with the number of durations, the mean, the median, the 95th percentile
+            and the maximum.
+        """
+        durations = np.array(self.spans.get(name, ()), dtype=float) / 1e6
+        if len(durations) == 0:
+            return {"n": 0, "mean": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+
+        p50, p95 = np.percentile(durations, [50, 95])
+        return {
+            "n": len(durations),
+            "mean": float(durations.mean()),
+            "p50": float(p50),
+            "p95": float(p95),
+            "max": float(durations.max()),
+        }
+
+    def histogram(self, name, bins=20):
+        """
+        Return the histogram (counts, bin edges in ms) of the last durations of the stage name.
+        """
+        durations = np.array(self.spans.get(name, ()), dtype=float) / 1e6
+        return np.histogram(durations, bins=bins)
+
+    def summary(self):
+        """
+        Return a dictionary with the statistics of all the stages and counters.
+        """
+        return {
+            "uptime": (time.perf_counter_ns() - self.t_start) / 1e9,
+            "stages": {name: self.stage_stats(name) for name in list(self.spans)},
+            "rates": {name: self.rate(name) for name in list(self.events)},
+            "totals": dict(self.totals),
+        }
+
+    def dump(self, file):
+        """
+        Write the summary and the histograms of all the stages to a JSON file.
+        """
+        summary = self.summary()
+        summary["histograms"] = {}
+        for name in list(self.spans):
+            counts, edges = self.histogram(name)
+            summary["histograms"][name] = {
+                "counts": counts.tolist(),
+                "edges": edges.tolist(),
+            }
+
+        with open(file, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+metrics = Metrics()
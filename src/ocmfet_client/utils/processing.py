@@ -2,13 +2,22 @@
 DataProcessor module
 
 This module contains the DataProcessor class for processing the data from the acquisition
-system.
+system, the ExtremaTracker class for tracking the extrema of the stored data, the TimeBase
+class for timestamping the samples, and the StreamingFilter class for filtering the samples as
+they are received.
 """
 
-from collections import deque
+import time
 
 import numpy as np
-from scipy.signal import filtfilt
+from scipy.signal import butter, filtfilt, iirnotch, lfilter, lfilter_zi
+
+from ocmfet_client.utils.formatting import size2string
+from ocmfet_client.utils.memory import MemoryBudgetError
+from ocmfet_client.utils.metrics import metrics
+
+# Value in A of the LSB of the 16-bit converter (10 V over 65536 codes, 2 uA/V)
+ADC_LSB = 10 / 65536 * 2e-6
 
 # Old conversion function, keeping it here for reference
 # def bytes2samples(data, ch_type=2):
@@ -49,12 +58,287 @@ from scipy.signal import filtfilt
 #     return current
 
 
+class TimeBase:
+    """
+    TimeBase
+
+    Wall-clock time base of an acquisition. The timestamp of a sample is obtained from its index
+    with the affine mapping t0 + index / fs, where t0 is the timestamp of the first sample.
+
+    Parameters
+    ----------
+    fs : scalar
+        Sample rate in kHz
+
+    Attributes
+    ----------
+    t0 : scalar
+        Timestamp (in s) of the first sample, None if the acquisition has not started
+
+    index : scalar
+        Number of samples acquired since t0
+    """
+
+    def __init__(self, fs):
+        self.fs = fs * 1e3
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the time base. It is anchored again at the next samples.
+        """
+        self.t0 = None
+        self.index = 0
+
+    def start(self, t0=None):
+        """
+        Anchor the time base.
+
+        Parameters
+        ----------
+        t0 : scalar, optional
+            Timestamp (in s) of the first sample. If None, the current time is used.
+        """
+        self.t0 = time.time() if t0 is None else t0
+        self.index = 0
+
+    def advance(self, n_samples):
+        """
+        Advance the time base by n_samples. If the time base is not anchored, the last of the
+        samples is assumed to be acquired now.
+        """
+        if self.t0 is None:
+            self.start(time.time() - n_samples / self.fs)
+        self.index += n_samples
+
+    def change_fs(self, fs):
+        """
+        Change the sample rate, anchoring the time base at the current sample.
+
+        Parameters
+        ----------
+        fs : scalar
+            Sample rate in kHz
+        """
+        if self.t0 is not None:
+            self.start(self.time(self.index))
+        self.fs = fs * 1e3
+
+    def time(self, index):
+        """Return the timestamp (in s) of the sample at index."""
+        return self.t0 + index / self.fs
+
+    def offset(self, n_samples):
+        """Return the timestamp (in s) of the first of the last n_samples samples."""
+        return self.time(self.index - n_samples)
+
+
+class ExtremaTracker:
+    """
+    ExtremaTracker
+
+    This class tracks the minimum and maximum of the last samples of each channel. The samples are
+    grouped in blocks, and only the min/max of each block is stored in a ring, so the extrema of
+    the whole window are obtained in O(n_blocks) regardless of the number of samples.
+
+    Parameters
+    ----------
+    n : scalar
+        Number of channels
+
+    max_samples : scalar
+        Number of samples per channel in the window
+
+    block_size : scalar
+        Number of samples per block
+    """
+
+    def __init__(self, n, max_samples, block_size=1024):
+        self.n = n
+        self.max_samples = max_samples
+        self.block_size = block_size
+
+        self.clear()
+
+    def clear(self):
+        """
+        Clear the tracked extrema.
+        """
+        self.n_blocks = -(-self.max_samples // self.block_size) + 1
+        self.mins = np.full((self.n, self.n_blocks), np.inf)
+        self.maxs = np.full((self.n, self.n_blocks), -np.inf)
+        self.idx = 0  # Block being filled
+        self.count = 0  # Samples in the block being filled
+
+    def next_block(self):
+        self.idx = (self.idx + 1) % self.n_blocks
+        self.count = 0
+        self.mins[:, self.idx] = np.inf
+        self.maxs[:, self.idx] = -np.inf
+
+    def update(self, data):
+        """
+        Update the extrema with new samples.
+
+        Parameters
+        ----------
+        data : ndarray
+            New samples in the form [ch1_samples, ch2_samples, ...].
+        """
+        m = data.shape[1]
+        pos = 0
+
+        # Fill the current block
+        if self.count > 0 and m > 0:
+            take = min(self.block_size - self.count, m)
+            np.minimum(
+                self.mins[:, self.idx],
+                data[:, :take].min(axis=1),
+                out=self.mins[:, self.idx],
+            )
+            np.maximum(
+                self.maxs[:, self.idx],
+                data[:, :take].max(axis=1),
+                out=self.maxs[:, self.idx],
+            )
+            self.count += take
+            pos = take
+            if self.count == self.block_size:
+                self.next_block()
+
+        # Full blocks, only the last n_blocks ones are kept
+        k = (m - pos) // self.block_size
+        if k > 0:
+            skip = max(k - self.n_blocks, 0)
+            start = pos + skip * self.block_size
+            stop = pos + k * self.block_size
+            blocks = data[:, start:stop].reshape(self.n, -1, self.block_size)
+            idx = (self.idx + np.arange(k - skip)) % self.n_blocks
+            self.mins[:, idx] = blocks.min(axis=2)
+            self.maxs[:, idx] = blocks.max(axis=2)
+            self.idx = (idx[-1] + 1) % self.n_blocks
+            self.mins[:, self.idx] = np.inf
+            self.maxs[:, self.idx] = -np.inf
+            pos = stop
+
+        # Start a new partial block with the remaining samples
+        if pos < m:
+            self.mins[:, self.idx] = data[:, pos:].min(axis=1)
+            self.maxs[:, self.idx] = data[:, pos:].max(axis=1)
+            self.count = m - pos
+
+    def get_ranges(self):
+        """
+        Get the extrema of the tracked window.
+
+        Returns
+        -------
+        ranges : ndarray
+            Array with shape (n, 2) with the minimum and the maximum of each channel.
+        """
+        return np.stack([self.mins.min(axis=1), self.maxs.max(axis=1)], axis=1)
+
+
+def design_filters(fs, bandpass=None, notch=None):
+    """
+    Design the filters of the configuration, in the form used by DataProcessor and
+    StreamingFilter.
+
+    Parameters
+    ----------
+    fs : scalar
+        Sample rate in kHz
+
+    bandpass : tuple, optional
+        ((low, high) in Hz, order)
+
+    notch : tuple, optional
+        (frequency in Hz, Q-factor)
+
+    Returns
+    -------
+    filters : list
+        List of tuples (b, a) with the filter coefficients
+    """
+    filters = []
+    if notch:
+        filters.append(iirnotch(notch[0], notch[1], fs=fs * 1e3))
+    if bandpass:
+        filters.append(butter(bandpass[1], bandpass[0], btype="bandpass", fs=fs * 1e3))
+    return filters
+
+
+class StreamingFilter:
+    """
+    StreamingFilter
+
+    This class applies a cascade of IIR filters to consecutive blocks of samples, keeping the
+    state of each filter between the blocks, so the result is the same as filtering the whole
+    stream at once (causal, unlike the zero-phase filtering of DataProcessor). The state is
+    initialized with the first samples to avoid the initial transient.
+
+    Parameters
+    ----------
+    n : scalar
+        Number of channels
+
+    filters : list
+        List of tuples (b, a) with the filter coefficients
+    """
+
+    def __init__(self, n, filters=[]):
+        self.n = n
+        self.filters = filters
+        self.reset()
+
+    def reset(self):
+        """
+        Reset the state of the filters.
+        """
+        self.zi = None
+
+    def process(self, data):
+        """
+        Filter new samples.
+
+        Parameters
+        ----------
+        data : ndarray
+            New samples in the form [ch1_samples, ch2_samples, ...].
+
+        Returns
+        -------
+        data : ndarray
+            Filtered samples
+        """
+        if not self.filters or data.shape[1] == 0:
+            return data
+
+        if self.zi is None:
+            self.zi = []
+            x = data[:, :1]
+            for b, a in self.filters:
+                zi = lfilter_zi(b, a)[np.newaxis, :] * x
+                self.zi.append(zi)
+                x = x * (np.sum(b) / np.sum(a))  # DC gain
+
+        for k, (b, a) in enumerate(self.filters):
+            data, self.zi[k] = lfilter(b, a, data, axis=1, zi=self.zi[k])
+
+        return data
+
+
 class DataProcessor:
     """
     DataProcessor
 
     This class is used to process the data from the acquisition system. It stores the data in a
-    deque object, and it can filter the data using the filters defined in the filters attribute.
+    ring buffer, and it can filter the data using the filters defined in the filters attribute.
+
+    The samples can be stored as float64, as float32, or as raw int16/int32 codes of the ADC,
+    which are calibrated (multiplied by the LSB of each channel) when they are read. The compact
+    types cut the memory of the buffer by 2x (float32, int32) or 4x (int16), and the data returned
+    by get_data is float32 unless the samples are stored as float64.
 
     Parameters
     ----------
@@ -71,6 +355,19 @@ class DataProcessor:
         List of tuples with the filter coefficients. Each tuple should have two arrays, the
         numerator and the denominator of the filter transfer function.
 
+    dtype : str
+        Storage type of the samples: "float64", "float32", "int16" or "int32"
+
+    lsb : scalar or list
+        Value of the LSB of the ADC of each channel, used for the integer types. Default: the LSB
+        of the 16-bit converter (ADC_LSB)
+
+    budget : MemoryBudget, optional
+        Memory budget where the buffer is registered (see fit_budget)
+
+    name : str
+        Name of the buffer in the memory budget
+
     Attributes
     ----------
     n : scalar
@@ -89,12 +386,30 @@ class DataProcessor:
         List of tuples with the filter coefficients. Each tuple should have two arrays, the
         numerator and the denominator of the filter transfer function.
 
-    data : list
-        List of deques with the data of each channel
+    dtype : numpy.dtype
+        Storage type of the samples
+
+    out_dtype : numpy.dtype
+        Type of the data returned by get_data
+
+    data : ndarray
+        Ring buffer with shape (n, max_samples) with the stored samples of each channel
+
+    size : scalar
+        Number of samples per channel stored in the ring buffer
 
     ptr : scalar
         Pointer to the last sample stored in the data
 
+    extrema : ExtremaTracker
+        Tracked extrema of the stored data
+
+    time_base : TimeBase
+        Wall-clock time base of the stored data
+
+    detector : SpikeDetector or None
+        Streaming detector of the events in the new samples (see set_detector)
+
     Methods
     -------
     init_data()
@@ -115,35 +430,189 @@ class DataProcessor:
     update_data(data)
         Store new samples of data.
 
-    get_data()
+    get_data(channels=None)
         Get the data stored in the DataProcessor object.
 
+    get_ranges(data=None)
+        Get the range of the data of each channel.
+
+    get_recent(n_samples, channels=None)
+        Get the last raw samples of some channels.
+
     clear_data()
         Clear the data stored in the DataProcessor object.
+
+    set_detector(detector)
+        Set the streaming detector of the events.
+
+    get_events(channels=None)
+        Get the events detected in the stored data.
+
+    release()
+        Unregister the buffer from the memory budget.
     """
 
-    def __init__(self, n, fs, max_time, filters=[]):
+    DTYPES = ("float64", "float32", "int16", "int32")
+    COPY_SAMPLES = (
+        1 << 16
+    )  # Samples per channel converted at once when the buffer is resized
+
+    def __init__(
+        self,
+        n,
+        fs,
+        max_time,
+        filters=[],
+        dtype="float64",
+        lsb=None,
+        budget=None,
+        name="buffer",
+    ):
+        if dtype not in self.DTYPES:
+            raise ValueError(f"Unsupported storage type {dtype}")
         self.n = n
         self.fs = fs * 1e3
         self.max_time = max_time
         self.max_samples = int(self.fs * self.max_time)
         self.filters = filters
+        self.time_base = TimeBase(fs)
+        self.budget = budget
+        self.name = name
+        self.detector = None
+
+        self.base_dtype = dtype
+        self.set_dtype(dtype)
+        lsb = ADC_LSB if lsb is None else lsb
+        self.lsb = np.broadcast_to(np.asarray(lsb, dtype=float), (n,))[:, np.newaxis]
 
         self.init_data()
 
+    @property
+    def nbytes(self):
+        """Memory of the ring buffer in bytes."""
+        return self.data.nbytes
+
+    def set_dtype(self, dtype):
+        self.dtype = np.dtype(dtype)
+        self.out_dtype = np.dtype(np.float64 if dtype == "float64" else np.float32)
+        self.integer = self.dtype.kind == "i"
+
     def init_data(self):
-        """ "
-        Initialize the data structure of the DataProcessor object.
         """
+        Initialize the data structure of the DataProcessor object. The last stored samples are
+        kept (call clear_data before, if they are not needed).
+
+        The old ring buffer is freed before the new one is allocated: only the samples kept are
+        copied (in their storage type, and counted in the memory budget), and they are converted
+        to the new storage type in chunks.
+        """
+        size = getattr(self, "size", 0)
+        retained = self.n * min(size, int(self.fs * self.max_time))
+        retained *= self.dtype.itemsize if size else 0
+        dtype, self.max_time = self.fit_budget(self.base_dtype, self.max_time, retained)
+
+        kept = None
+        old_integer, old_out_dtype = self.integer, self.out_dtype
+        if size:
+            kept = self.stored(n_samples=int(self.fs * self.max_time))
+            if np.may_share_memory(kept, self.data):
+                kept = kept.copy()
+        self.data = None  # The old ring buffer is freed
+
+        self.set_dtype(dtype)
         self.max_samples = int(self.fs * self.max_time)
-        if hasattr(self, "data"):
-            self.data = [
-                deque(self.data[i], maxlen=self.max_samples) for i in range(self.n)
-            ]
-            self.ptr = len(self.data[0])
-        else:
-            self.data = [deque(maxlen=self.max_samples) for _ in range(self.n)]
-            self.ptr = 0
+        self.data = np.zeros((self.n, self.max_samples), dtype=self.dtype)
+        self.head = 0  # Column of the next sample
+        self.size = 0
+        self.ptr = 0
+        self.extrema = ExtremaTracker(self.n, self.max_samples)
+
+        if kept is not None:
+            for start in range(0, kept.shape[1], self.COPY_SAMPLES):
+                block = kept[:, start : start + self.COPY_SAMPLES]
+                if old_integer:
+                    block = block * self.lsb.astype(old_out_dtype)
+                self.write(self.quantize(block))
+                self.extrema.update(block)
+            self.ptr = self.size
+
+        if self.budget is not None:
+            self.budget.register(f"{self.name} raw", self.data.nbytes)
+            self.budget.register(
+                f"{self.name} filtered",
+                self.n * self.max_samples * self.out_dtype.itemsize,
+            )
+
+    def required(self, max_samples, dtype):
+        """
+        Return the memory in bytes of the ring buffer and of the (filtered) data returned by
+        get_data, for max_samples samples per channel stored as dtype.
+        """
+        out = 8 if dtype == "float64" else 4
+        return self.n * max_samples * (np.dtype(dtype).itemsize + out)
+
+    def fit_budget(self, dtype, max_time, retained=0):
+        """
+        Check that the buffer fits in the memory budget. If it does not, either the
+        MemoryBudgetError is raised (refuse policy), or the buffer is degraded: it is stored in a
+        more compact type (float32, then int16), then its maximum time is shortened.
+
+        Parameters
+        ----------
+        dtype : str
+            Storage type requested
+
+        max_time : scalar
+            Maximum time requested in s
+
+        retained : scalar
+            Memory in bytes of the old samples kept while the buffer is allocated
+
+        Returns
+        -------
+        dtype : str
+            Storage type of the samples
+
+        max_time : scalar
+            Maximum time in s
+        """
+        if self.budget is None:
+            return dtype, max_time
+        available = (
+            self.budget.available(exclude=(f"{self.name} raw", f"{self.name} filtered"))
+            - retained
+        )
+        max_samples = int(self.fs * max_time)
+        if self.required(max_samples, dtype) <= available:
+            return dtype, max_time
+        if self.budget.policy == "refuse":
+            raise MemoryBudgetError(
+                f"The {self.name} buffer of {max_time:g} s "
+                f"({size2string(self.required(max_samples, dtype))}) does not fit in the "
+                f"memory budget ({size2string(available)} available)"
+            )
+
+        changes = []
+        for compact in ("float32", "int16"):
+            if self.required(max_samples, compact) < self.required(max_samples, dtype):
+                dtype = compact
+                if self.required(max_samples, dtype) <= available:
+                    break
+        if dtype != self.base_dtype:
+            changes.append(f"stored as {dtype}")
+        if self.required(max_samples, dtype) > available:
+            max_time = available // self.required(1, dtype) / self.fs
+            changes.append(f"history shortened to {max_time:.2f} s")
+        self.budget.report(self.name, ", ".join(changes))
+        return dtype, max_time
+
+    def release(self):
+        """
+        Unregister the buffer from the memory budget.
+        """
+        if self.budget is not None:
+            self.budget.release(f"{self.name} raw")
+            self.budget.release(f"{self.name} filtered")
 
     def change_fs(self, fs):
         """
@@ -155,6 +624,7 @@ class DataProcessor:
             Sample rate in kHz
         """
         self.fs = fs * 1e3
+        self.time_base.change_fs(fs)
         self.init_data()
 
     def change_max_time(self, max_time):
@@ -164,10 +634,15 @@ class DataProcessor:
         Parameters
         ----------
         max_time : scalar
-            Maximum time in s
+            Maximum time in s (it may be shortened to fit in the memory budget). If the buffer is
+            refused by the memory budget, the maximum time is not changed.
         """
-        self.max_time = max_time
-        self.init_data()
+        previous, self.max_time = self.max_time, max_time
+        try:
+            self.init_data()
+        except MemoryBudgetError:
+            self.max_time = previous
+            raise
 
     def change_filters(self, filters):
         """
@@ -180,6 +655,8 @@ class DataProcessor:
             numerator and the denominator of the filter transfer function.
         """
         self.filters = filters
+        if self.detector is not None:
+            self.detector.change_filters(filters)
 
     def filter_data(self, data):
         """
@@ -200,6 +677,46 @@ class DataProcessor:
 
         return data
 
+    def quantize(self, data):
+        """Convert calibrated samples (n, m) to the storage type."""
+        if not self.integer:
+            return data.astype(self.dtype, copy=False)
+        info = np.iinfo(self.dtype)
+        return np.clip(np.rint(data / self.lsb), info.min, info.max).astype(self.dtype)
+
+    def calibrate(self, data, channels=None):
+        """Convert stored samples (of the given channels) to calibrated values."""
+        if not self.integer:
+            return data
+        lsb = self.lsb if channels is None else self.lsb[list(channels)]
+        return data * lsb.astype(self.out_dtype)
+
+    def write(self, data):
+        """Write stored samples (n, m) in the ring buffer."""
+        m = data.shape[1]
+        if m == 0 or self.max_samples == 0:
+            return
+        data = data[:, -self.max_samples :]
+        k = data.shape[1]
+        first = min(k, self.max_samples - self.head)
+        self.data[:, self.head : self.head + first] = data[:, :first]
+        self.data[:, : k - first] = data[:, first:]
+        self.head = (self.head + k) % self.max_samples
+        self.size = min(self.size + k, self.max_samples)
+
+    def stored(self, rows=slice(None), n_samples=None):
+        """
+        Return the last n_samples stored samples (all by default) of the given rows in
+        chronological order, in the storage type.
+        """
+        n_samples = self.size if n_samples is None else min(int(n_samples), self.size)
+        start = (self.head - n_samples) % self.max_samples if self.max_samples else 0
+        if start + n_samples <= self.max_samples:
+            return self.data[rows, start : start + n_samples]
+        return np.concatenate(
+            [self.data[rows, start:], self.data[rows, : self.head]], axis=-1
+        )
+
     def update_data(self, data):
         """
         Store new samples of data. If the data exceeds the maximum number of samples,
@@ -212,32 +729,146 @@ class DataProcessor:
             ch2_sample1, ..., ch1_sample2, ch2_sample2, ...], i.e., the samples of each channel
             should be interleaved.
         """
-        for i in range(self.n):
-            if self.ptr > self.max_samples:
-                self.data[i].popleft()
-            self.data[i].extend(data[i :: self.n])
-        self.ptr += len(data) // self.n  # Update pointer
+        data = np.asarray(data)
+        m = len(data) // self.n
+        block = data[: m * self.n].reshape(m, self.n).T
+
+        self.write(self.quantize(block))
+        self.ptr += m  # Update pointer
+        self.time_base.advance(m)
+        self.extrema.update(block)
 
-    def get_data(self):
+        if self.detector is not None:
+            with metrics.span("detect"):
+                metrics.count("events", self.detector.process(block))
+
+    def get_data(self, channels=None):
         """
         Get the data stored in the DataProcessor object. If filters are defined, the data is
         filtered before being returned.
 
+        Parameters
+        ----------
+        channels : list, optional
+            Indices of the channels to be returned. The rows of the other channels are left
+            empty (zeros) and are not processed. If None, all the channels are returned.
+
         Returns
         -------
         data : ndarray
             Data stored in the DataProcessor object. The data is in the form [ch1_samples,
             ch2_samples, ...], i.e., the samples of each channel are stored in a separate array.
+            The type of the data is out_dtype.
+        """
+        if channels is None:
+            channels = range(self.n)
+            if not self.filters:
+                return self.calibrate(self.stored()).astype(self.out_dtype)
+
+        data = np.zeros((self.n, self.size), dtype=self.out_dtype)
+        with metrics.span("filter" if self.filters else "copy"):
+            for i in channels:
+                samples = self.calibrate(self.stored(i), [i])
+                if self.filters:
+                    data[i] = self.filter_data(samples)
+                else:
+                    data[i] = samples
+        return data
+
+    def get_recent(self, n_samples, channels=None):
+        """
+        Get the last samples stored in the DataProcessor object, without filtering them.
+
+        Parameters
+        ----------
+        n_samples : scalar
+            Number of samples per channel
+
+        channels : list, optional
+            Indices of the channels to be returned. If None, all the channels are returned.
+
+        Returns
+        -------
+        data : ndarray
+            Data in the form [ch1_samples, ch2_samples, ...] of the requested channels, with at
+            most n_samples samples per channel.
         """
-        if self.filters:
-            return np.array([self.filter_data(d) for d in self.data])
-        else:
-            return np.array(self.data)
+        channels = list(range(self.n) if channels is None else channels)
+        data = self.stored(channels, n_samples).astype(float)
+        return self.calibrate(data, channels) if self.integer else data
 
     def clear_data(self):
         """
         Clear the data stored in the DataProcessor object.
         """
         self.ptr = 0
-        for i in range(self.n):
-            self.data[i].clear()
+        self.head = 0
+        self.size = 0
+        self.extrema.clear()
+        self.time_base.reset()
+
+    def set_detector(self, detector):
+        """
+        Set the streaming detector of the events, run on the new samples after the filters.
+
+        Parameters
+        ----------
+        detector : SpikeDetector or None
+            Detector of the events (see ocmfet_client.utils.detection), None to disable the
+            detection
+        """
+        if detector is not None:
+            detector.change_filters(self.filters)
+            detector.reset()
+        self.detector = detector
+
+    def get_events(self, channels=None):
+        """
+        Get the events detected in the stored data.
+
+        Parameters
+        ----------
+        channels : list, optional
+            Indices of the channels whose events are returned. If None, all the channels.
+
+        Returns
+        -------
+        positions : ndarray
+            Position of each event in the data returned by get_data (in samples)
+
+        channels : ndarray
+            Channel of each event
+
+        amplitudes : ndarray
+            Amplitude of each event (filtered, from the baseline)
+        """
+        if self.detector is None:
+            return np.zeros(0, int), np.zeros(0, int), np.zeros(0)
+        # The newest stored sample is the last one processed by the detector
+        first = self.detector.index - self.size
+        index, channel, amplitude, _ = self.detector.events.since(first)
+        if channels is not None:
+            keep = np.isin(channel, list(channels))
+            index, channel, amplitude = index[keep], channel[keep], amplitude[keep]
+        return index - first, channel, amplitude
+
+    def get_ranges(self, data=None):
+        """
+        Get the range of the data of each channel.
+
+        The range is obtained from the tracked extrema of the raw samples. If filters are defined,
+        the tracked extrema do not apply, and the range is computed from the filtered data.
+
+        Parameters
+        ----------
+        data : ndarray, optional
+            Data returned by get_data, used if filters are defined.
+
+        Returns
+        -------
+        ranges : ndarray
+            Array with shape (n, 2) with the minimum and the maximum of each channel.
+        """
+        if self.filters and data is not None and data.shape[1] > 0:
+            return np.stack([data.min(axis=1), data.max(axis=1)], axis=1)
+        return self.extrema.get_ranges()
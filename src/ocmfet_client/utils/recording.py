@@ -0,0 +1,474 @@
+"""
+Recording module
+
+This module contains the classes for writing and reading the recordings in the chunked container
+format (.ocm), and a reader for the legacy headerless .bin files recorded by the server.
+
+Format
+------
+An .ocm file is made of:
+
+- the magic b"OCMREC01", the header length (u32) and the header (JSON) with the channels, the
+  sample rate (kHz), the data type of the samples, the number of samples per chunk, the calibration
+  (scale, offset) of each channel and the start time;
+- the data chunks, each with chunk_samples interleaved samples of all the channels (the last one
+  may be shorter);
+- the index: the number of chunks (u32), then for each chunk the byte offset (u64), the first
+  sample (u64), the number of samples (u32) and the minimum and maximum of each channel
+  (float64), followed by the length (u32) and the JSON list of the tags [sample, text];
+- the footer: the offset of the index (u64) and the magic b"OCMIDX01".
+"""
+
+import json
+import os
+import struct
+import time
+
+import numpy as np
+import oCPPmfet as oc
+
+REC_MAGIC = b"OCMREC01"
+IDX_MAGIC = b"OCMIDX01"
+FOOTER = struct.Struct("<Q8s")
+ENTRY = struct.Struct("<QQI")
+
+
+class RecordingWriter:
+    """
+    RecordingWriter
+
+    This class writes the samples to an .ocm file, in fixed-size chunks. The index with the
+    offset, the sample range and the min/max of each chunk, and the tags, are written when the
+    file is closed. An existing file can be opened for appending: its index is read and the file
+    is truncated before it (if the index is missing, e.g., after a crash, it is rebuilt from the
+    complete chunks).
+
+    Parameters
+    ----------
+    file : str
+        Path of the file
+
+    n_channels : scalar
+        Number of channels
+
+    fs : scalar
+        Sample rate in kHz
+
+    channels : list, optional
+        Configuration of the channels (name, type, ...)
+
+    dtype : str
+        Data type of the stored samples
+
+    chunk_samples : scalar
+        Number of samples per channel in a chunk
+
+    calibration : list, optional
+        (scale, offset) of each channel, applied on read. Default: (1, 0)
+
+    start_time : scalar, optional
+        Timestamp (in s) of the first sample. Default: now
+
+    append : bool
+        If True and the file exists, the samples are appended to it
+
+    Attributes
+    ----------
+    n_samples : scalar
+        Number of samples per channel written to the file (including the incomplete chunk)
+    """
+
+    def __init__(
+        self,
+        file,
+        n_channels,
+        fs,
+        channels=None,
+        dtype="<f8",
+        chunk_samples=65536,
+        calibration=None,
+        start_time=None,
+        append=False,
+    ):
+        self.file = file
+        self.n_channels = n_channels
+        self.entries = []
+        self.tags = []
+        self.buffer = np.empty(0, dtype=dtype)
+
+        if append and os.path.exists(file):
+            self.open_append()
+            return
+
+        self.header = {
+            "version": 1,
+            "n_channels": n_channels,
+            "channels": channels or [],
+            "fs": fs,
+            "dtype": np.dtype(dtype).str,
+            "chunk_samples": chunk_samples,
+            "calibration": calibration or [(1.0, 0.0)] * n_channels,
+            "start_time": time.time() if start_time is None else start_time,
+        }
+        self.dtype = np.dtype(dtype)
+        self.chunk_samples = chunk_samples
+        self.n_chunked = 0
+        self.n_samples = 0
+
+        header = json.dumps(self.header).encode()
+        self.f = open(file, "w+b", buffering=1 << 20)
+        self.f.write(REC_MAGIC + struct.pack("<I", len(header)) + header)
+        self.data_offset = self.f.tell()
+
+    def open_append(self):
+        reader = RecordingReader(self.file, recover=True)
+        self.header = reader.header
+        self.dtype = np.dtype(self.header["dtype"])
+        self.chunk_samples = self.header["chunk_samples"]
+        self.data_offset = reader.data_offset
+        self.tags = [list(tag) for tag in reader.tags]
+        self.entries = list(reader.entries)
+
+        self.f = open(self.file, "r+b", buffering=1 << 20)
+        end = self.data_offset
+        if self.entries:
+            offset, first, n = self.entries[-1][:3]
+            end = offset + n * self.n_channels * self.dtype.itemsize
+            if n < self.chunk_samples:
+                # Reopen the last, incomplete chunk
+                self.f.seek(offset)
+                self.buffer = np.frombuffer(
+                    self.f.read(n * self.n_channels * self.dtype.itemsize),
+                    dtype=self.dtype,
+                )
+                self.entries.pop()
+                end = offset
+        self.n_chunked = sum(entry[2] for entry in self.entries)
+        self.n_samples = self.n_chunked + len(self.buffer) // self.n_channels
+        self.f.seek(end)
+        self.f.truncate()
+
+    def write(self, samples):
+        """
+        Append interleaved samples [ch1_sample1, ch2_sample1, ..., ch1_sample2, ...].
+        """
+        samples = np.asarray(samples, dtype=self.dtype)
+        if len(self.buffer):
+            samples = np.concatenate([self.buffer, samples])
+
+        chunk_len = self.chunk_samples * self.n_channels
+        n_chunks = len(samples) // chunk_len
+        for k in range(n_chunks):
+            self.write_chunk(samples[k * chunk_len : (k + 1) * chunk_len])
+        self.buffer = samples[n_chunks * chunk_len :]
+        self.n_samples = self.n_chunked + len(self.buffer) // self.n_channels
+
+    def write_chunk(self, chunk):
+        chunk = chunk[: len(chunk) // self.n_channels * self.n_channels]
+        if len(chunk) == 0:
+            return
+
+        frames = chunk.reshape(-1, self.n_channels)
+        offset = self.f.tell()
+        self.f.write(chunk.tobytes())
+        self.entries.append(
+            (
+                offset,
+                self.n_chunked,
+                len(frames),
+                frames.min(axis=0).astype(float),
+                frames.max(axis=0).astype(float),
+            )
+        )
+        self.n_chunked += len(frames)
+
+    def tag(self, text, sample=None):
+        """
+        Add a tag.
+
+        Parameters
+        ----------
+        text : str
+            Text of the tag
+
+        sample : scalar, optional
+            Index of the tagged sample. Default: the next sample
+        """
+        if sample is None:
+            sample = self.n_samples
+        self.tags.append([int(sample), text])
+
+    def sync(self):
+        """
+        Flush the complete chunks and force them to disk.
+        """
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self, fsync=False):
+        """
+        Write the last chunk, the index and the footer, and close the file.
+
+        Parameters
+        ----------
+        fsync : bool
+            If True, the file is forced to disk before closing it
+        """
+        if self.f.closed:
+            return
+
+        self.write_chunk(self.buffer)
+        self.buffer = np.empty(0, dtype=self.dtype)
+
+        index_offset = self.f.tell()
+        self.f.write(struct.pack("<I", len(self.entries)))
+        for offset, first, n, mins, maxs in self.entries:
+            self.f.write(ENTRY.pack(offset, first, n))
+            self.f.write(np.concatenate([mins, maxs]).astype("<f8").tobytes())
+        tags = json.dumps(self.tags).encode()
+        self.f.write(struct.pack("<I", len(tags)) + tags)
+        self.f.write(FOOTER.pack(index_offset, IDX_MAGIC))
+
+        if fsync:
+            self.sync()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class RecordingReader:
+    """
+    RecordingReader
+
+    This class reads an .ocm file. Any sample range is read with a single seek, and the min/max
+    of each chunk in the index give a fast overview of the whole recording.
+
+    Parameters
+    ----------
+    file : str
+        Path of the file
+
+    recover : bool
+        If True and the index is missing, it is rebuilt from the complete chunks
+
+    Attributes
+    ----------
+    header : dict
+        Header of the recording
+
+    n_channels : scalar
+        Number of channels
+
+    fs : scalar
+        Sample rate in kHz
+
+    n_samples : scalar
+        Number of samples per channel
+
+    duration : scalar
+        Duration in s
+
+    entries : list
+        Index of the chunks (offset, first sample, number of samples, mins, maxs)
+
+    tags : list
+        List of [sample, text]
+    """
+
+    def __init__(self, file, recover=False):
+        self.file = file
+
+        with open(file, "rb") as f:
+            if f.read(len(REC_MAGIC)) != REC_MAGIC:
+                raise ValueError(f"{file} is not an .ocm recording")
+            header_len = struct.unpack("<I", f.read(4))[0]
+            self.header = json.loads(f.read(header_len))
+            self.data_offset = f.tell()
+
+            self.n_channels = self.header["n_channels"]
+            self.fs = self.header["fs"]
+            self.dtype = np.dtype(self.header["dtype"])
+            self.chunk_samples = self.header["chunk_samples"]
+            self.start_time = self.header["start_time"]
+            calibration = np.array(self.header["calibration"], dtype=float)
+            self.scale = calibration[:, 0:1]
+            self.offset = calibration[:, 1:2]
+
+            f_size = f.seek(0, 2)
+            f.seek(f_size - FOOTER.size)
+            index_offset, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic == IDX_MAGIC:
+                self.read_index(f, index_offset)
+            elif recover:
+                self.rebuild_index(f, f_size)
+            else:
+                raise ValueError(f"{file} has no index")
+
+        self.n_samples = sum(entry[2] for entry in self.entries)
+        self.duration = self.n_samples / self.fs / 1e3
+
+    def read_index(self, f, index_offset):
+        f.seek(index_offset)
+        n_chunks = struct.unpack("<I", f.read(4))[0]
+        self.entries = []
+        for _ in range(n_chunks):
+            offset, first, n = ENTRY.unpack(f.read(ENTRY.size))
+            extrema = np.frombuffer(f.read(16 * self.n_channels), dtype="<f8")
+            self.entries.append(
+                (
+                    offset,
+                    first,
+                    n,
+                    extrema[: self.n_channels],
+                    extrema[self.n_channels :],
+                )
+            )
+        tags_len = struct.unpack("<I", f.read(4))[0]
+        self.tags = json.loads(f.read(tags_len))
+
+    def rebuild_index(self, f, f_size):
+        chunk_bytes = self.chunk_samples * self.n_channels * self.dtype.itemsize
+        self.entries = []
+        self.tags = []
+        for k in range((f_size - self.data_offset) // chunk_bytes):
+            offset = self.data_offset + k * chunk_bytes
+            f.seek(offset)
+            frames = np.frombuffer(f.read(chunk_bytes), dtype=self.dtype).reshape(
+                -1, self.n_channels
+            )
+            self.entries.append(
+                (
+                    offset,
+                    k * self.chunk_samples,
+                    self.chunk_samples,
+                    frames.min(axis=0).astype(float),
+                    frames.max(axis=0).astype(float),
+                )
+            )
+
+    def read(self, start=0, stop=None):
+        """
+        Read a range of samples.
+
+        Parameters
+        ----------
+        start : scalar
+            First sample
+
+        stop : scalar, optional
+            Last sample (excluded). Default: the end of the recording
+
+        Returns
+        -------
+        data : ndarray
+            Calibrated samples in the form [ch1_samples, ch2_samples, ...]
+        """
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        start = max(start, 0)
+        if stop <= start:
+            return np.empty((self.n_channels, 0))
+
+        # All the chunks but the last have chunk_samples samples
+        k = start // self.chunk_samples
+        offset = self.entries[k][0] + (start - self.entries[k][1]) * (
+            self.n_channels * self.dtype.itemsize
+        )
+        with open(self.file, "rb") as f:
+            f.seek(offset)
+            raw = np.fromfile(
+                f, dtype=self.dtype, count=(stop - start) * self.n_channels
+            )
+
+        return raw.reshape(-1, self.n_channels).T * self.scale + self.offset
+
+    def overview(self):
+        """
+        Return the calibrated min and max of each chunk, in the form [ch1_values, ...], and the
+        first sample of each chunk.
+        """
+        first = np.array([entry[1] for entry in self.entries])
+        mins = np.array([entry[3] for entry in self.entries]).T
+        maxs = np.array([entry[4] for entry in self.entries]).T
+        lo = np.minimum(mins * self.scale, maxs * self.scale) + self.offset
+        hi = np.maximum(mins * self.scale, maxs * self.scale) + self.offset
+        return first, lo, hi
+
+
+class LegacyBinReader:
+    """
+    LegacyBinReader
+
+    Reader for the headerless .bin files recorded by the server. The sample rate and the number of
+    channels are not stored in the file, so they must be given.
+
+    Parameters
+    ----------
+    file : str
+        Path of the file
+
+    n_channels : scalar
+        Number of channels
+
+    fs : scalar
+        Sample rate in kHz
+    """
+
+    def __init__(self, file, n_channels, fs):
+        self.file = file
+        self.n_channels = n_channels
+        self.fs = fs
+        self.tags = []
+        self.start_time = os.path.getmtime(file)
+
+        f_size = os.path.getsize(file)
+        self.n_samples = f_size // 2 // n_channels  # 2 bytes per sample
+        self.duration = self.n_samples / self.fs / 1e3
+
+    def read(self, start=0, stop=None):
+        """
+        Read (and decode) a range of samples, in the form [ch1_samples, ch2_samples, ...].
+        """
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        start = max(start, 0)
+        if stop <= start:
+            return np.empty((self.n_channels, 0))
+
+        frame = 2 * self.n_channels
+        with open(self.file, "rb") as f:
+            f.seek(start * frame)
+            raw = f.read((stop - start) * frame)
+        converter = oc.Converter(len(raw) // 2)
+        converter.append(raw)
+        samples = np.asarray(converter.get_samples())
+        n = len(samples) // self.n_channels * self.n_channels
+        return samples[:n].reshape(-1, self.n_channels).T
+
+
+def open_recording(file, n_channels, fs):
+    """
+    Open a recording, in the .ocm format or in the legacy .bin format.
+
+    Parameters
+    ----------
+    file : str
+        Path of the file
+
+    n_channels : scalar
+        Number of channels, used for the legacy files
+
+    fs : scalar
+        Sample rate in kHz, used for the legacy files
+
+    Returns
+    -------
+    reader : RecordingReader or LegacyBinReader
+    """
+    with open(file, "rb") as f:
+        magic = f.read(len(REC_MAGIC))
+    if magic == REC_MAGIC:
+        return RecordingReader(file, recover=True)
+    return LegacyBinReader(file, n_channels, fs)
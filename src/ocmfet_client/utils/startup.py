@@ -0,0 +1,129 @@
+"""
+Startup module
+
+This module contains the startup profiler of the client (``ocmfet_client --profile-startup``). The
+startup until the splash is shown is run in a new interpreter with ``-X importtime``, and the
+report lists the time to the splash and the slowest imports. With a budget, the exit code is 1 if
+the time to the splash exceeds it, so the check can be run by CI.
+"""
+
+import os
+import re
+import subprocess
+import sys
+import time
+
+# Startup of the GUI until the splash is painted, as done by cli
+SPLASH_CODE = """
+import time
+t0 = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+app = QApplication([])
+from ocmfet_client import __version__, win_title
+from ocmfet_client.gui.dialogs.SplashDialog import SplashDialog
+splash = SplashDialog(version=__version__, title=win_title)
+splash.show()
+app.processEvents()
+print(f"SPLASH {(time.perf_counter() - t0) * 1e3:.3f}")
+"""
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def parse_importtime(output):
+    """
+    Parse the output of -X importtime.
+
+    Returns
+    -------
+    imports : list
+        List of (module, self time in ms, cumulative time in ms, depth)
+    """
+    imports = []
+    for line in output.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            depth = (len(indent) - 1) // 2
+            imports.append(
+                (module, int(self_us) / 1e3, int(cumulative_us) / 1e3, depth)
+            )
+    return imports
+
+
+def measure_startup():
+    """
+    Run the startup of the client until the splash is shown in a new interpreter.
+
+    Returns
+    -------
+    splash : scalar
+        Time to the splash in ms
+
+    total : scalar
+        Time of the whole process in ms
+
+    imports : list
+        Modules imported until the splash is shown (see parse_importtime)
+
+    Raises
+    ------
+    RuntimeError
+        If the startup fails, with its error output
+    """
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    t = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SPLASH_CODE],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    total = (time.perf_counter() - t) * 1e3
+
+    match = re.search(r"SPLASH ([\d.]+)", result.stdout)
+    if result.returncode != 0 or not match:
+        raise RuntimeError(result.stderr)
+    return float(match.group(1)), total, parse_importtime(result.stderr)
+
+
+def profile_startup(top=20, budget=None, file=sys.stdout):
+    """
+    Profile the startup of the client until the splash is shown, and print the report.
+
+    Parameters
+    ----------
+    top : scalar
+        Number of slowest imports listed
+
+    budget : scalar, optional
+        Maximum time to the splash in ms
+
+    file : file-like
+        Output of the report
+
+    Returns
+    -------
+    code : scalar
+        0, or 1 if the time to the splash exceeds the budget
+    """
+    try:
+        splash, total, imports = measure_startup()
+    except RuntimeError as e:
+        print(e, file=file)
+        return 1
+
+    print(f"Time to splash: {splash:.1f} ms (process: {total:.1f} ms)", file=file)
+    print(f"Modules imported: {len(imports)}", file=file)
+    print("\nSlowest top-level imports (cumulative ms, self ms):", file=file)
+    for module, self_ms, cumulative_ms, _ in sorted(
+        [i for i in imports if i[3] == 0], key=lambda i: -i[2]
+    )[:top]:
+        print(f"{cumulative_ms:10.1f} {self_ms:10.1f}  {module}", file=file)
+
+    if budget is not None and splash > budget:
+        print(f"\nTime to splash over budget ({budget:.0f} ms)", file=file)
+        return 1
+    return 0
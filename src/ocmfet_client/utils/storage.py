@@ -0,0 +1,395 @@
+"""
+Storage module
+
+This module contains the NpyWriter class for streaming the acquired samples to a binary .npy file,
+the StreamRecorder class for recording the live stream on the client, and the functions for
+converting the raw .bin files to .npy and the .npy files to CSV.
+"""
+
+import ast
+import os
+import threading
+import time
+
+import numpy as np
+import oCPPmfet as oc
+
+from ocmfet_client.utils.recording import RecordingWriter
+
+NPY_MAGIC = b"\x93NUMPY\x01\x00"
+
+
+class NpyWriter:
+    """
+    NpyWriter
+
+    This class streams samples to an open, buffered .npy file. The header is preallocated with a
+    fixed length and it is rewritten with the final shape when the file is closed, so the samples
+    are appended without reopening or rewriting the file. The resulting file can be loaded with
+    np.load (also with mmap_mode).
+
+    Parameters
+    ----------
+    file : str
+        Path of the .npy file
+
+    n_channels : scalar
+        Number of channels
+
+    dtype : str
+        Data type of the stored samples
+
+    buffering : scalar
+        Size in bytes of the write buffer
+
+    Attributes
+    ----------
+    n_samples : scalar
+        Number of samples per channel written to the file
+    """
+
+    HEADER_LEN = 128
+
+    def __init__(self, file, n_channels, dtype="<f8", buffering=1 << 20):
+        self.file = file
+        self.n_channels = n_channels
+        self.dtype = np.dtype(dtype)
+        self.n_samples = 0
+        self.remainder = np.empty(0, dtype=self.dtype)
+
+        self.f = open(self.file, "wb", buffering=buffering)
+        self.f.write(self.header())
+
+    def header(self):
+        """
+        Return the .npy header for the samples written so far.
+        """
+        header = repr(
+            {
+                "descr": self.dtype.str,
+                "fortran_order": False,
+                "shape": (self.n_samples, self.n_channels),
+            }
+        )
+        pad = self.HEADER_LEN - len(NPY_MAGIC) - 2 - len(header) - 1
+        header = header + " " * pad + "\n"
+        return NPY_MAGIC + len(header).to_bytes(2, "little") + header.encode("latin1")
+
+    def write(self, samples):
+        """
+        Append samples to the file.
+
+        Parameters
+        ----------
+        samples : array-like
+            Interleaved samples [ch1_sample1, ch2_sample1, ..., ch1_sample2, ...]. Incomplete
+            frames are kept until the next call.
+        """
+        samples = np.asarray(samples, dtype=self.dtype)
+        if len(self.remainder):
+            samples = np.concatenate([self.remainder, samples])
+
+        n = len(samples) // self.n_channels * self.n_channels
+        self.remainder = samples[n:]
+        self.f.write(samples[:n].tobytes())
+        self.n_samples += n // self.n_channels
+
+    def sync(self):
+        """
+        Flush the samples and force them to disk.
+        """
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self, fsync=False):
+        """
+        Flush the samples and write the final header.
+
+        Parameters
+        ----------
+        fsync : bool
+            If True, the file is forced to disk before closing it
+        """
+        if self.f.closed:
+            return
+        self.f.flush()
+        self.f.seek(0)
+        self.f.write(self.header())
+        if fsync:
+            self.sync()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class StreamRecorder:
+    """
+    StreamRecorder
+
+    This class records the live stream on the client. The samples are collected in a front buffer
+    by write (called by the data listener), and a dedicated writer thread swaps it with the back
+    buffer and writes it to disk in large writes, so the acquisition never waits for the disk.
+    A new file is started every max_record_time seconds of samples; the samples are split exactly
+    at the boundary, so there are no gaps between the files. The tags are stored in the file that
+    contains the tagged sample (only in the .ocm format).
+
+    Parameters
+    ----------
+    folder : str
+        Folder of the recordings
+
+    name : str
+        Base name of the files, the files are named <name>_<index>.<format>
+
+    n_channels : scalar
+        Number of channels
+
+    fs : scalar
+        Sample rate in kHz
+
+    max_record_time : scalar
+        Duration in s of each file (0 for a single file)
+
+    fsync : str
+        When the files are forced to disk: "never", "rollover" (when a file is closed) or
+        "always" (after each write)
+
+    buffer_size : scalar
+        Size in bytes of the buffer written at once
+
+    channels : list, optional
+        Configuration of the channels, stored in the header of the .ocm files
+
+    format : str
+        Format of the files: "ocm" (see the recording module) or "npy"
+
+    Attributes
+    ----------
+    files : list
+        Paths of the files written so far
+
+    n_samples : scalar
+        Number of samples per channel recorded
+    """
+
+    def __init__(
+        self,
+        folder,
+        name,
+        n_channels,
+        fs,
+        max_record_time=0,
+        fsync="rollover",
+        buffer_size=4 << 20,
+        channels=None,
+        format="ocm",
+    ):
+        self.folder = folder
+        self.name = name
+        self.n_channels = n_channels
+        self.fs = fs * 1e3
+        self.max_samples = int(self.fs * max_record_time)
+        self.fsync = fsync
+        self.buffer_size = buffer_size
+        self.channels = channels
+        self.format = format
+
+        self.files = []
+        self.index = 0
+        self.n_samples = 0
+        self.writer = None
+        self.file_start = 0
+        self.start_time = None
+        self.front = []
+        self.front_bytes = 0
+        self.queued_samples = 0
+        self.tags = []
+        self.running = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        """
+        Open the first file and start the writer thread.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        self.start_time = time.time()
+        self.next_file()
+        self.running = True
+        self.thread.start()
+
+    def write(self, samples):
+        """
+        Queue interleaved samples to be recorded. It does not block on disk I/O.
+        """
+        with self.condition:
+            self.front.append(samples)
+            self.front_bytes += samples.nbytes
+            self.queued_samples += len(samples)
+            if self.front_bytes >= self.buffer_size:
+                self.condition.notify()
+
+    def tag(self, text):
+        """
+        Tag the next sample to be recorded.
+        """
+        with self.condition:
+            self.tags.append((self.queued_samples // self.n_channels, text))
+
+    def stop(self):
+        """
+        Write the queued samples, close the last file and stop the writer thread.
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: self.front_bytes >= self.buffer_size or not self.running,
+                    timeout=1.0,
+                )
+                back, self.front = self.front, []
+                self.front_bytes = 0
+                running = self.running
+
+            if back:
+                self.write_samples(np.concatenate(back))
+                if self.fsync == "always":
+                    self.writer.sync()
+            if not running:
+                break
+
+        self.write_tags(final=True)
+        self.writer.close(fsync=self.fsync != "never")
+
+    def write_samples(self, samples):
+        while len(samples):
+            if self.max_samples:
+                left = (self.max_samples - self.writer.n_samples) * self.n_channels
+                if left <= 0:
+                    self.write_tags()
+                    self.writer.close(fsync=self.fsync != "never")
+                    self.next_file()
+                    continue
+            else:
+                left = len(samples)
+
+            self.writer.write(samples[:left])
+            self.n_samples += len(samples[:left]) // self.n_channels
+            samples = samples[left:]
+
+    def write_tags(self, final=False):
+        """
+        Move the tags of the samples in the current file to it.
+        """
+        if not hasattr(self.writer, "tag"):
+            return
+        with self.condition:
+            tags = [tag for tag in self.tags if final or tag[0] < self.n_samples]
+            self.tags = [tag for tag in self.tags if tag not in tags]
+        for sample, text in tags:
+            self.writer.tag(text, sample - self.file_start)
+
+    def next_file(self):
+        # Existing files are not overwritten, the index continues after them
+        while True:
+            file = os.path.join(
+                self.folder, f"{self.name}_{self.index:03d}.{self.format}"
+            )
+            self.index += 1
+            if not os.path.exists(file):
+                break
+        self.file_start = self.n_samples
+        if self.format == "ocm":
+            self.writer = RecordingWriter(
+                file,
+                self.n_channels,
+                self.fs / 1e3,
+                channels=self.channels,
+                start_time=self.start_time + self.n_samples / self.fs,
+            )
+        else:
+            self.writer = NpyWriter(file, self.n_channels)
+        self.files.append(file)
+
+
+def npy_shape(file):
+    """Return the shape stored in the header of a .npy file."""
+    with open(file, "rb") as f:
+        if f.read(len(NPY_MAGIC)) != NPY_MAGIC:
+            raise ValueError(f"{file} is not a .npy file")
+        header_len = int.from_bytes(f.read(2), "little")
+        return ast.literal_eval(f.read(header_len).decode("latin1"))["shape"]
+
+
+def bin2npy(bin_file, npy_file, n_channels, chunk_size=98304, progress=None):
+    """
+    Decode a raw .bin file (as recorded by the server) to a .npy file, in chunks.
+
+    Parameters
+    ----------
+    bin_file : str
+        Path of the .bin file
+
+    npy_file : str
+        Path of the .npy file
+
+    n_channels : scalar
+        Number of channels
+
+    chunk_size : scalar
+        Number of bytes decoded at once, multiple of the size of a frame
+
+    progress : callable, optional
+        Function called with the number of bytes decoded so far
+    """
+    converter = oc.Converter(chunk_size // 2)
+    with open(bin_file, "rb") as f, NpyWriter(npy_file, n_channels) as writer:
+        n_bytes = 0
+        while chunk := f.read(chunk_size):
+            converter.append(chunk)
+            writer.write(converter.get_samples())
+            converter.clear()
+            n_bytes += len(chunk)
+            if progress is not None:
+                progress(n_bytes)
+
+
+def npy2csv(npy_file, csv_file, header=None, chunk_size=100000, progress=None):
+    """
+    Convert a .npy file with samples (n_samples x n_channels) to a CSV file, in chunks.
+
+    Parameters
+    ----------
+    npy_file : str
+        Path of the .npy file
+
+    csv_file : str
+        Path of the CSV file
+
+    header : list, optional
+        Names of the columns
+
+    chunk_size : scalar
+        Number of rows converted at once
+
+    progress : callable, optional
+        Function called with the number of rows converted so far
+    """
+    data = np.load(npy_file, mmap_mode="r")
+
+    with open(csv_file, "w") as f:
+        if header:
+            f.write(",".join(header) + "\n")
+        for start in range(0, len(data), chunk_size):
+            np.savetxt(f, data[start : start + chunk_size], delimiter=",", fmt="%.6e")
+            if progress is not None:
+                progress(min(start + chunk_size, len(data)))
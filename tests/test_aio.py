@@ -0,0 +1,67 @@
+import asyncio
+import socket
+import time
+
+import pytest
+from PyQt5.QtCore import QCoreApplication
+
+# The decoder is built from the oCPPmfet submodule
+if not hasattr(pytest.importorskip("oCPPmfet"), "Converter"):
+    pytest.skip("oCPPmfet is not built", allow_module_level=True)
+
+from ocmfet_client.network.aio import AsyncMsgDataClient, LoopThread  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QCoreApplication.instance() or QCoreApplication([])
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(("", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def client(app):
+    thread = LoopThread()
+    thread.start()
+    # The client listens on the message port it sends to, so each command is echoed back
+    client = AsyncMsgDataClient("127.0.0.1", free_port(), free_port(), loop=thread.loop)
+    client.commands.timeout = 0.1
+    client.start_listening()
+    yield client
+    client.close()
+    thread.stop()
+
+
+def run(app, client, coro, timeout=2.0):
+    """Run a coroutine on the loop thread while the Qt events are processed."""
+    future = asyncio.run_coroutine_threadsafe(coro, client.loop)
+    t_start = time.perf_counter()
+    while not future.done() and time.perf_counter() - t_start < timeout:
+        app.processEvents()
+        time.sleep(0.001)
+    return future.result(0)
+
+
+def test_command_resolved_by_tracker(app, client):
+    async def ping():
+        return await client.command("ping")
+
+    assert run(app, client, ping()) == "ping"
+    assert client.commands.stats()["ping"]["confirmed"] == 1
+    assert client.futures == {}
+
+
+def test_command_timeout(app, client):
+    client.msg_listener.stop_listening()
+
+    async def ping():
+        with pytest.raises(asyncio.TimeoutError):
+            await client.command("ping")
+        return True
+
+    assert run(app, client, ping())
+    assert client.commands.stats()["ping"]["timeouts"] == 1
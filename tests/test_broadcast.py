@@ -0,0 +1,60 @@
+import time
+
+import numpy as np
+import pytest
+
+from ocmfet_client.network.broadcast import (
+    DATA,
+    INFO,
+    BroadcastClient,
+    BroadcastServer,
+)
+
+N_CHANNELS = 4
+
+
+@pytest.fixture
+def server():
+    server = BroadcastServer(0, N_CHANNELS, 10, host="127.0.0.1")
+    yield server
+    server.close()
+
+
+def test_invalid_requests(server):
+    client = BroadcastClient("127.0.0.1", server.port)
+    for request in [
+        {"channels": [N_CHANNELS]},
+        {"channels": [-1]},
+        {"channels": []},
+        {"channels": "0"},
+        {"decimate": 0},
+        {"decimate": "10"},
+        {"decimate": True},
+        {"channels": [False]},
+    ]:
+        with pytest.raises(ValueError):
+            client.request(**request)
+        assert client.info["channels"] == server.channels
+
+    # The subscriber is still connected, with its configuration
+    client.request(decimate=2, channels=[1, 3])
+    assert client.info["decimate"] == 2
+    assert "error" not in client.info
+    client.close()
+
+
+def test_malformed_request(server):
+    client = BroadcastClient("127.0.0.1", server.port)
+    for line in [b"{not json\n", b"[1, 2]\n"]:
+        client.socket.sendall(line)
+        assert client.read_frame()[0] == INFO
+        assert "error" in client.info
+
+    # Wait for the subscriber to be registered before writing
+    while not server.subscribers:
+        time.sleep(0.01)
+    server.write(np.arange(8 * N_CHANNELS, dtype=float))
+    kind, index, data = client.read_frame()
+    assert kind == DATA
+    assert data.shape == (N_CHANNELS, 8)
+    client.close()
@@ -0,0 +1,55 @@
+import time
+
+import pytest
+from PyQt5.QtCore import QCoreApplication
+
+from ocmfet_client.network.commands import CommandTracker
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QCoreApplication.instance() or QCoreApplication([])
+
+
+def make_tracker(use_ids):
+    sent = []
+    tracker = CommandTracker(sent.append, timeout=0.01, retries=2, use_ids=use_ids)
+    tracker.timer.stop()  # The timeouts are checked by the tests
+    return tracker, sent
+
+
+def expire(tracker):
+    time.sleep(0.02)
+    tracker.check_timeouts()
+
+
+def test_fifo_commands_are_not_retransmitted(app):
+    tracker, sent = make_tracker(use_ids=False)
+    failed = []
+    tracker.failed.connect(failed.append)
+
+    first = tracker.send("vg01 0.50")
+    second = tracker.send("vg02 0.50")
+    expire(tracker)
+    assert sent == ["vg01 0.50", "vg02 0.50"]
+    assert [c["id"] for c in failed] == [first["id"], second["id"]]
+
+    # The failed commands are not matched to the following replies
+    third = tracker.send("vg03 0.50")
+    tracker.handle_reply("ok")
+    assert third["status"] == "confirmed"
+    assert tracker.pending == {}
+
+
+def test_id_commands_are_retried(app):
+    tracker, sent = make_tracker(use_ids=True)
+    command = tracker.send("vg01 0.50")
+    toggle = tracker.send("rec", retries=0)
+    expire(tracker)
+    assert sent == ["@1 vg01 0.50", "@2 rec", "@1 vg01 0.50"]
+    assert toggle["status"] == "failed"
+
+    tracker.handle_reply("@1 ok")
+    assert command["status"] == "confirmed"
+    assert command["reply"] == "ok"
+    assert command["attempts"] == 2
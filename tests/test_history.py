@@ -0,0 +1,61 @@
+import threading
+
+import numpy as np
+
+from ocmfet_client.utils.history import TieredHistory
+
+FS = 5  # kHz
+
+
+def expected(t, channel):
+    """Value of the samples written by write_ramp (2 channels)."""
+    return 2 * np.round(t * FS * 1e3) + channel
+
+
+def write_ramp(history, seconds, n_chunks=1000):
+    for chunk in np.array_split(
+        np.arange(FS * 1000 * seconds * 2, dtype=float), n_chunks
+    ):
+        history.write(chunk)
+
+
+def test_read_while_writing():
+    # A ring of 10 s, overwritten while it is read
+    history = TieredHistory(2, FS, hours=10 / 3600, decimation=16)
+    errors = []
+    done = threading.Event()
+
+    def reader():
+        while not done.is_set():
+            end = history.end
+            t, data = history.read(end - 11, end, n_points=10**9)
+            valid = ~np.isnan(data[0])
+            if not np.array_equal(data[0, valid], expected(t[valid], 0)):
+                errors.append((end, t[0]))
+
+    thread = threading.Thread(target=reader)
+    thread.start()
+    write_ramp(history, 30)
+    assert history.flush(5)
+    done.set()
+    thread.join()
+    assert errors == []
+
+    assert history.end == 30
+    assert history.start == 20
+    t, data = history.read(history.end - 1, history.end, n_points=10**9)
+    assert np.array_equal(data[1], expected(t, 1))
+    history.close()
+
+
+def test_envelope():
+    history = TieredHistory(2, FS, hours=10 / 3600, decimation=16)
+    write_ramp(history, 5)
+    assert history.flush(5)
+
+    t, data = history.read(0, 5, n_points=2000)
+    assert 1000 <= len(t) < 4000
+    # Minimum at the start of each bin, maximum at the end
+    assert np.array_equal(data[0, 0::2], expected(t[0::2], 0))
+    assert np.all(data[0, 1::2] > data[0, 0::2])
+    history.close()
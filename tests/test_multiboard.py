@@ -0,0 +1,149 @@
+import numpy as np
+import pytest
+from PyQt5.QtCore import QCoreApplication, QObject, pyqtSignal
+
+from ocmfet_client.network import multiboard
+from ocmfet_client.network.commands import CommandTracker
+from ocmfet_client.network.multiboard import BoardMerger, MultiBoardClient
+
+
+@pytest.fixture(scope="module")
+def app():
+    return QCoreApplication.instance() or QCoreApplication([])
+
+
+class Clock:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(multiboard.time, "monotonic", clock)
+    return clock
+
+
+class FakeListener:
+    def add_sink(self, sink):
+        self.sink = sink
+
+    def set_bytes_to_emit(self, n_bytes):
+        pass
+
+    def start_listening(self):
+        pass
+
+    def stop_listening(self):
+        pass
+
+
+class FakeMessages(QObject):
+    received_msg = pyqtSignal(str)
+    received_json = pyqtSignal(object)
+
+
+class FakeClient:
+    """MsgDataClient of a board, recording the messages sent."""
+
+    def __init__(self, host, msg_port, data_port, *args):
+        self.host, self.msg_port, self.data_port = host, msg_port, data_port
+        self.data_listener = FakeListener()
+        self.msg_listener = FakeMessages()
+        self.sent = []
+        self.commands = CommandTracker(self.sent.append)
+
+    def send_message(self, msg):
+        self.sent.append(msg)
+
+    def close(self):
+        self.commands.timer.stop()
+
+
+def board_samples(first, m, sign):
+    """m samples of 2 channels, the value is the index of the sample (and a half)."""
+    i = np.arange(first, first + m)
+    return (sign * np.stack([i, i + 0.5], axis=1)).ravel()
+
+
+def make_merger(app):
+    # 1 kHz, 2 boards of 2 channels, 10 samples per merged chunk
+    return BoardMerger(
+        [FakeListener(), FakeListener()], [2, 2], ["b1", "b2"], 1, 80, max_skew=0.1
+    )
+
+
+def test_alignment(app, clock):
+    merger = make_merger(app)
+    # The first block of b2 arrives 5 ms later, so b1 started 5 samples earlier
+    clock.t = 1.0
+    merger.push(0, board_samples(0, 20, 1))
+    clock.t = 1.005
+    merger.push(1, board_samples(0, 20, -1))
+
+    data = merger.merge().reshape(-1, 4)
+    assert len(data) == 15
+    assert np.array_equal(data[:, 0], np.arange(5, 20))
+    assert np.array_equal(data[:, 1], np.arange(5, 20) + 0.5)
+    assert np.array_equal(data[:, 2], -np.arange(15))
+    assert merger.merge() is None  # b1 has no samples left
+
+
+def test_padding_after_stall(app, clock):
+    merger = make_merger(app)
+    clock.t = 1.0
+    merger.push(0, board_samples(0, 20, 1))
+    merger.push(1, board_samples(0, 20, -1))
+    merger.merge()
+
+    # b2 stalls for more than max_skew, b1 goes on
+    clock.t = 1.1
+    merger.push(0, board_samples(20, 100, 1))
+    clock.t = 1.2
+    data = merger.merge().reshape(-1, 4)
+    assert len(data) == 100
+    assert np.array_equal(data[:, 0], np.arange(20, 120))
+    # b2 holds its last sample, the filters downstream only see finite values
+    assert np.all(np.isfinite(data))
+    assert np.all(data[:, 2] == -19)
+    stats = merger.stats()["b2"]
+    assert stats["padded"] == 100
+    assert stats["gaps"] == 1
+
+
+@pytest.fixture
+def client(app, monkeypatch):
+    monkeypatch.setattr(multiboard, "MsgDataClient", FakeClient)
+    boards = [
+        {
+            "name": name,
+            "server_ip": "127.0.0.1",
+            "msg_port": 0,
+            "data_port": 0,
+            "n_channels": 16,
+        }
+        for name in ("b1", "b2")
+    ]
+    client = MultiBoardClient(boards, 1, 32, batch_separator=";")
+    yield client
+    client.close()
+
+
+def test_routing(client):
+    assert client.route("vg05 0.50") == [(0, "vg05 0.50")]
+    assert client.route("vg17 0.50") == [(1, "vg01 0.50")]
+    assert client.route("b2: info") == [(1, "info")]
+    assert client.route("getf data.bin") == [(0, "getf data.bin")]
+    assert client.route("start") == [(0, "start"), (1, "start")]
+
+
+def test_batched_routing(client):
+    assert client.route("vg01 0.50;vg17 0.50;vg02 0.50") == [
+        (0, "vg01 0.50;vg02 0.50"),
+        (1, "vg01 0.50"),
+    ]
+    client.commands.send("vg16 1.00;vg32 1.00")
+    assert [c.sent for c in client.clients] == [["vg16 1.00"], ["vg16 1.00"]]
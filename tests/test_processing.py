@@ -0,0 +1,43 @@
+import tracemalloc
+
+import numpy as np
+import pytest
+
+from ocmfet_client.utils.memory import MemoryBudget
+from ocmfet_client.utils.processing import DataProcessor
+
+N_CHANNELS = 8
+FS = 50  # kHz
+
+
+@pytest.mark.parametrize("dtype", ["float64", "int16"])
+def test_resize_keeps_recent_samples(dtype):
+    processor = DataProcessor(N_CHANNELS, FS, 4, dtype=dtype)
+    processor.update_data(np.random.randn(N_CHANNELS * processor.max_samples) * 1e-3)
+    recent = processor.get_recent(1000)
+
+    processor.change_max_time(2)
+    assert processor.size == processor.max_samples == 2 * FS * 1000
+    assert np.allclose(processor.get_recent(1000), recent)
+
+
+def test_resize_peak_memory():
+    budget = MemoryBudget()
+    budget.configure({"memory_budget": 100, "memory_policy": "degrade"})
+    processor = DataProcessor(N_CHANNELS, FS, 15, budget=budget)  # 48 MB ring
+    processor.update_data(np.random.randn(N_CHANNELS * processor.max_samples))
+
+    # The new ring and the samples kept, not the old ring nor a calibrated copy of it
+    tracemalloc.start()
+    processor.change_max_time(10)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak < 2.2 * processor.data.nbytes
+
+    # Without samples to keep, only the new ring is allocated
+    processor.clear_data()
+    tracemalloc.start()
+    processor.change_max_time(12)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert peak < 1.2 * processor.data.nbytes
@@ -0,0 +1,67 @@
+import io
+import os
+import sys
+
+import pytest
+
+import ocmfet_client
+from ocmfet_client.utils.startup import (
+    measure_startup,
+    parse_importtime,
+    profile_startup,
+)
+
+SPLASH_BUDGET = 2000  # ms, generous for the CI machines
+# Modules imported when a window needs them, not before the splash
+HEAVY_MODULES = ("pyqtgraph", "scipy", "matplotlib")
+
+IMPORTTIME = """\
+import time: self [us] | cumulative | imported package
+import time:       150 |        150 |   _io
+import time:       320 |        470 | io
+import time:       200 |        200 |     PyQt5.sip
+import time:      1000 |       1200 |   PyQt5.QtCore
+import time:     23100 |      67500 | PyQt5.QtWidgets
+SPLASH 136.900
+"""
+
+
+@pytest.fixture
+def child_path(monkeypatch):
+    """Make the package importable by the interpreter started by the profiler."""
+    src = os.path.dirname(os.path.dirname(ocmfet_client.__file__))
+    path = [src] + [p for p in [os.environ.get("PYTHONPATH")] if p]
+    monkeypatch.setenv("PYTHONPATH", os.pathsep.join(path))
+    monkeypatch.setenv("QT_QPA_PLATFORM", "offscreen")
+
+
+def test_parse_importtime():
+    assert parse_importtime(IMPORTTIME) == [
+        ("_io", 0.15, 0.15, 1),
+        ("io", 0.32, 0.47, 0),
+        ("PyQt5.sip", 0.2, 0.2, 2),
+        ("PyQt5.QtCore", 1.0, 1.2, 1),
+        ("PyQt5.QtWidgets", 23.1, 67.5, 0),
+    ]
+
+
+def test_no_heavy_imports_before_splash(child_path):
+    splash, total, imports = measure_startup()
+    assert 0 < splash <= total
+    heavy = [m for m, *_ in imports if m.split(".")[0] in HEAVY_MODULES]
+    assert heavy == []
+
+
+def test_time_to_splash(child_path):
+    report = io.StringIO()
+    assert profile_startup(budget=SPLASH_BUDGET, file=report) == 0, report.getvalue()
+    assert "Time to splash" in report.getvalue()
+
+
+@pytest.mark.parametrize("argv", [["--budget"], ["--budget", "fast"]])
+def test_budget_usage_error(monkeypatch, capsys, argv):
+    monkeypatch.setattr(sys, "argv", ["ocmfet_client", "--profile-startup"] + argv)
+    with pytest.raises(SystemExit) as exit_info:
+        ocmfet_client.cli()
+    assert exit_info.value.code == 2
+    assert "usage" in capsys.readouterr().err
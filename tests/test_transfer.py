@@ -0,0 +1,115 @@
+import os
+import zlib
+
+import pytest
+
+from ocmfet_client.network.simulator import ServerSimulator
+from ocmfet_client.network.transfer import BlockTransfer, TransferQueue
+
+BLOCK_SIZE = 1024
+
+
+@pytest.fixture
+def served(tmp_path):
+    """A file of about 300 blocks in the served folder."""
+    root = tmp_path / "server"
+    root.mkdir()
+    data = os.urandom(300 * BLOCK_SIZE + 123)
+    (root / "data.bin").write_bytes(data)
+    return root, data
+
+
+def run_transfer(simulator, data, file, **kwargs):
+    transfer = BlockTransfer(
+        "127.0.0.1",
+        simulator.port,
+        "data.bin",
+        len(data),
+        str(file),
+        block_size=BLOCK_SIZE,
+        window=32,
+        timeout=0.05,
+        **kwargs,
+    )
+    return transfer.run()
+
+
+def test_lossy_transfer(served, tmp_path):
+    root, data = served
+    simulator = ServerSimulator(str(root), loss=0.1, reorder=0.1, seed=1)
+    simulator.start()
+    try:
+        stats = run_transfer(simulator, data, tmp_path / "data.bin")
+    finally:
+        simulator.stop()
+
+    assert (tmp_path / "data.bin").read_bytes() == data
+    assert stats["crc"] == f"{zlib.crc32(data):08x}"
+    assert simulator.dropped > 0
+    assert stats["rerequests"] > 0
+
+
+def test_resume_transfer(served, tmp_path):
+    root, data = served
+    first_block = 100
+    file = tmp_path / "data.bin"
+    # Partial download: the first blocks are already in the local file
+    file.write_bytes(data[: first_block * BLOCK_SIZE])
+
+    simulator = ServerSimulator(str(root), loss=0.1, reorder=0.1, seed=2)
+    simulator.start()
+    try:
+        stats = run_transfer(simulator, data, file, first_block=first_block)
+    finally:
+        simulator.stop()
+
+    assert file.read_bytes() == data
+    assert stats["crc"] == f"{zlib.crc32(data):08x}"
+    # Only the bytes of this run are counted in the throughput
+    assert stats["transferred"] == len(data) - first_block * BLOCK_SIZE
+    assert stats["throughput"] == pytest.approx(stats["transferred"] / stats["elapsed"])
+
+
+class ShortReplySimulator(ServerSimulator):
+    """Simulator sending a truncated datagram before the CRC."""
+
+    def handle(self, args, addr):
+        if args and args[0] == "crcf":
+            self.socket.sendto(b"C", addr)
+        super().handle(args, addr)
+
+
+def test_verify_ignores_short_datagrams(served, tmp_path):
+    root, data = served
+    simulator = ShortReplySimulator(str(root), seed=3)
+    simulator.start()
+    try:
+        stats = run_transfer(simulator, data, tmp_path / "data.bin")
+    finally:
+        simulator.stop()
+
+    assert stats["crc"] == f"{zlib.crc32(data):08x}"
+
+
+class CancellingQueue(TransferQueue):
+    """Queue cancelled while a job reads its checkpoint, before it starts running."""
+
+    def load_checkpoint(self, job):
+        self.cancel()
+        return super().load_checkpoint(job)
+
+
+def test_cancel_before_running(served, tmp_path):
+    root, data = served
+    simulator = ServerSimulator(str(root), seed=4)
+    simulator.start()
+    queue = CancellingQueue("127.0.0.1", simulator.port, block_size=BLOCK_SIZE)
+    try:
+        job = queue.add("data.bin", len(data), str(tmp_path / "data.bin"))
+        queue.executor.shutdown(wait=True)
+    finally:
+        simulator.stop()
+
+    assert job["status"] == "cancelled"
+    assert job["transfer"] is None
+    assert not (tmp_path / "data.bin").exists()